@@ -0,0 +1,443 @@
+"""
+知识图谱前端渲染基准测试
+在本地无界面浏览器中加载学生端/管理端实际生成的图谱HTML，对不同规模的合成图谱测量：
+可交互时间、物理稳定耗时、每次点击高亮的耗时和JS堆内存。
+--cold-start 时改为启动全新的 streamlit 进程，测量部署/扩容后学生端的首屏时间（TTFP）。
+
+依赖（可选，仅基准测试需要）：
+    pip install playwright && playwright install chromium
+
+运行：
+    python bench_graph_render.py
+    python bench_graph_render.py --sizes 100 1000 5000 --clicks 30 --output bench.json
+    python bench_graph_render.py --cold-start --runs 5 --output ttfp.json
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import random
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+import xjygraph as graph
+
+# ==================== 配置区 ====================
+DEFAULT_SIZES = [50, 200, 1000, 3000]  # 合成图谱的节点数
+DEFAULT_CLICKS = 20  # 每个图谱模拟点击的节点数
+EDGES_PER_NODE = 2  # 每个节点平均新增的关系数
+PAGE_TIMEOUT_MS = 120000  # 单个页面等待可交互/稳定的超时（毫秒）
+COLD_START_RUNS = 5  # 冷启动测量的重复次数（每次都是新进程和新的浏览器上下文）
+COLD_START_STUDENT = "bench"  # 冷启动测量时登录学生端使用的学号
+BENCH_ORIGIN = "http://bench.localhost"  # 页面所在的虚拟源（请求全部由本脚本拦截应答，不访问网络）
+MODES = {
+    "pyvis": "管理端pyvis页面（内嵌数据）",
+    "full": "学生端首次加载（发送全量数据）",
+    "cached": "学生端再次加载（IndexedDB缓存和布局）"
+}
+
+# 本地静态资源：pyvis页面模板中引用的CDN地址改由仓库中的文件应答（学生端页面自带vis，不发请求）
+LOCAL_ASSETS = {
+    "https://cdnjs.cloudflare.com/ajax/libs/vis-network/9.1.2/dist/vis-network.min.js": os.path.join(graph.VIS_NETWORK_DIR, "vis-network.min.js"),
+    "https://cdnjs.cloudflare.com/ajax/libs/vis-network/9.1.2/dist/dist/vis-network.min.css": os.path.join(graph.VIS_NETWORK_DIR, "vis-network.css"),
+    f"{BENCH_ORIGIN}/lib/bindings/utils.js": os.path.join(graph.current_dir, "lib", "bindings", "utils.js")
+}
+
+# 页面脚本执行前注入：包装 vis.Network 记录构造和稳定时间，以及页面绑定点击处理函数（可交互）的时刻
+INSTRUMENT_JS = """
+(function() {
+    var bench = window.__bench = {start: performance.now()};
+    var visObject;
+    function wrapNetwork(Original) {
+        function BenchNetwork(container, data, options) {
+            var before = performance.now();
+            var network = new Original(container, data, options);
+            bench.constructed = performance.now();
+            bench.constructMs = bench.constructed - before;
+            window.__benchNetwork = network;
+            // 页面给网络绑定click处理函数时即可响应点击，不依赖页面脚本中的全局变量
+            var on = network.on;
+            network.on = function(event) {
+                if (event === 'click' && bench.interactive === undefined) bench.interactive = performance.now();
+                return on.apply(this, arguments);
+            };
+            var physics = (options && options.physics) || {};
+            if (physics.enabled === false || (physics.stabilization && physics.stabilization.enabled === false)) {
+                bench.stabilized = bench.constructed;
+            }
+            network.once('afterDrawing', function() { bench.painted = performance.now(); });
+            var done = function() { if (bench.stabilized === undefined) bench.stabilized = performance.now(); };
+            network.once('stabilizationIterationsDone', done);
+            network.once('stabilized', done);
+            return network;
+        }
+        BenchNetwork.prototype = Original.prototype;
+        return BenchNetwork;
+    }
+    // vis-network 的UMD包先创建 window.vis 对象，再给它逐个赋值导出项
+    Object.defineProperty(window, 'vis', {
+        configurable: true,
+        get: function() { return visObject; },
+        set: function(value) {
+            visObject = value;
+            var network;
+            Object.defineProperty(value, 'Network', {
+                configurable: true,
+                enumerable: true,
+                get: function() { return network; },
+                set: function(Original) { network = wrapNetwork(Original); }
+            });
+        }
+    });
+})();
+"""
+
+# 模拟点击一个节点：触发图谱页实际绑定的click处理函数，分别记录同步耗时和到下一帧绘制完成的耗时
+CLICK_JS = """
+(nodeId) => new Promise((resolve) => {
+    var network = window.__benchNetwork;
+    var before = performance.now();
+    network.body.emitter.emit('click', {nodes: [nodeId], edges: [], event: {}, pointer: {}});
+    var handled = performance.now();
+    requestAnimationFrame(function() {
+        requestAnimationFrame(function() {
+            resolve({handlerMs: handled - before, paintMs: performance.now() - before});
+        });
+    });
+})
+"""
+
+# ==================== 合成图谱 ====================
+def make_synthetic_graph(node_count, edges_per_node=EDGES_PER_NODE, seed=0):
+    """生成与真实数据结构一致的合成图谱：层级越低的节点越多，新节点优先连向关联多的旧节点"""
+    rng = random.Random(seed)
+    categories = list(graph.CATEGORY_COLORS)
+    nodes = []
+    relationships = []
+    endpoints = []  # 按关联数加权抽样
+    for i in range(node_count):
+        node_id = f"n{i}"
+        nodes.append({
+            "id": node_id,
+            "label": f"节点{i}",
+            "category": categories[i % len(categories)],
+            "level": min(4, 1 + int(rng.random() * 4 * i / max(node_count, 1))),
+            "type": "合成",
+            "properties": {"说明": f"合成节点 {i}", "序号": str(i)}
+        })
+        if i == 0:
+            endpoints.append(node_id)
+            continue
+        for target in {rng.choice(endpoints) for _ in range(rng.randint(1, 2 * edges_per_node - 1))}:
+            relationships.append({"source": node_id, "target": target, "type": "关联", "properties": {}})
+            endpoints.append(target)
+        endpoints.append(node_id)
+    json_data, _, _ = graph.validate_graph({"nodes": nodes, "relationships": relationships})
+    return json_data
+
+def build_pages(json_data):
+    """按应用中的同一套函数生成三种页面的HTML"""
+    raw = json.dumps(json_data, ensure_ascii=False).encode("utf-8")
+    version = hashlib.sha1(raw).hexdigest()[:16]
+    nodes_json, edges_json = graph.serialize_graph_payload(json_data)
+    payload = graph.build_client_payload(json_data, version)
+    # pyvis模板给CDN脚本加了 integrity 校验，本地应答的同版本文件构建不同，去掉校验后才能加载
+    pyvis_html = re.sub(r'\s(?:integrity|crossorigin)="[^"]*"', "", graph.render_graph_html(json_data))
+    return {
+        "pyvis": graph.inject_click_handler(pyvis_html, nodes_json, edges_json),
+        "full": graph.build_cached_graph_page({"mode": "full", "version": version, "payload": payload}),
+        "cached": graph.build_cached_graph_page({"mode": "cached", "version": version}, with_vis=False)
+    }
+
+# ==================== 浏览器测量 ====================
+def serve_routes(page):
+    """拦截页面发出的全部请求：图谱页和静态资源从内存/本地文件应答，其余（如外部CDN样式）返回404"""
+    current = {"html": ""}
+
+    def handle(route):
+        url = route.request.url
+        headers = {"Access-Control-Allow-Origin": "*"}
+        if url.startswith(f"{BENCH_ORIGIN}/graph.html"):
+            route.fulfill(status=200, body=current["html"], content_type="text/html; charset=utf-8", headers=headers)
+        elif url in LOCAL_ASSETS and os.path.exists(LOCAL_ASSETS[url]):
+            content_type = "text/css" if url.endswith(".css") else "application/javascript"
+            with open(LOCAL_ASSETS[url], 'rb') as f:
+                route.fulfill(status=200, body=f.read(), content_type=content_type, headers=headers)
+        else:
+            route.fulfill(status=404, body="", headers=headers)
+
+    page.route("**/*", handle)
+    return current
+
+def js_heap_mb(page, cdp):
+    """强制GC后的JS堆占用（MB）；非Chromium浏览器返回None"""
+    if cdp is None:
+        return None
+    cdp.send("HeapProfiler.collectGarbage")
+    metrics = {item["name"]: item["value"] for item in cdp.send("Performance.getMetrics")["metrics"]}
+    return round(metrics.get("JSHeapUsedSize", 0) / 1024 / 1024, 1)
+
+def measure_page(page, cdp, current, html, node_ids, clicks, rng):
+    """加载一个图谱页面并测量，返回本次的各项指标"""
+    current["html"] = html
+    started = time.perf_counter()
+    page.goto(f"{BENCH_ORIGIN}/graph.html", wait_until="load")
+    page.wait_for_function("window.__bench && window.__bench.interactive !== undefined", timeout=PAGE_TIMEOUT_MS)
+    page.wait_for_function("window.__bench.stabilized !== undefined", timeout=PAGE_TIMEOUT_MS)
+    wall_ms = (time.perf_counter() - started) * 1000
+    bench = page.evaluate("window.__bench")
+    heap_loaded = js_heap_mb(page, cdp)
+
+    samples = [page.evaluate(CLICK_JS, node_id) for node_id in rng.sample(node_ids, min(clicks, len(node_ids)))]
+    handler_ms = [sample["handlerMs"] for sample in samples]
+    paint_ms = [sample["paintMs"] for sample in samples]
+    return {
+        "first_paint_ms": round(bench["painted"] - bench["start"], 1) if "painted" in bench else None,
+        "interactive_ms": round(bench["interactive"] - bench["start"], 1),
+        "construct_ms": round(bench.get("constructMs", 0), 1),
+        "stabilize_ms": round(bench["stabilized"] - bench["constructed"], 1) if "constructed" in bench else None,
+        "load_wall_ms": round(wall_ms, 1),
+        "click_handler_p50_ms": round(statistics.median(handler_ms), 2) if handler_ms else None,
+        "click_handler_max_ms": round(max(handler_ms), 2) if handler_ms else None,
+        "click_paint_p50_ms": round(statistics.median(paint_ms), 2) if paint_ms else None,
+        "click_paint_p95_ms": round(sorted(paint_ms)[min(len(paint_ms) - 1, int(len(paint_ms) * 0.95))], 2) if paint_ms else None,
+        "heap_loaded_mb": heap_loaded,
+        "heap_after_clicks_mb": js_heap_mb(page, cdp)
+    }
+
+def run_benchmark(sizes, clicks, modes, browser_name="chromium", headed=False, seed=0, executable=None):
+    """对每种规模的合成图谱依次测量各页面模式，返回结果列表"""
+    try:
+        from playwright.sync_api import sync_playwright
+    except ImportError:
+        print("❌ 缺少可选依赖 playwright，请先执行: pip install playwright && playwright install chromium")
+        sys.exit(1)
+
+    results = []
+    with sync_playwright() as p:
+        browser = getattr(p, browser_name).launch(headless=not headed, executable_path=executable)
+        try:
+            for size in sizes:
+                json_data = make_synthetic_graph(size, seed=seed)
+                t0 = time.perf_counter()
+                pages = build_pages(json_data)
+                build_ms = round((time.perf_counter() - t0) * 1000, 1)
+                node_ids = [node["id"] for node in json_data["nodes"]]
+
+                # 每种规模一个独立的浏览器上下文：cached 模式复用同一上下文中 full 模式写入的IndexedDB
+                context = browser.new_context(viewport={"width": 1400, "height": 1000})
+                page = context.new_page()
+                page.add_init_script(INSTRUMENT_JS)
+                cdp = context.new_cdp_session(page) if browser_name == "chromium" else None
+                if cdp is not None:
+                    cdp.send("Performance.enable")
+                current = serve_routes(page)
+                try:
+                    for mode in modes:
+                        if mode == "cached" and "full" not in modes:
+                            measure_page(page, cdp, current, pages["full"], node_ids, 0, random.Random(seed))
+                        row = {"nodes": size, "edges": len(json_data["relationships"]), "mode": mode, "build_ms": build_ms}
+                        try:
+                            row.update(measure_page(page, cdp, current, pages[mode], node_ids, clicks, random.Random(seed)))
+                        except Exception as e:
+                            row["error"] = str(e).splitlines()[0]
+                        results.append(row)
+                        print_row(row)
+                finally:
+                    context.close()
+        finally:
+            browser.close()
+    return results
+
+# ==================== 冷启动首屏 ====================
+# 学生端图谱iframe的状态：null 尚未收到，delivered 已收到页面，painted 图谱已完成首次绘制（INSTRUMENT_JS 记录）
+GRAPH_FRAME_STATE_JS = """
+() => {
+    if (!document.getElementById('mynetwork')) return null;
+    return window.__bench && window.__bench.painted !== undefined ? 'painted' : 'delivered';
+}
+"""
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def graph_frame_state(page):
+    """在页面的各个iframe中查找学生端图谱，返回最靠后的状态"""
+    state = None
+    for frame in page.frames:
+        try:
+            frame_state = frame.evaluate(GRAPH_FRAME_STATE_JS)
+        except Exception:
+            continue  # iframe 在查找期间被替换
+        if frame_state == "painted":
+            return "painted"
+        state = frame_state or state
+    return state
+
+def measure_cold_start(context, app_path, port):
+    """启动全新的 streamlit 进程并在给定的浏览器上下文中打开学生端，依次记录（毫秒，从启动进程起）：
+    服务可访问、登录表单显示（首次运行完成）、登录后图谱页面送达、图谱画布首次绘制"""
+    import urllib.request
+
+    command = [sys.executable, "-m", "streamlit", "run", app_path, "--server.headless", "true",
+               "--server.port", str(port), "--browser.gatherUsageStats", "false"]
+    started = time.perf_counter()
+    elapsed = lambda: round((time.perf_counter() - started) * 1000, 1)
+    process = subprocess.Popen(command, cwd=os.path.dirname(os.path.abspath(app_path)),
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    row = {"app": app_path}
+    page = None
+    try:
+        deadline = time.perf_counter() + PAGE_TIMEOUT_MS / 1000
+        while True:
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/_stcore/health", timeout=1):
+                    break
+            except OSError:
+                if time.perf_counter() > deadline or process.poll() is not None:
+                    raise TimeoutError("streamlit 服务未能启动")
+                time.sleep(0.02)
+        row["server_ready_ms"] = elapsed()
+
+        page = context.new_page()
+        page.add_init_script(INSTRUMENT_JS)  # 对页面中的每个iframe都生效
+        # 外部请求一律返回404，结果不受网络影响（学生端图谱页面自带vis脚本，不依赖外网）
+        page.route("https://**/*", lambda route: route.fulfill(status=404, body=""))
+        page.goto(f"http://127.0.0.1:{port}/")
+        login = page.get_by_label("学号或姓名")
+        login.wait_for(timeout=PAGE_TIMEOUT_MS)
+        row["login_form_ms"] = elapsed()
+        login.fill(COLD_START_STUDENT)
+        page.get_by_role("button", name="确认登录").click()
+        clicked = time.perf_counter()
+
+        while time.perf_counter() < deadline:
+            state = graph_frame_state(page)
+            if state and "graph_delivered_ms" not in row:
+                row["graph_delivered_ms"] = elapsed()
+            if state == "painted":
+                row["graph_painted_ms"] = elapsed()
+                break
+            time.sleep(0.02)
+        row["login_to_paint_ms"] = round((time.perf_counter() - clicked) * 1000, 1) if "graph_painted_ms" in row else None
+    except Exception as e:
+        row["error"] = str(e).splitlines()[0]
+    finally:
+        if page is not None:
+            page.close()
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+    return row
+
+COLD_START_COLUMNS = [
+    ("server_ready_ms", "服务就绪ms"), ("login_form_ms", "首屏(登录表单)ms"),
+    ("graph_delivered_ms", "图谱送达ms"), ("graph_painted_ms", "图谱首次绘制ms"), ("login_to_paint_ms", "登录到绘制ms")
+]
+
+def summarize_cold_start(rows):
+    """各阶段取中位数"""
+    ok = [row for row in rows if "error" not in row]
+    return {
+        key: round(statistics.median(row[key] for row in ok if row.get(key) is not None), 1)
+        if any(row.get(key) is not None for row in ok) else None
+        for key, _ in COLD_START_COLUMNS
+    }
+
+def run_cold_start(app_path, runs, browser_name="chromium", headed=False, executable=None, warm_browser=False):
+    """重复测量冷启动首屏，返回每次的结果和中位数。
+    warm_browser 时各次共用同一个浏览器上下文和端口（模拟部署后回来的学生，浏览器中已有图谱缓存），
+    第一次只用于写入缓存，不计入中位数"""
+    try:
+        from playwright.sync_api import sync_playwright
+    except ImportError:
+        print("❌ 缺少可选依赖 playwright，请先执行: pip install playwright && playwright install chromium")
+        sys.exit(1)
+
+    rows = []
+    port = free_port()
+    with sync_playwright() as p:
+        browser = getattr(p, browser_name).launch(headless=not headed, executable_path=executable)
+        shared = browser.new_context(viewport={"width": 1400, "height": 1000}) if warm_browser else None
+        try:
+            for index in range(runs + 1 if warm_browser else runs):
+                context = shared or browser.new_context(viewport={"width": 1400, "height": 1000})
+                try:
+                    row = measure_cold_start(context, app_path, port)
+                finally:
+                    if shared is None:
+                        context.close()
+                if warm_browser and index == 0:
+                    print(f"  0 预热浏览器缓存: " + ("❌ " + row["error"] if "error" in row else f"图谱首次绘制ms={row.get('graph_painted_ms')}"))
+                    continue
+                rows.append(row)
+                if "error" in row:
+                    print(f"{len(rows):>3} ❌ {row['error']}")
+                else:
+                    print(f"{len(rows):>3} " + "  ".join(f"{label}={row.get(key)}" for key, label in COLD_START_COLUMNS))
+        finally:
+            browser.close()
+    summary = summarize_cold_start(rows)
+    print("中位数 " + "  ".join(f"{label}={summary[key]}" for key, label in COLD_START_COLUMNS))
+    return {"warm_browser": warm_browser, "runs": rows, "median": summary}
+
+# ==================== 输出 ====================
+REPORT_COLUMNS = [
+    ("nodes", "节点"), ("edges", "关系"), ("mode", "模式"), ("first_paint_ms", "首次绘制ms"), ("interactive_ms", "可交互ms"),
+    ("stabilize_ms", "稳定ms"), ("click_handler_p50_ms", "点击处理p50"), ("click_paint_p50_ms", "点击到绘制p50"),
+    ("click_paint_p95_ms", "点击到绘制p95"), ("heap_loaded_mb", "堆MB"), ("heap_after_clicks_mb", "点击后堆MB")
+]
+
+def print_row(row):
+    if "error" in row:
+        print(f"{row['nodes']:>6} {row['mode']:<7} ❌ {row['error']}")
+        return
+    print("  ".join(f"{label}={row.get(key)}" for key, label in REPORT_COLUMNS))
+
+def main():
+    parser = argparse.ArgumentParser(description="知识图谱前端渲染基准测试（无界面浏览器）")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="合成图谱的节点数")
+    parser.add_argument("--clicks", type=int, default=DEFAULT_CLICKS, help="每个图谱模拟点击的节点数")
+    parser.add_argument("--modes", nargs="+", choices=list(MODES), default=list(MODES), help="测量的页面模式")
+    parser.add_argument("--browser", choices=["chromium", "firefox", "webkit"], default="chromium",
+                        help="浏览器（堆内存只在chromium下可测）")
+    parser.add_argument("--headed", action="store_true", help="显示浏览器窗口")
+    parser.add_argument("--executable", help="浏览器可执行文件路径（不使用playwright自带的浏览器时）")
+    parser.add_argument("--seed", type=int, default=0, help="合成图谱和点击顺序的随机种子")
+    parser.add_argument("--output", help="把结果写入JSON文件，便于对比优化前后")
+    parser.add_argument("--cold-start", action="store_true", help="测量新进程启动后学生端的首屏时间（TTFP）")
+    parser.add_argument("--app", default=os.path.abspath(graph.__file__), help="冷启动测量的应用脚本（可指向其他版本的检出）")
+    parser.add_argument("--runs", type=int, default=COLD_START_RUNS, help="冷启动测量的重复次数")
+    parser.add_argument("--warm-browser", action="store_true", help="冷启动测量时保留浏览器中的缓存（学生再次访问）")
+    args = parser.parse_args()
+
+    if args.cold_start:
+        result = run_cold_start(args.app, args.runs, args.browser, args.headed, args.executable, args.warm_browser)
+        if args.output:
+            graph.write_json_atomic(args.output, dict(result, created_at=time.strftime("%Y-%m-%d %H:%M:%S"), browser=args.browser))
+            print(f"✅ 结果已写入 {args.output}")
+        return
+
+    for mode in args.modes:
+        print(f"· {mode}: {MODES[mode]}")
+    results = run_benchmark(args.sizes, args.clicks, args.modes, args.browser, args.headed, args.seed, args.executable)
+    if args.output:
+        graph.write_json_atomic(args.output, {
+            "created_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "browser": args.browser,
+            "clicks": args.clicks,
+            "results": results
+        })
+        print(f"✅ 结果已写入 {args.output}")
+
+if __name__ == "__main__":
+    main()
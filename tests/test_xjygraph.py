@@ -0,0 +1,356 @@
+"""
+xjygraph 核心逻辑测试：存储后端契约（内存/SQLite 同一套用例）、图谱校验与编辑、推荐和时序分析。
+运行：python -m pytest -q
+"""
+
+import json
+import os
+import re
+import sys
+from datetime import datetime, timedelta
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import xjygraph as graph
+
+# ==================== 测试数据 ====================
+BASE_TIME = datetime(2026, 3, 2, 9, 0, 0)
+
+def make_record(i, student_id="s1", node_id=None, minutes=0, count=1, duration=2.0):
+    at = BASE_TIME + timedelta(minutes=minutes)
+    return {
+        "interaction_id": f"i{i}",
+        "student_id": student_id,
+        "node_id": node_id or f"n{i % 3}",
+        "node_label": f"节点{i % 3}",
+        "action_type": "view",
+        "duration": duration,
+        "count": count,
+        "timestamp": at.astimezone().isoformat()
+    }
+
+def make_node(node_id, level=1, category="事故"):
+    return {"id": node_id, "label": f"标签{node_id}", "category": category, "level": level, "type": "", "properties": {}}
+
+def make_graph():
+    return {
+        "nodes": [make_node("a"), make_node("b", 2), make_node("c", 2, "原因")],
+        "relationships": [
+            {"source": "a", "target": "b", "type": "导致", "properties": {}},
+            {"source": "b", "target": "c", "type": "导致", "properties": {}}
+        ]
+    }
+
+# ==================== 存储后端契约 ====================
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        backend = graph.MemoryInteractionStore()
+    else:
+        backend = graph.SqliteInteractionStore(str(tmp_path / "store.db"))
+    yield backend
+    backend.close()
+
+def test_write_is_idempotent(store):
+    """同一 interaction_id 重复投递只保留一条"""
+    records = [make_record(i, minutes=i) for i in range(5)]
+    store.write_interactions(records)
+    store.write_interactions(records[:3])
+    assert store.count() == 5
+    assert sorted(record["interaction_id"] for record in store.all_interactions()) == [f"i{i}" for i in range(5)]
+
+def test_iter_interactions_chunks_and_order(store):
+    """按块产出全部记录，ordered 时按时间正序"""
+    records = [make_record(i, minutes=(7 * i) % 10) for i in range(10)]
+    store.write_interactions(records)
+    chunks = list(store.iter_interactions(chunk_size=4, ordered=True))
+    assert [len(chunk) for chunk in chunks] == [4, 4, 2]
+    times = [graph.parse_record_time(record["timestamp"]) for chunk in chunks for record in chunk]
+    assert times == sorted(times)
+    unordered = [record["interaction_id"] for chunk in store.iter_interactions(chunk_size=3) for record in chunk]
+    assert sorted(unordered) == sorted(record["interaction_id"] for record in records)
+
+def test_interactions_after_is_strict_and_limited(store):
+    """只返回严格晚于水位线的记录，按时间顺序最多 limit 条"""
+    store.write_interactions([make_record(i, minutes=i) for i in range(6)])
+    watermark = make_record(0, minutes=2)["timestamp"]
+    after = store.interactions_after(watermark, 2)
+    assert [record["interaction_id"] for record in after] == ["i3", "i4"]
+    assert store.interactions_after(make_record(0, minutes=5)["timestamp"], 10) == []
+
+def test_compact_preserves_view_totals(store):
+    """压缩后原始记录并入每日汇总，各学生、节点的查看次数和时长不变"""
+    records = [make_record(i, student_id=f"s{i % 2}", minutes=i, count=1 + i % 2) for i in range(8)]
+    records.append(make_record(99, minutes=60 * 24 * 3))
+    store.write_interactions(records)
+
+    def totals():
+        counts, durations = {}, {}
+        for record in store.all_interactions():
+            key = (record["student_id"], record["node_id"])
+            counts[key] = counts.get(key, 0) + int(record["count"] or 1)
+            durations[key] = durations.get(key, 0) + float(record["duration"] or 0)
+        return counts, durations
+
+    before = totals()
+    compacted = store.compact(BASE_TIME + timedelta(days=1))
+    assert compacted == 8
+    assert store.count() == 1
+    assert totals() == before
+    rollups = [record for record in store.all_interactions() if record["action_type"] == "daily_rollup"]
+    assert rollups and all(record["timestamp"].startswith("2026-03-02") for record in rollups)
+
+def test_clear_interactions(store):
+    store.write_interactions([make_record(i) for i in range(3)])
+    store.compact(BASE_TIME + timedelta(days=1))
+    store.clear_interactions()
+    assert store.count() == 0
+    assert store.all_interactions() == []
+
+# ==================== 图谱校验与编辑 ====================
+def test_validate_graph_quarantines_bad_records():
+    """坏节点和端点不存在的关系进入隔离区，其余数据和索引正常生成"""
+    data = make_graph()
+    data["nodes"].append({"id": "bad", "label": "缺少类别", "level": 1})
+    data["nodes"].append(make_node("a"))
+    data["relationships"].append({"source": "a", "target": "missing"})
+    validated, index, quarantined = graph.validate_graph(data)
+    assert [node["id"] for node in validated["nodes"]] == ["a", "b", "c"]
+    assert len(validated["relationships"]) == 2
+    assert len(quarantined) == 3
+    assert validated["quarantine"] == quarantined
+    assert index["out_neighbors"][index["position"]["a"]] == [index["position"]["b"]]
+    assert index["in_degree"] == [0, 1, 1]
+
+def test_apply_graph_ops_is_copy_on_write():
+    data = make_graph()
+    new_data, resolved = graph.apply_graph_ops(data, [
+        {"op": "add_node", "node": make_node("d")},
+        {"op": "add_relationship", "relationship": {"source": "c", "target": "d"}},
+        {"op": "update_node", "id": "a", "fields": {"label": "新名称"}},
+        {"op": "remove_node", "id": "b"}
+    ])
+    assert [node["id"] for node in new_data["nodes"]] == ["a", "c", "d"]
+    assert new_data["nodes"][0]["label"] == "新名称"
+    assert [(rel["source"], rel["target"]) for rel in new_data["relationships"]] == [("c", "d")]
+    assert resolved[1]["relationship"]["type"] == "关联"
+    # 原图谱不受影响，未改动的节点对象共享
+    assert data == make_graph()
+    assert new_data["nodes"][1] is data["nodes"][2]
+
+@pytest.mark.parametrize("ops", [
+    [{"op": "add_node", "node": make_node("a")}],
+    [{"op": "add_node", "node": {"id": "x"}}],
+    [{"op": "remove_node", "id": "missing"}],
+    [{"op": "add_relationship", "relationship": {"source": "a", "target": "missing"}}],
+    [{"op": "add_relationship", "relationship": {"source": "a", "target": "b", "type": "导致"}}],
+    [{"op": "update_node", "id": "a", "node": make_node("z")}],
+    [{"op": "rename"}]
+])
+def test_apply_graph_ops_rejects_invalid(ops):
+    with pytest.raises(ValueError):
+        graph.apply_graph_ops(make_graph(), ops)
+
+@pytest.fixture
+def graph_store(tmp_path, monkeypatch):
+    """指向临时目录的版本化图谱（JSON、快照和历史版本都写在 tmp_path 下）"""
+    json_path = tmp_path / "graph.json"
+    json_path.write_text(json.dumps(make_graph(), ensure_ascii=False), encoding="utf-8")
+    monkeypatch.setattr(graph, "JSON_FILE_PATH", str(json_path))
+    monkeypatch.setattr(graph, "SNAPSHOT_FILE", str(tmp_path / "snapshot.pkl"))
+    monkeypatch.setattr(graph, "GRAPH_VERSIONS_DIR", str(tmp_path / "versions"))
+    snapshot, error = graph.load_or_build_snapshot(force=True)
+    assert error is None
+    return graph.GraphStore(snapshot)
+
+def test_apply_patch_merges_disjoint_edits(graph_store):
+    """基线之后别人改的是其他节点时直接合并"""
+    base = graph_store.version
+    graph_store.apply_patch(base, [{"op": "update_node", "id": "a", "fields": {"label": "甲"}}])
+    snapshot = graph_store.apply_patch(base, [{"op": "update_node", "id": "c", "fields": {"label": "丙"}}])
+    labels = {node["id"]: node["label"] for node in snapshot["json_data"]["nodes"]}
+    assert labels["a"] == "甲" and labels["c"] == "丙"
+    with open(graph.JSON_FILE_PATH, encoding="utf-8") as f:
+        assert {node["id"]: node["label"] for node in json.load(f)["nodes"]} == labels
+
+def test_apply_patch_conflict(graph_store):
+    """基线之后同一节点被改过时抛出 GraphConflictError，图谱保持不变"""
+    base = graph_store.version
+    graph_store.apply_patch(base, [{"op": "update_node", "id": "a", "fields": {"label": "甲"}}])
+    current = graph_store.version
+    with pytest.raises(graph.GraphConflictError):
+        graph_store.apply_patch(base, [{"op": "remove_node", "id": "a"}])
+    with pytest.raises(graph.GraphConflictError):
+        graph_store.apply_patch("0" * 16, [{"op": "remove_node", "id": "c"}])
+    assert graph_store.version == current
+
+def test_apply_patch_rejects_invalid_without_side_effects(graph_store):
+    """未通过校验的编辑在写入JSON和历史版本之前被拒绝"""
+    with open(graph.JSON_FILE_PATH, "rb") as f:
+        before = f.read()
+    versions = sorted(os.listdir(graph.GRAPH_VERSIONS_DIR))
+    base = graph_store.version
+    with pytest.raises(ValueError):
+        graph_store.apply_patch(base, [{"op": "add_node", "node": make_node("d", level=0)}])
+    with open(graph.JSON_FILE_PATH, "rb") as f:
+        assert f.read() == before
+    assert sorted(os.listdir(graph.GRAPH_VERSIONS_DIR)) == versions
+    assert graph_store.version == base
+
+# ==================== 推荐 ====================
+def test_personalized_pagerank_matches_power_iteration():
+    """前向推送的近似结果与幂迭代的误差在 epsilon 量级内"""
+    neighbors = [[1, 2], [0, 2], [0, 1, 3], [2, 4], [3], []]
+    alpha = graph.RECOMMEND_ALPHA
+    estimate = graph.personalized_pagerank(0, neighbors, epsilon=1e-6)
+    n = len(neighbors)
+    rank = [1.0 if i == 0 else 0.0 for i in range(n)]
+    for _ in range(300):
+        spread = [0.0] * n
+        for u, targets in enumerate(neighbors):
+            if targets:
+                for v in targets:
+                    spread[v] += rank[u] / len(targets)
+            else:
+                spread[u] += rank[u]
+        rank = [alpha * (1.0 if i == 0 else 0.0) + (1 - alpha) * spread[i] for i in range(n)]
+    for i in range(5):
+        assert abs(estimate.get(i, 0.0) - rank[i]) < 1e-3
+    assert 5 not in estimate
+    assert max(estimate, key=estimate.get) == 0
+
+# ==================== 时序分析 ====================
+def test_time_analytics_job():
+    import pandas as pd
+
+    records = [
+        make_record(0, node_id="a", minutes=0),
+        make_record(1, node_id="b", minutes=5),
+        make_record(2, node_id="c", minutes=10, count=2),
+        # 超过会话间隔，另起一个会话
+        make_record(3, node_id="a", minutes=120),
+        make_record(4, student_id="s2", node_id="b", minutes=30)
+    ]
+    df = graph.add_time_column(graph.normalize_count_column(pd.DataFrame(records)))
+    start, end = BASE_TIME, BASE_TIME + timedelta(days=1)
+    result = graph.time_analytics_job(df, start, end, "h", 30, {"a": "事故", "b": "事故", "c": "原因"})
+    assert int(result["activity"]["访问次数"].sum()) == 6
+    assert len(result["sessions"]) == 3
+    assert result["transitions"].loc["a", "b"] == 1
+    assert result["transitions"].loc["b", "c"] == 1
+    assert "c" not in result["transitions"].index
+    assert result["coverage"]["原因"].iloc[-1] == 0.5
+
+def test_time_analytics_job_empty_range():
+    empty = graph.load_interaction_frame(graph.MemoryInteractionStore(), BASE_TIME, BASE_TIME + timedelta(days=1))
+    result = graph.time_analytics_job(empty, BASE_TIME, BASE_TIME + timedelta(days=1), "D", 30, {})
+    assert result["activity"].empty and result["sessions"].empty
+
+# ==================== 客户端事件 ====================
+def test_parse_client_timestamp_only_accepts_recent_times():
+    """浏览器上报的时间只接受最近一个合并窗口内的，伪造的未来或过早时间改用服务器时间"""
+    now = datetime(2026, 3, 2, 12, 0, 0).timestamp()
+    recent = datetime.fromtimestamp(now - 5).isoformat()
+    assert graph.parse_client_timestamp(recent, now) == pytest.approx(now - 5)
+    for value in (
+        datetime.fromtimestamp(now - graph.CLICK_DEBOUNCE_SECONDS - 1).isoformat(),
+        datetime.fromtimestamp(now + 60).isoformat(),
+        "2001-01-01",
+        "not a time",
+        None
+    ):
+        assert graph.parse_client_timestamp(value, now) is None
+
+# ==================== 进程池 ====================
+def test_worker_pool_inline_fallback_releases_lock(monkeypatch):
+    """进程池无法启动时在当前线程计算，计算期间不持有锁，任务异常照常抛出"""
+    pool = graph.WorkerPool(workers=2)
+
+    def broken_executor():
+        raise OSError("no processes")
+
+    def check_unlocked(*args):
+        assert not pool._lock.locked()
+        return graph.personalized_pagerank(*args)
+
+    monkeypatch.setattr(pool, "_get_executor", broken_executor)
+    monkeypatch.setattr(graph, "call_worker_function", lambda fn_name, *args: check_unlocked(*args))
+    assert pool.run("personalized_pagerank", 0, [[1], [0]])[0] > 0
+    assert pool.stats["inline"] == 1
+    monkeypatch.setattr(graph, "call_worker_function", lambda fn_name, *args: 1 / 0)
+    with pytest.raises(ZeroDivisionError):
+        pool.run("personalized_pagerank", 0, [[1], [0]])
+
+def test_worker_pool_forgets_finished_futures(monkeypatch):
+    """计算中的相同任务共用一个future，完成后不再保留结果"""
+    from concurrent.futures import Future
+
+    pending = Future()
+
+    class Executor:
+        def submit(self, *args):
+            return pending
+
+    pool = graph.WorkerPool(workers=2)
+    monkeypatch.setattr(pool, "_get_executor", lambda: Executor())
+    first = pool.submit("build_ppr_table", [[]], [[]], cache_key="k")
+    assert pool.submit("build_ppr_table", [[]], [[]], cache_key="k") is first
+    assert pool.stats["shared"] == 1
+    pending.set_result([[]])
+    assert pool._futures == {}
+
+# ==================== 报表导出 ====================
+@pytest.mark.parametrize("with_outbox", [False, True])
+def test_export_reads_only_submitted_version(store, tmp_path, monkeypatch, with_outbox):
+    """导出只包含提交时数据版本内的记录，之后到达的记录不写入同名文件"""
+    outbox = graph.InteractionOutbox(str(tmp_path / "outbox.db")) if with_outbox else None
+    monkeypatch.setattr(graph, "get_outbox", lambda: outbox)
+    store.write_interactions([make_record(i, minutes=i) for i in range(3)])
+    feed = graph.InteractionFeed(graph.get_data_generation().value)
+    feed.refresh(store, {})
+    data_key, source = feed.export_source(store)
+    late = make_record(9, minutes=30)
+    if outbox:
+        outbox.append(late)
+    store.write_interactions([late])
+    path = tmp_path / "export.json"
+    graph.export_class_json(str(path), source, lambda fraction, message: None)
+    exported = json.loads(path.read_text(encoding="utf-8"))
+    assert sorted(record["interaction_id"] for record in exported["records"]) == ["i0", "i1", "i2"]
+    assert feed.export_source(store)[0] == data_key
+    graph.get_data_generation().bump()
+    with pytest.raises(RuntimeError):
+        graph.export_class_json(str(path), source, lambda fraction, message: None)
+
+def test_export_graph_html_is_self_contained(graph_store, tmp_path):
+    """导出的图谱网页内联vis-network脚本和样式，不引用任何外部地址"""
+    path = tmp_path / "graph.html"
+    graph.export_graph_html(str(path), graph_store.snapshot, lambda fraction, message: None)
+    html = path.read_text(encoding="utf-8")
+    assert re.search(r'(src|href)="(https?:|lib/)', html) is None
+    assert "node_modules" not in html
+    assert graph.load_vis_assets()["js"] in html
+
+# ==================== 发件箱 ====================
+def test_replay_prunes_delivered_outside_dedup_window(tmp_path, monkeypatch):
+    """每批同步成功后清理去重窗口之前已同步的记录，实时统计在记录被清理后重新全量读取"""
+    store = graph.MemoryInteractionStore()
+    outbox = graph.InteractionOutbox(str(tmp_path / "outbox.db"))
+    monkeypatch.setattr(graph, "get_outbox", lambda: outbox)
+    monkeypatch.setattr(graph, "OUTBOX_DEDUP_SECONDS", 0)
+    feed = graph.InteractionFeed(graph.get_data_generation().value)
+    feed.refresh(store, {})
+    for i in range(3):
+        outbox.append(make_record(i, minutes=i))
+    replayer = graph.OutboxReplayer(store, outbox)
+    with replayer.lock:
+        replayer._replay_batch()  # 后台线程可能已先投递，这里保证至少完成一批
+    assert store.count() == 3 and replayer.delivered_total == 3
+    assert outbox.since(0, 10) == [] and outbox.last_seq() == 3
+    feed.refresh(store, {})
+    assert feed.metrics.records == 3
+    monkeypatch.setattr(graph, "OUTBOX_DEDUP_SECONDS", 3600)
+    outbox.append(make_record(3, minutes=3))
+    assert feed.refresh(store, {}) == 1 and feed.metrics.records == 4
@@ -4,17 +4,29 @@
 功能：学生端浏览知识图谱，管理端查看访问数据
 """
 
+import time
+
+_RUN_T0 = time.perf_counter()  # 本次脚本运行起点，用于测量首屏耗时
+
 import streamlit as st
 import json
 import os
-import pandas as pd
-from datetime import datetime
-from neo4j import GraphDatabase
-from pyvis.network import Network
+import sys
+import pickle
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from collections import Counter
+from contextlib import contextmanager
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
 import streamlit.components.v1 as components
 import hashlib
-import time
-from streamlit_javascript import st_javascript
+import re
+
+# 注意：neo4j、pyvis、pandas、streamlit_javascript 等重量级模块均在使用处延迟导入，
+# 学生端首屏无需为管理端的依赖付出导入开销
 
 # ==================== 配置区 ====================
 # 1. 专属标签 (通过修改这个后缀，区分不同的人)
@@ -27,12 +39,60 @@ ADMIN_PASSWORD = "admin888"
 NEO4J_URI = "bolt://localhost:7687"
 NEO4J_USER = "neo4j"
 NEO4J_PASSWORD = "wE7pV36hqNSo43mpbjTlfzE7n99NWcYABDFqUGvgSrk"
+STORAGE_BACKEND = "neo4j"  # 存储后端：neo4j（本地SQLite副本兜底）/ sqlite（无需Neo4j）/ memory（仅测试用，重启即清空）
 
 # 4. JSON文件路径
 # 获取当前脚本所在的目录
 current_dir = os.path.dirname(os.path.abspath(__file__))
 JSON_FILE_PATH = os.path.join(current_dir, "范各庄突水事故知识图谱.json")
-INTERACTIONS_FILE = os.path.join(current_dir, "interactions_log.json")  # 本地交互记录文件
+INTERACTIONS_FILE = os.path.join(current_dir, "interactions_log.json")  # 旧版本地交互记录文件（新建SQLite存储时导入）
+INTERACTIONS_DAILY_FILE = os.path.join(current_dir, "interactions_daily.json")  # 旧版本地每日汇总记录文件
+STORAGE_FILE = os.path.join(current_dir, "interactions_store.db")  # 嵌入式SQLite存储（sqlite后端，或Neo4j后端的本地副本）
+OUTBOX_FILE = os.path.join(current_dir, "interactions_outbox.db")  # 待同步到Neo4j的交互记录（SQLite发件箱）
+EXPORT_DIR = os.path.join(current_dir, "exports")  # 导出报表的输出目录
+SNAPSHOT_FILE = os.path.join(current_dir, "graph_snapshot.pkl")  # 预编译图谱快照（部署时可提前生成）
+GRAPH_VERSIONS_DIR = os.path.join(current_dir, "graph_versions")  # 近期图谱版本的前端数据（用于向浏览器发送增量）
+
+# 5. 性能参数
+SNAPSHOT_FORMAT = 3  # 快照结构版本，结构变化时递增使旧快照失效
+GRAPH_VERSION_HISTORY = 5  # 保留的历史图谱版本数
+VIS_NETWORK_DIR = os.path.join(current_dir, "lib", "vis-9.1.2")  # 随仓库提供的vis-network脚本和样式（学生端图谱不依赖CDN）
+VIS_ASSET_KEY = "vis-network-9.1.2"  # 浏览器缓存vis脚本所用的键，升级vis版本时同步修改
+NEO4J_RETRY_SECONDS = 30  # Neo4j 连接失败后的重试间隔
+STREAM_FETCH_SIZE = 1000  # 流式查询时Neo4j驱动每次从服务器拉取的记录数
+STREAM_CHUNK_SIZE = 5000  # 流式读取交互记录时每块的记录数（管理端内存按块而非全量占用）
+NODE_PAGE_SIZE = 15  # 侧边栏节点列表每页显示的节点数
+CLICK_DEBOUNCE_SECONDS = 30  # 同一节点在此窗口内的重复查看合并为一条记录
+PENDING_SWEEP_SECONDS = 10  # 后台写入超时会话缓冲的检查间隔（秒），会话直接关闭时最后一次浏览也会写入
+INTERACTION_RETENTION_DAYS = 90  # 原始访问记录保留天数，更早的记录汇总为每日聚合
+COMPACTION_BATCH_SIZE = 5000  # 压缩/批量删除时每个事务处理的记录数
+LIVE_REFRESH_SECONDS = 5  # 管理端实时模式的刷新间隔
+LIVE_BATCH_LIMIT = 2000  # 实时模式每次最多读取的新记录数
+FEED_LOOKBACK_SECONDS = 120  # 无发件箱时增量轮询回看的时间窗口（秒），覆盖会话缓冲稍后写入、时间戳较早的记录
+SESSION_GAP_MINUTES = 30  # 同一学生两次访问间隔超过此值视为新的学习会话
+FLOW_MAX_EDGES = 60  # 学习路径流向图最多叠加的转移边数
+EXPORT_WORKERS = 2  # 后台导出线程数
+EXPORT_JOB_TTL = 3600  # 导出任务完成后保留的时间（秒），过期后移除任务并删除文件
+WORKER_PROCESSES = (os.cpu_count() or 2) - 1  # CPU密集任务的进程池大小；单核机器上为0，任务直接在当前线程计算（子进程只会争抢同一个CPU）
+ANALYTICS_CACHE_TTL = 600  # 时序分析结果的缓存时间（秒）
+OUTBOX_BATCH_SIZE = 500  # 发件箱每批同步到Neo4j的记录数上限（按写入耗时自动调整）
+OUTBOX_REPLAY_INTERVAL = 2  # 发件箱后台同步的轮询间隔（秒），失败时按指数退避
+OUTBOX_MIN_BATCH_SIZE = 50  # 存储写入变慢时批大小缩减的下限
+OUTBOX_TARGET_WRITE_SECONDS = 0.5  # 每批写入的目标耗时，超过则减小批大小、低于一半则逐步增大
+OUTBOX_DEDUP_SECONDS = 3600  # 已同步记录在发件箱中保留的时间（秒），期间重复投递的 interaction_id 被忽略
+INGEST_STUDENT_RATE = 2  # 每个学生每秒允许写入的交互记录数（令牌桶补充速度）
+INGEST_STUDENT_BURST = 30  # 每个学生的突发上限（令牌桶容量）
+INGEST_GLOBAL_RATE = 200  # 整个进程每秒允许写入的交互记录数，保护存储后端
+INGEST_GLOBAL_BURST = 2000  # 全局突发上限（如上课开始时全班同时进入）
+INGEST_CLIENT_BATCH_LIMIT = 100  # 每次从浏览器读取的待处理记录上限，超出部分直接丢弃
+GRAPH_EDIT_HISTORY = 50  # 保留的图谱编辑记录数（用于判断并发编辑是否冲突）
+GRAPH_SYNC_SECONDS = 10  # 学生端检查图谱是否被编辑的间隔（秒）
+GRAPH_ACK_SECONDS = 20  # 等待浏览器报告图谱缓存结果的最长时间（秒），超时视为浏览器没有缓存
+RECOMMEND_COUNT = 5  # 侧边栏推荐的下一步学习节点数
+RECOMMEND_ALPHA = 0.15  # 个性化PageRank的重启概率（越大越偏向近邻节点）
+RECOMMEND_EPSILON = 1e-4  # 近似PageRank的残差阈值（越小越精确，预计算越慢）
+RECOMMEND_PPR_TOP = 50  # 每个节点只保留得分最高的若干个相关节点
+RECOMMEND_RECENCY = 1.25  # 每次新的访问权重放大的倍数（越大越偏向最近浏览的节点）
 
 # ==================== 颜色配置 ====================
 CATEGORY_COLORS = {
@@ -46,17 +106,35 @@ CATEGORY_COLORS = {
 # ==================== Neo4j 数据库操作类 ====================
 class Neo4jConnection:
     def __init__(self, uri, user, password):
-        self.driver = None
-        try:
-            self.driver = GraphDatabase.driver(uri, auth=(user, password))
-            self.driver.verify_connectivity()
-        except Exception as e:
-            # Neo4j连接失败时静默处理，系统将使用纯JSON模式运行
-            self.driver = None
+        self.uri = uri
+        self.auth = (user, password)
+        self._driver = None
+        self._last_attempt = None
+        self._lock = threading.Lock()
+    
+    @property
+    def driver(self):
+        """首次使用时才连接Neo4j，避免启动阶段的连接探测阻塞首屏"""
+        if self._driver is not None:
+            return self._driver
+        with self._lock:
+            now = time.monotonic()
+            if self._driver is None and (self._last_attempt is None or now - self._last_attempt >= NEO4J_RETRY_SECONDS):
+                self._last_attempt = now
+                try:
+                    from neo4j import GraphDatabase
+                    driver = GraphDatabase.driver(self.uri, auth=self.auth)
+                    driver.verify_connectivity()
+                    self._driver = driver
+                except Exception as e:
+                    # Neo4j连接失败时静默处理，系统将使用纯JSON模式运行
+                    self._driver = None
+        return self._driver
     
     def close(self):
-        if self.driver:
-            self.driver.close()
+        if self._driver:
+            self._driver.close()
+            self._driver = None
     
     def execute_query(self, query, parameters=None):
         if not self.driver:
@@ -65,37 +143,1163 @@ class Neo4jConnection:
             result = session.run(query, parameters or {})
             return [record.data() for record in result]
     
+    def stream_query(self, query, parameters=None, fetch_size=STREAM_FETCH_SIZE):
+        """逐条产出查询结果（驱动按 fetch_size 分批拉取），不整体物化"""
+        if not self.driver:
+            return
+        with self.driver.session(fetch_size=fetch_size) as session:
+            result = session.run(query, parameters or {})
+            for record in result:
+                yield record.data()
+    
     def execute_write(self, query, parameters=None):
         if not self.driver:
             return None
         with self.driver.session() as session:
             result = session.run(query, parameters or {})
             return result.consume()
+    
+    def execute_write_batch(self, statements):
+        """在同一个事务中依次执行多条写语句 [(query, parameters)]，任一失败则整体回滚"""
+        if not self.driver:
+            return None
+        with self.driver.session() as session:
+            with session.begin_transaction() as tx:
+                for query, parameters in statements:
+                    tx.run(query, parameters or {}).consume()
+                tx.commit()
+        return len(statements)
+
+@st.cache_resource
+def get_connection():
+    """进程内共享的Neo4j连接（驱动自带连接池，无需每次重跑都重新连接）"""
+    return Neo4jConnection(NEO4J_URI, NEO4J_USER, NEO4J_PASSWORD)
+
+def delete_label_in_batches(conn, label, detach=False, batch_size=COMPACTION_BATCH_SIZE):
+    """分批删除某标签的全部节点，避免单个大事务耗尽Neo4j堆内存"""
+    delete_clause = "DETACH DELETE n" if detach else "DELETE n"
+    return conn.execute_write(f"""
+    MATCH (n:{label})
+    CALL {{ WITH n {delete_clause} }} IN TRANSACTIONS OF {int(batch_size)} ROWS
+    """)
+
+# ==================== 存储后端 ====================
+INTERACTION_FIELDS = ("interaction_id", "student_id", "node_id", "node_label", "action_type", "duration", "count", "timestamp")
+SQLITE_INTERACTION_COLUMNS = ", ".join(INTERACTION_FIELDS)
+
+def iter_chunks(iterable, chunk_size):
+    """把迭代器按固定大小分块产出列表"""
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+class InteractionStore(ABC):
+    """存储后端接口：知识图谱、原始交互记录和每日汇总；具体存储由子类实现"""
+    path = None  # 本地存储文件路径（内存/远程存储为None）
+    mirror = None  # 远程存储的本地副本，远程不可用时由副本兜底
+    
+    def available(self):
+        """存储当前是否可写"""
+        return True
+    
+    def describe(self):
+        return ""
+    
+    def init_schema(self):
+        """创建约束和索引（可重复调用）"""
+    
+    @abstractmethod
+    def save_graph(self, json_data):
+        """用JSON数据覆盖存储中的知识图谱，成功返回True"""
+    
+    @abstractmethod
+    def clear_graph(self):
+        """删除存储中的知识图谱"""
+    
+    @abstractmethod
+    def apply_graph_ops(self, ops):
+        """增量应用已校验过的图谱编辑操作（见 apply_graph_ops 函数）"""
+    
+    @abstractmethod
+    def write_interactions(self, records):
+        """按 interaction_id 幂等写入一批交互记录（重复投递不会产生重复记录）"""
+    
+    @abstractmethod
+    def all_interactions(self):
+        """原始记录与每日汇总合并返回（汇总以 daily_rollup 类型出现），按时间倒序"""
+    
+    def iter_interactions(self, chunk_size=STREAM_CHUNK_SIZE, ordered=False):
+        """分块产出全部记录（原始记录与每日汇总）；ordered 时按时间正序"""
+        records = self.all_interactions()
+        if ordered:
+            records.reverse()
+        yield from iter_chunks(records, chunk_size)
+    
+    def student_interactions(self, student_id):
+        """某学生的原始记录与每日汇总，按时间倒序"""
+        return [record for record in self.all_interactions() if record["student_id"] == student_id]
+    
+    @abstractmethod
+    def interactions_after(self, timestamp, limit):
+        """时间戳晚于水位线的原始记录，按时间顺序最多返回 limit 条"""
+    
+    @abstractmethod
+    def count(self):
+        """原始记录条数"""
+    
+    @abstractmethod
+    def compact(self, cutoff, batch_size=COMPACTION_BATCH_SIZE):
+        """把早于 cutoff 的原始记录并入每日（学生×节点）汇总并删除，返回压缩条数"""
+    
+    @abstractmethod
+    def clear_interactions(self):
+        """删除全部原始记录和每日汇总"""
+    
+    def close(self):
+        pass
+
+NEO4J_INTERACTION_FIELDS = """
+       i.interaction_id as interaction_id,
+       i.student_id as student_id,
+       i.node_id as node_id,
+       i.node_label as node_label,
+       i.action_type as action_type,
+       i.duration as duration,
+       coalesce(i.count, 1) as count,
+       toString(i.timestamp) as timestamp"""
+
+class Neo4jInteractionStore(InteractionStore):
+    """Neo4j存储；Neo4j不可用时读取本地SQLite副本"""
+    
+    def __init__(self, conn, mirror=None):
+        self.conn = conn
+        self.mirror = mirror
+    
+    def available(self):
+        return self.conn.driver is not None
+    
+    def describe(self):
+        if self.available():
+            return "Neo4j 数据库"
+        if self.mirror is not None:
+            return f"本地副本 ({os.path.basename(self.mirror.path or '')})，Neo4j 未连接"
+        return "Neo4j 未连接"
+    
+    def init_schema(self):
+        if not self.available():
+            return
+        try:
+            self.conn.execute_write(f"""
+            CREATE CONSTRAINT IF NOT EXISTS FOR (n:Interaction_{TARGET_LABEL}) 
+            REQUIRE n.interaction_id IS UNIQUE
+            """)
+            # 按时间筛选待压缩记录、按键合并每日汇总都依赖索引
+            self.conn.execute_write(f"""
+            CREATE INDEX IF NOT EXISTS FOR (n:Interaction_{TARGET_LABEL}) ON (n.timestamp)
+            """)
+            self.conn.execute_write(f"""
+            CREATE INDEX IF NOT EXISTS FOR (n:InteractionDaily_{TARGET_LABEL}) ON (n.student_id, n.node_id, n.day)
+            """)
+            # 批量导入关系时按 node_id 匹配两端节点
+            self.conn.execute_write(f"""
+            CREATE INDEX IF NOT EXISTS FOR (n:{TARGET_LABEL}) ON (n.node_id)
+            """)
+        except:
+            pass
+    
+    def save_graph(self, json_data):
+        """将JSON数据导入Neo4j（数据已在加载时校验，关系两端一定存在，可以按批UNWIND导入）"""
+        if not self.available():
+            return False
+        conn = self.conn
+        
+        # 清除旧数据
+        delete_label_in_batches(conn, TARGET_LABEL, detach=True)
+        
+        # 创建节点
+        for rows in iter_chunks(map(self._node_parameters, json_data.get("nodes", [])), COMPACTION_BATCH_SIZE):
+            conn.execute_write(f"""
+            UNWIND $rows AS row
+            CREATE (n:{TARGET_LABEL}:KnowledgeNode {{
+                node_id: row.node_id,
+                label: row.label,
+                category: row.category,
+                level: row.level,
+                type: row.type,
+                properties: row.properties
+            }})
+            """, {"rows": rows})
+        
+        # 创建关系
+        for rows in iter_chunks(map(self._relationship_parameters, json_data.get("relationships", [])), COMPACTION_BATCH_SIZE):
+            conn.execute_write(f"""
+            UNWIND $rows AS row
+            MATCH (a:{TARGET_LABEL} {{node_id: row.source}})
+            MATCH (b:{TARGET_LABEL} {{node_id: row.target}})
+            CREATE (a)-[r:RELATES {{type: row.rel_type, properties: row.properties}}]->(b)
+            """, {"rows": rows})
+        
+        return True
+    
+    @staticmethod
+    def _node_parameters(node):
+        return {
+            "node_id": node["id"],
+            "label": node["label"],
+            "category": node["category"],
+            "level": node["level"],
+            "type": node["type"],
+            "properties": json.dumps(node["properties"], ensure_ascii=False)
+        }
+    
+    @staticmethod
+    def _relationship_parameters(rel):
+        return {
+            "source": rel["source"],
+            "target": rel["target"],
+            "rel_type": rel["type"],
+            "properties": json.dumps(rel["properties"], ensure_ascii=False)
+        }
+    
+    CREATE_RELATIONSHIP_QUERY = f"""
+    MATCH (a:{TARGET_LABEL} {{node_id: $source}})
+    MATCH (b:{TARGET_LABEL} {{node_id: $target}})
+    CREATE (a)-[r:RELATES {{type: $rel_type, properties: $properties}}]->(b)
+    """
+    
+    def apply_graph_ops(self, ops):
+        """同步一次编辑的全部操作（同一个事务，部分失败时整体回滚），只改动涉及的节点和关系"""
+        if not self.available():
+            return False
+        statements = []
+        for op in ops:
+            kind = op["op"]
+            if kind in ("add_node", "update_node"):
+                statements.append((f"""
+                MERGE (n:{TARGET_LABEL}:KnowledgeNode {{node_id: $node_id}})
+                SET n.label = $label, n.category = $category, n.level = $level,
+                    n.type = $type, n.properties = $properties
+                """, self._node_parameters(op["node"])))
+            elif kind == "remove_node":
+                statements.append((
+                    f"MATCH (n:{TARGET_LABEL} {{node_id: $node_id}}) DETACH DELETE n",
+                    {"node_id": op["id"]}
+                ))
+            elif kind == "add_relationship":
+                statements.append((self.CREATE_RELATIONSHIP_QUERY, self._relationship_parameters(op["relationship"])))
+            elif kind == "remove_relationship":
+                rel = op["relationship"]
+                statements.append((f"""
+                MATCH (a:{TARGET_LABEL} {{node_id: $source}})-[r:RELATES {{type: $rel_type}}]->(b:{TARGET_LABEL} {{node_id: $target}})
+                WITH r LIMIT 1
+                DELETE r
+                """, {"source": rel["source"], "target": rel["target"], "rel_type": rel.get("type", "关联")}))
+        self.conn.execute_write_batch(statements)
+        return True
+    
+    def clear_graph(self):
+        if self.available():
+            delete_label_in_batches(self.conn, TARGET_LABEL, detach=True)
+    
+    def write_interactions(self, records):
+        return self.conn.execute_write(f"""
+        UNWIND $rows AS row
+        MERGE (i:Interaction_{TARGET_LABEL} {{interaction_id: row.interaction_id}})
+        ON CREATE SET i.student_id = row.student_id,
+                      i.node_id = row.node_id,
+                      i.node_label = row.node_label,
+                      i.action_type = row.action_type,
+                      i.duration = row.duration,
+                      i.count = row.count,
+                      i.timestamp = datetime(row.timestamp)
+        """, {"rows": records})
+    
+    def _interactions_query(self, where="", order="DESC"):
+        """原始记录与每日汇总的合并查询；where 作用于两类节点（变量名统一为 n）"""
+        return f"""
+        CALL {{
+            MATCH (n:Interaction_{TARGET_LABEL}) {where}
+            WITH n AS i
+            RETURN {NEO4J_INTERACTION_FIELDS}
+            UNION ALL
+            MATCH (n:InteractionDaily_{TARGET_LABEL}) {where}
+            RETURN null as interaction_id,
+                   n.student_id as student_id,
+                   n.node_id as node_id,
+                   n.node_label as node_label,
+                   'daily_rollup' as action_type,
+                   n.duration as duration,
+                   n.count as count,
+                   toString(n.day) as timestamp
+        }}
+        RETURN interaction_id, student_id, node_id, node_label, action_type, duration, count, timestamp
+        """ + (f"ORDER BY timestamp {order}" if order else "")
+    
+    def all_interactions(self):
+        if self.available():
+            result = self.conn.execute_query(self._interactions_query())
+            if result:
+                return result
+        return self.mirror.all_interactions() if self.mirror is not None else []
+    
+    def iter_interactions(self, chunk_size=STREAM_CHUNK_SIZE, ordered=False):
+        if self.available():
+            query = self._interactions_query(order="ASC" if ordered else "")
+            streamed = False
+            try:
+                for chunk in iter_chunks(self.conn.stream_query(query), chunk_size):
+                    streamed = True
+                    yield chunk
+            except Exception:
+                # 已经产出部分记录时不能再改读本地副本（会重复），只在一条都没读到时回退
+                if streamed or self.mirror is None:
+                    raise
+            if streamed:
+                return
+        # 与 all_interactions 一致：Neo4j未连接、查询失败或没有记录时读取本地副本
+        if self.mirror is not None:
+            yield from self.mirror.iter_interactions(chunk_size, ordered)
+    
+    def student_interactions(self, student_id):
+        if not self.available():
+            return self.mirror.student_interactions(student_id) if self.mirror is not None else []
+        return self.conn.execute_query(
+            self._interactions_query(where="WHERE n.student_id = $student_id"),
+            {"student_id": student_id}
+        )
+    
+    def interactions_after(self, timestamp, limit):
+        if not self.available():
+            return self.mirror.interactions_after(timestamp, limit) if self.mirror is not None else []
+        return self.conn.execute_query(f"""
+        MATCH (i:Interaction_{TARGET_LABEL})
+        WHERE i.timestamp > datetime($watermark)
+        RETURN {NEO4J_INTERACTION_FIELDS}
+        ORDER BY i.timestamp
+        LIMIT {int(limit)}
+        """, {"watermark": timestamp})
+    
+    def count(self):
+        if not self.available():
+            return self.mirror.count() if self.mirror is not None else 0
+        result = self.conn.execute_query(f"MATCH (i:Interaction_{TARGET_LABEL}) RETURN count(i) as n")
+        return result[0]["n"] if result else 0
+    
+    def compact(self, cutoff, batch_size=COMPACTION_BATCH_SIZE):
+        if not self.available():
+            return 0
+        self.init_schema()
+        # 每批在同一个事务内完成“累加到汇总 + 删除原始记录”，中途失败重跑也不会重复计数
+        summary = self.conn.execute_write(f"""
+        MATCH (i:Interaction_{TARGET_LABEL})
+        WHERE i.timestamp < datetime($cutoff)
+        CALL {{
+            WITH i
+            MERGE (d:InteractionDaily_{TARGET_LABEL} {{student_id: i.student_id, node_id: i.node_id, day: date(i.timestamp)}})
+            ON CREATE SET d.node_label = i.node_label, d.count = 0, d.duration = 0
+            SET d.count = d.count + coalesce(i.count, 1),
+                d.duration = d.duration + coalesce(i.duration, 0)
+            DELETE i
+        }} IN TRANSACTIONS OF {int(batch_size)} ROWS
+        """, {"cutoff": cutoff.astimezone().isoformat()})
+        return summary.counters.nodes_deleted if summary is not None else 0
+    
+    def clear_interactions(self):
+        if self.available():
+            delete_label_in_batches(self.conn, f"Interaction_{TARGET_LABEL}")
+            delete_label_in_batches(self.conn, f"InteractionDaily_{TARGET_LABEL}")
+    
+    def close(self):
+        self.conn.close()
+        if self.mirror is not None:
+            self.mirror.close()
+
+class SqliteInteractionStore(InteractionStore):
+    """嵌入式SQLite存储（WAL模式）：无需Neo4j的部署使用，也作为Neo4j的本地副本"""
+    
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self.init_schema()
+    
+    def describe(self):
+        return f"本地 SQLite 存储 ({os.path.basename(self.path)})"
+    
+    def init_schema(self):
+        with self._lock:
+            self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS interactions (
+                interaction_id TEXT PRIMARY KEY,
+                student_id TEXT NOT NULL,
+                node_id TEXT NOT NULL,
+                node_label TEXT,
+                action_type TEXT,
+                duration REAL DEFAULT 0,
+                count INTEGER DEFAULT 1,
+                timestamp TEXT NOT NULL,
+                ts REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_interactions_ts ON interactions(ts);
+            CREATE INDEX IF NOT EXISTS idx_interactions_student ON interactions(student_id, ts);
+            CREATE TABLE IF NOT EXISTS interactions_daily (
+                student_id TEXT NOT NULL,
+                node_id TEXT NOT NULL,
+                day TEXT NOT NULL,
+                node_label TEXT,
+                count INTEGER NOT NULL DEFAULT 0,
+                duration REAL NOT NULL DEFAULT 0,
+                PRIMARY KEY (student_id, node_id, day)
+            );
+            CREATE TABLE IF NOT EXISTS graph_nodes (
+                node_id TEXT PRIMARY KEY,
+                label TEXT,
+                category TEXT,
+                level INTEGER,
+                type TEXT,
+                properties TEXT
+            );
+            CREATE TABLE IF NOT EXISTS graph_relationships (
+                source TEXT NOT NULL,
+                target TEXT NOT NULL,
+                type TEXT,
+                properties TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_relationships_source ON graph_relationships(source);
+            CREATE INDEX IF NOT EXISTS idx_relationships_target ON graph_relationships(target);
+            """)
+    
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._db
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._db.execute("COMMIT")
+    
+    def _query(self, sql, parameters=()):
+        with self._lock:
+            return [dict(row) for row in self._db.execute(sql, parameters).fetchall()]
+    
+    def save_graph(self, json_data):
+        with self._transaction() as db:
+            db.execute("DELETE FROM graph_relationships")
+            db.execute("DELETE FROM graph_nodes")
+            db.executemany(
+                "INSERT OR REPLACE INTO graph_nodes (node_id, label, category, level, type, properties) VALUES (?, ?, ?, ?, ?, ?)",
+                [(node["id"], node["label"], node["category"], node["level"], node["type"],
+                  json.dumps(node["properties"], ensure_ascii=False))
+                 for node in json_data.get("nodes", [])]
+            )
+            db.executemany(
+                "INSERT INTO graph_relationships (source, target, type, properties) VALUES (?, ?, ?, ?)",
+                [(rel["source"], rel["target"], rel["type"], json.dumps(rel["properties"], ensure_ascii=False))
+                 for rel in json_data.get("relationships", [])]
+            )
+        return True
+    
+    def clear_graph(self):
+        with self._transaction() as db:
+            db.execute("DELETE FROM graph_relationships")
+            db.execute("DELETE FROM graph_nodes")
+    
+    def apply_graph_ops(self, ops):
+        with self._transaction() as db:
+            for op in ops:
+                kind = op["op"]
+                if kind in ("add_node", "update_node"):
+                    node = op["node"]
+                    db.execute(
+                        "INSERT OR REPLACE INTO graph_nodes (node_id, label, category, level, type, properties) VALUES (?, ?, ?, ?, ?, ?)",
+                        (node["id"], node["label"], node["category"], node["level"], node["type"],
+                         json.dumps(node["properties"], ensure_ascii=False))
+                    )
+                elif kind == "remove_node":
+                    db.execute("DELETE FROM graph_relationships WHERE source = ? OR target = ?", (op["id"], op["id"]))
+                    db.execute("DELETE FROM graph_nodes WHERE node_id = ?", (op["id"],))
+                elif kind == "add_relationship":
+                    rel = op["relationship"]
+                    db.execute(
+                        "INSERT INTO graph_relationships (source, target, type, properties) VALUES (?, ?, ?, ?)",
+                        (rel["source"], rel["target"], rel["type"], json.dumps(rel["properties"], ensure_ascii=False))
+                    )
+                elif kind == "remove_relationship":
+                    rel = op["relationship"]
+                    db.execute("""
+                    DELETE FROM graph_relationships WHERE rowid = (
+                        SELECT rowid FROM graph_relationships WHERE source = ? AND target = ? AND type = ? LIMIT 1
+                    )
+                    """, (rel["source"], rel["target"], rel.get("type", "关联")))
+        return True
+    
+    def write_interactions(self, records):
+        rows = []
+        for record in records:
+            ts = parse_record_time(record["timestamp"])
+            rows.append((
+                record["interaction_id"], record["student_id"], record["node_id"], record.get("node_label"),
+                record.get("action_type"), record.get("duration") or 0, record.get("count") or 1,
+                record["timestamp"], ts if ts is not None else time.time()
+            ))
+        with self._transaction() as db:
+            db.executemany("""
+            INSERT OR IGNORE INTO interactions
+                (interaction_id, student_id, node_id, node_label, action_type, duration, count, timestamp, ts)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, rows)
+    
+    def _interactions_sql(self, where=""):
+        """原始记录与每日汇总的合并查询（sort_key 为统一的秒级时间）"""
+        return f"""
+        SELECT {SQLITE_INTERACTION_COLUMNS} FROM (
+            SELECT {SQLITE_INTERACTION_COLUMNS}, ts AS sort_key FROM interactions {where}
+            UNION ALL
+            SELECT NULL, student_id, node_id, node_label, 'daily_rollup', duration, count, day,
+                   CAST(strftime('%s', day) AS REAL)
+            FROM interactions_daily {where}
+        )
+        """
+    
+    def all_interactions(self):
+        return self._query(self._interactions_sql() + "ORDER BY sort_key DESC")
+    
+    def iter_interactions(self, chunk_size=STREAM_CHUNK_SIZE, ordered=False):
+        # 独立的读连接：WAL模式下读取不阻塞写入，也不长时间占用共享连接的锁
+        db = sqlite3.connect(self.path)
+        db.row_factory = sqlite3.Row
+        try:
+            cursor = db.execute(self._interactions_sql() + ("ORDER BY sort_key" if ordered else ""))
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield [dict(row) for row in rows]
+        finally:
+            db.close()
+    
+    def student_interactions(self, student_id):
+        return self._query(
+            self._interactions_sql(where="WHERE student_id = ?") + "ORDER BY sort_key DESC",
+            (student_id, student_id)
+        )
+    
+    def interactions_after(self, timestamp, limit):
+        watermark = parse_record_time(timestamp)
+        if watermark is None:
+            return []
+        return self._query(
+            f"SELECT {SQLITE_INTERACTION_COLUMNS} FROM interactions WHERE ts > ? ORDER BY ts LIMIT ?",
+            (watermark, int(limit))
+        )
+    
+    def count(self):
+        with self._lock:
+            return self._db.execute("SELECT count(*) FROM interactions").fetchone()[0]
+    
+    def compact(self, cutoff, batch_size=COMPACTION_BATCH_SIZE):
+        compacted = 0
+        batch = "SELECT interaction_id FROM interactions WHERE ts < ? ORDER BY ts LIMIT ?"
+        parameters = (cutoff.timestamp(), int(batch_size))
+        while True:
+            # 每批在同一个事务内完成“累加到汇总 + 删除原始记录”
+            with self._transaction() as db:
+                db.execute(f"""
+                INSERT INTO interactions_daily (student_id, node_id, day, node_label, count, duration)
+                SELECT student_id, node_id, date(ts, 'unixepoch', 'localtime'), min(node_label),
+                       sum(coalesce(count, 1)), sum(coalesce(duration, 0))
+                FROM interactions
+                WHERE interaction_id IN ({batch})
+                GROUP BY student_id, node_id, date(ts, 'unixepoch', 'localtime')
+                ON CONFLICT (student_id, node_id, day) DO UPDATE SET
+                    count = count + excluded.count,
+                    duration = duration + excluded.duration
+                """, parameters)
+                deleted = db.execute(f"DELETE FROM interactions WHERE interaction_id IN ({batch})", parameters).rowcount
+            compacted += deleted
+            if deleted < batch_size:
+                return compacted
+    
+    def clear_interactions(self):
+        with self._transaction() as db:
+            db.execute("DELETE FROM interactions")
+            db.execute("DELETE FROM interactions_daily")
+    
+    def import_json_files(self, interactions_path, daily_path):
+        """一次性导入旧版JSON记录文件（仅在新建数据库时调用），返回导入条数"""
+        interactions = read_json_list(interactions_path)
+        for item in interactions:
+            # 早期记录没有 interaction_id，按 record_interaction 的规则补上
+            item.setdefault("interaction_id", f"{item['student_id']}_{item['node_id']}_{re.sub(r'[^0-9]', '', item['timestamp'])}")
+        self.write_interactions(interactions)
+        daily = read_json_list(daily_path)
+        with self._transaction() as db:
+            db.executemany("""
+            INSERT OR IGNORE INTO interactions_daily (student_id, node_id, day, node_label, count, duration)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """, [(item["student_id"], item["node_id"], item["day"], item.get("node_label"),
+                   item.get("count", 0), item.get("duration", 0)) for item in daily])
+        return len(interactions) + len(daily)
+    
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+class MemoryInteractionStore(InteractionStore):
+    """进程内存储（重启即丢失），用于测试"""
+    
+    def __init__(self):
+        self.graph = None
+        self.interactions = {}
+        self.daily = {}
+        self._lock = threading.Lock()
+    
+    def describe(self):
+        return "内存存储（重启后清空）"
+    
+    def save_graph(self, json_data):
+        self.graph = json.loads(json.dumps(json_data))
+        return True
+    
+    def clear_graph(self):
+        self.graph = None
+    
+    def apply_graph_ops(self, ops):
+        self.graph, _ = apply_graph_ops(self.graph or {"nodes": [], "relationships": []}, ops)
+        return True
+    
+    def write_interactions(self, records):
+        with self._lock:
+            for record in records:
+                self.interactions.setdefault(record["interaction_id"], dict(record))
+    
+    def _sorted(self, records, reverse):
+        return sorted(records, key=lambda record: parse_record_time(record["timestamp"]) or 0, reverse=reverse)
+    
+    def all_interactions(self):
+        with self._lock:
+            records = [dict(record) for record in self.interactions.values()]
+            for (student_id, node_id, day), entry in self.daily.items():
+                records.append({
+                    "interaction_id": None,
+                    "student_id": student_id,
+                    "node_id": node_id,
+                    "node_label": entry["node_label"],
+                    "action_type": "daily_rollup",
+                    "duration": entry["duration"],
+                    "count": entry["count"],
+                    "timestamp": day
+                })
+        return self._sorted(records, reverse=True)
+    
+    def interactions_after(self, timestamp, limit):
+        watermark = parse_record_time(timestamp)
+        if watermark is None:
+            return []
+        with self._lock:
+            records = [dict(record) for record in self.interactions.values()
+                       if (parse_record_time(record["timestamp"]) or 0) > watermark]
+        return self._sorted(records, reverse=False)[:limit]
+    
+    def count(self):
+        return len(self.interactions)
+    
+    def compact(self, cutoff, batch_size=COMPACTION_BATCH_SIZE):
+        cutoff_ts = cutoff.timestamp()
+        with self._lock:
+            expired = [(record, parse_record_time(record["timestamp"]) or 0) for record in self.interactions.values()]
+            expired = [(record, ts) for record, ts in expired if ts < cutoff_ts]
+            for record, ts in expired:
+                day = datetime.fromtimestamp(ts).strftime("%Y-%m-%d")
+                entry = self.daily.setdefault((record["student_id"], record["node_id"], day), {
+                    "node_label": record.get("node_label", ""),
+                    "count": 0,
+                    "duration": 0
+                })
+                entry["count"] += record.get("count") or 1
+                entry["duration"] += record.get("duration") or 0
+                del self.interactions[record["interaction_id"]]
+        return len(expired)
+    
+    def clear_interactions(self):
+        with self._lock:
+            self.interactions.clear()
+            self.daily.clear()
+
+def open_sqlite_store(path=STORAGE_FILE):
+    """打开本地SQLite存储；新建数据库时导入旧版JSON记录文件"""
+    fresh = not os.path.exists(path)
+    store = SqliteInteractionStore(path)
+    if fresh:
+        store.import_json_files(INTERACTIONS_FILE, INTERACTIONS_DAILY_FILE)
+    return store
+
+@st.cache_resource
+def get_interaction_store():
+    """按 STORAGE_BACKEND 创建进程内共享的存储后端"""
+    if STORAGE_BACKEND == "memory":
+        return MemoryInteractionStore()
+    if STORAGE_BACKEND == "sqlite":
+        return open_sqlite_store()
+    # Neo4j后端：本地SQLite副本打不开时只用Neo4j
+    try:
+        mirror = open_sqlite_store()
+    except sqlite3.Error:
+        mirror = None
+    return Neo4jInteractionStore(get_connection(), mirror)
+
+# ==================== 交互写入限流 ====================
+class TokenBucket:
+    """令牌桶：按固定速度补充令牌，容量决定允许的突发量"""
+    
+    def __init__(self, rate, capacity, now=None):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic() if now is None else now
+    
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + max(now - self.updated, 0) * self.rate)
+        self.updated = max(now, self.updated)
+    
+    def idle(self, now):
+        """已补满（与新建的桶等价），可以回收"""
+        return self.tokens + (now - self.updated) * self.rate >= self.capacity
+
+class IngestionLimiter:
+    """交互写入的准入控制：每个学生、每个会话各一个令牌桶，再加一个全局令牌桶，都有余量才允许写入。
+    会话桶防止同一客户端不断更换登录名绕过个人限额"""
+    
+    def __init__(self, student_rate=INGEST_STUDENT_RATE, student_burst=INGEST_STUDENT_BURST,
+                 global_rate=INGEST_GLOBAL_RATE, global_burst=INGEST_GLOBAL_BURST):
+        self.student_rate = student_rate
+        self.student_burst = student_burst
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self.stats = {"admitted": 0, "dropped_student": 0, "dropped_global": 0, "dropped_client": 0}
+        self.dropped_by_student = Counter()
+        self._buckets = {}
+        self._lock = threading.Lock()
+    
+    def admit(self, student_id, session_key, now=None):
+        """尝试为一条记录取得令牌，返回是否允许写入"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            buckets = [self._bucket(("student", student_id), now), self._bucket(("session", session_key), now)]
+            self.global_bucket.refill(now)
+            if any(bucket.tokens < 1 for bucket in buckets):
+                self._drop("dropped_student", student_id)
+                return False
+            if self.global_bucket.tokens < 1:
+                self._drop("dropped_global", student_id)
+                return False
+            for bucket in buckets + [self.global_bucket]:
+                bucket.tokens -= 1
+            self.stats["admitted"] += 1
+            return True
+    
+    def _bucket(self, key, now):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= 10000:
+                self._prune(now)
+            bucket = self._buckets[key] = TokenBucket(self.student_rate, self.student_burst, now)
+        bucket.refill(now)
+        return bucket
+    
+    def reject(self, student_id, count):
+        """记录在进入令牌桶之前就被丢弃的记录（如浏览器一次提交过多）"""
+        if count > 0:
+            with self._lock:
+                self._drop("dropped_client", student_id, count)
+    
+    def _drop(self, reason, student_id, count=1):
+        self.stats[reason] += count
+        self.dropped_by_student[student_id] += count
+    
+    def _prune(self, now):
+        for key in [key for key, bucket in self._buckets.items() if bucket.idle(now)]:
+            del self._buckets[key]
+    
+    def dropped_total(self):
+        return self.stats["dropped_student"] + self.stats["dropped_global"] + self.stats["dropped_client"]
+
+@st.cache_resource
+def get_ingestion_limiter():
+    """进程内共享的写入限流器"""
+    return IngestionLimiter()
+
+# ==================== 交互记录发件箱 ====================
+class InteractionOutbox:
+    """本地SQLite（WAL模式）发件箱：点击路径只写本地，后台线程按批同步到Neo4j"""
+    
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("""
+        CREATE TABLE IF NOT EXISTS outbox (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            interaction_id TEXT UNIQUE NOT NULL,
+            payload TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            delivered_at REAL
+        )
+        """)
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_outbox_pending ON outbox(seq) WHERE delivered_at IS NULL")
+    
+    def append(self, record):
+        """写入一条待同步记录（按 interaction_id 去重）"""
+        with self._lock:
+            self._db.execute(
+                "INSERT OR IGNORE INTO outbox (interaction_id, payload, created_at) VALUES (?, ?, ?)",
+                (record["interaction_id"], json.dumps(record, ensure_ascii=False), time.time())
+            )
+    
+    def pending(self, limit):
+        """按写入顺序取出尚未同步的记录，返回 [(seq, record)]"""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT seq, payload FROM outbox WHERE delivered_at IS NULL ORDER BY seq LIMIT ?",
+                (limit,)
+            ).fetchall()
+        return [(seq, json.loads(payload)) for seq, payload in rows]
+    
+    # 快照：取快照时尚未同步的记录，读取期间被同步的仍算在内，保证与存储中的记录去重时前后一致
+    SNAPSHOT_CONDITION = "seq BETWEEN ? AND ? AND (delivered_at IS NULL OR delivered_at >= ?)"
+    
+    def pending_snapshot(self, until_seq=None):
+        """记下当前未同步记录的范围 (最小序号, 最大序号, 时间)，之后按快照分块读取；until_seq 限定最大序号"""
+        started = time.time()
+        with self._lock:
+            first, last = self._db.execute(
+                "SELECT min(seq), max(seq) FROM outbox WHERE delivered_at IS NULL"
+            ).fetchone()
+        last = last or -1
+        if until_seq is not None:
+            last = min(last, until_seq)
+        return (first or 0, last, started)
+    
+    def iter_pending(self, snapshot, chunk_size, student_id=None):
+        """按写入顺序分块读取快照中的记录（内存按块计，不随积压量增长）"""
+        first, last, started = snapshot
+        after = first - 1
+        while True:
+            query = f"SELECT seq, payload FROM outbox WHERE seq > ? AND {self.SNAPSHOT_CONDITION}"
+            params = [after, first, last, started]
+            if student_id is not None:
+                query += " AND json_extract(payload, '$.student_id') = ?"
+                params.append(student_id)
+            with self._lock:
+                rows = self._db.execute(query + " ORDER BY seq LIMIT ?", params + [chunk_size]).fetchall()
+            if not rows:
+                return
+            after = rows[-1][0]
+            yield [json.loads(payload) for _, payload in rows]
+    
+    def in_snapshot(self, snapshot, interaction_ids):
+        """给定的ID中属于快照的部分（这些记录以发件箱为准，存储中读到的要去掉）"""
+        first, last, started = snapshot
+        found = set()
+        for chunk in iter_chunks((item for item in interaction_ids if item), 500):
+            with self._lock:
+                rows = self._db.execute(
+                    f"SELECT interaction_id FROM outbox WHERE {self.SNAPSHOT_CONDITION} "
+                    f"AND interaction_id IN ({', '.join('?' * len(chunk))})",
+                    [first, last, started] + chunk
+                ).fetchall()
+            found.update(row[0] for row in rows)
+        return found
+    
+    def ids_after(self, seq, interaction_ids):
+        """给定的ID中序号大于水位线的部分（这些记录由增量读取负责）"""
+        found = set()
+        for chunk in iter_chunks((item for item in interaction_ids if item), 500):
+            with self._lock:
+                rows = self._db.execute(
+                    f"SELECT interaction_id FROM outbox WHERE seq > ? AND interaction_id IN ({', '.join('?' * len(chunk))})",
+                    [seq] + chunk
+                ).fetchall()
+            found.update(row[0] for row in rows)
+        return found
+    
+    def mark_delivered(self, seqs):
+        with self._lock:
+            self._db.executemany(
+                "UPDATE outbox SET delivered_at = ? WHERE seq = ?",
+                [(time.time(), seq) for seq in seqs]
+            )
+    
+    def lag(self):
+        """未同步记录数和最早一条的等待秒数"""
+        with self._lock:
+            count, oldest = self._db.execute(
+                "SELECT count(*), min(created_at) FROM outbox WHERE delivered_at IS NULL"
+            ).fetchone()
+        return {"pending": count, "oldest_age": round(time.time() - oldest, 1) if oldest else 0}
+    
+    def last_seq(self):
+        """已分配的最大序号（已清理的记录也算在内），作为实时增量读取的水位线"""
+        with self._lock:
+            return self._db.execute(
+                "SELECT coalesce((SELECT seq FROM sqlite_sequence WHERE name = 'outbox'), 0)"
+            ).fetchone()[0]
+    
+    def since(self, seq, limit):
+        """读取序号大于水位线的新记录（无论是否已同步），返回 [(seq, record)]"""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT seq, payload FROM outbox WHERE seq > ? ORDER BY seq LIMIT ?",
+                (seq, limit)
+            ).fetchall()
+        return [(seq, json.loads(payload)) for seq, payload in rows]
+    
+    def clear(self):
+        """清空发件箱（清除访问记录时调用，避免未同步的记录在清除后又被写回）"""
+        with self._lock:
+            self._db.execute("DELETE FROM outbox")
+    
+    def prune_delivered(self, before):
+        """删除早于指定时间且已同步的记录"""
+        with self._lock:
+            cursor = self._db.execute(
+                "DELETE FROM outbox WHERE delivered_at IS NOT NULL AND created_at < ?",
+                (before,)
+            )
+        return cursor.rowcount
+
+@st.cache_resource
+def get_outbox():
+    """进程内共享的发件箱，打开失败时返回None（退回同步写入Neo4j）"""
+    try:
+        return InteractionOutbox(OUTBOX_FILE)
+    except sqlite3.Error:
+        return None
+
+class OutboxReplayer:
+    """后台同步线程：把发件箱中的记录分批投递到存储后端，并统计同步延迟"""
+    
+    def __init__(self, store, outbox):
+        self.store = store
+        self.outbox = outbox
+        self.delivered_total = 0
+        self.last_success_at = None
+        self.last_error = None
+        self.batch_size = OUTBOX_BATCH_SIZE
+        self.last_write_seconds = None
+        self.lock = threading.Lock()  # 投递一批期间持有，清除记录时借此等待正在投递的批次完成
+        self._thread = threading.Thread(target=self._run, name="outbox-replayer", daemon=True)
+        self._thread.start()
+    
+    def _run(self):
+        backoff = OUTBOX_REPLAY_INTERVAL
+        while True:
+            try:
+                batch_size = self.batch_size
+                delivered = self.replay_once()
+                backoff = OUTBOX_REPLAY_INTERVAL
+                if delivered >= batch_size:
+                    continue  # 积压时连续投递，不等待
+            except Exception as e:
+                self.last_error = f"{datetime.now().strftime('%H:%M:%S')} {e}"
+                backoff = min(backoff * 2, 60)
+            time.sleep(backoff)
+    
+    def replay_once(self):
+        """投递一批记录，返回投递条数；存储不可用时不做任何事"""
+        with self.lock:
+            return self._replay_batch()
+    
+    def _replay_batch(self):
+        if not self.store.available():
+            return 0
+        batch = self.outbox.pending(self.batch_size)
+        if not batch:
+            return 0
+        started = time.perf_counter()
+        try:
+            self.store.write_interactions([record for _, record in batch])
+        except Exception:
+            self.batch_size = max(OUTBOX_MIN_BATCH_SIZE, self.batch_size // 2)
+            raise
+        self.last_write_seconds = time.perf_counter() - started
+        self.adjust_batch_size(self.last_write_seconds)
+        self.outbox.mark_delivered([seq for seq, _ in batch])
+        # 去重窗口之前已同步的记录不再需要，发件箱大小随窗口而非累计记录数增长
+        self.outbox.prune_delivered(time.time() - OUTBOX_DEDUP_SECONDS)
+        self.delivered_total += len(batch)
+        self.last_success_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        return len(batch)
+    
+    def adjust_batch_size(self, seconds):
+        """按写入耗时调整批大小：超过目标耗时减半，明显低于目标时逐步增大（积压时数据库负载保持平稳）"""
+        if seconds > OUTBOX_TARGET_WRITE_SECONDS:
+            self.batch_size = max(OUTBOX_MIN_BATCH_SIZE, self.batch_size // 2)
+        elif seconds < OUTBOX_TARGET_WRITE_SECONDS / 2:
+            self.batch_size = min(OUTBOX_BATCH_SIZE, self.batch_size + OUTBOX_MIN_BATCH_SIZE)
+    
+    def status(self):
+        status = self.outbox.lag()
+        status.update({
+            "batch_size": self.batch_size,
+            "last_write_ms": round(self.last_write_seconds * 1000, 1) if self.last_write_seconds is not None else None,
+            "delivered_total": self.delivered_total,
+            "last_success_at": self.last_success_at,
+            "last_error": self.last_error
+        })
+        return status
+
+@st.cache_resource
+def start_outbox_replayer(_store, _outbox):
+    """每个进程只启动一个同步线程"""
+    return OutboxReplayer(_store, _outbox)
+
+# ==================== CPU密集任务进程池 ====================
+# 允许在子进程中执行的函数（按名称调用，子进程通过导入本模块找到它们）
+WORKER_FUNCTIONS = {"render_graph_html", "serialize_graph_payload", "build_client_payload", "time_analytics_job", "build_ppr_table"}
+
+def call_worker_function(fn_name, *args):
+    """子进程入口：按名称调用白名单中的函数"""
+    if fn_name not in WORKER_FUNCTIONS:
+        raise ValueError(f"不允许在进程池中执行: {fn_name}")
+    return globals()[fn_name](*args)
+
+class WorkerPool:
+    """CPU密集任务的共享进程池：相同输入的任务在计算期间只提交一次；进程池不可用时退回当前线程执行。
+    结果由调用方缓存（快照、推荐模型、st.cache_data），任务完成后进程池不再保留"""
+    
+    def __init__(self, workers=WORKER_PROCESSES):
+        self.workers = workers
+        self.stats = {"submitted": 0, "shared": 0, "inline": 0}
+        self._executor = None
+        self._entry = None
+        self._futures = {}  # 计算中的任务：键 -> future
+        self._lock = threading.Lock()
+    
+    def _get_executor(self):
+        if self._executor is None:
+            import importlib
+            import multiprocessing
+            
+            # Streamlit把脚本当作 __main__ 执行，其中的函数无法跨进程引用；
+            # 改为以普通模块导入本文件，子进程按模块名找到入口函数
+            if current_dir not in sys.path:
+                sys.path.insert(0, current_dir)
+            module = importlib.import_module(os.path.splitext(os.path.basename(__file__))[0])
+            self._entry = module.call_worker_function
+            # spawn 方式启动，避免在多线程的Streamlit进程中 fork
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._executor
+    
+    def submit(self, fn_name, *args, cache_key=None):
+        """提交任务并返回future；cache_key 缺省时按参数的pickle哈希计算，相同键的任务未完成时共用同一个future"""
+        if self.workers < 1:
+            return self._run_inline(fn_name, *args)
+        if cache_key is None:
+            cache_key = hashlib.sha1(pickle.dumps((fn_name, args), protocol=pickle.HIGHEST_PROTOCOL)).hexdigest()
+        with self._lock:
+            future = self._futures.get(cache_key)
+            if future is not None:
+                self.stats["shared"] += 1
+                return future
+            try:
+                future = self._get_executor().submit(self._entry, fn_name, *args)
+                self.stats["submitted"] += 1
+                self._futures[cache_key] = future
+            except (BrokenProcessPool, RuntimeError, OSError, ImportError):
+                self._executor = None
+                future = None
+        if future is None:
+            # 在锁外计算，不阻塞其他会话提交任务
+            return self._run_inline(fn_name, *args)
+        future.add_done_callback(lambda done: self._forget(cache_key, done))
+        return future
+    
+    def _forget(self, cache_key, future):
+        with self._lock:
+            if self._futures.get(cache_key) is future:
+                del self._futures[cache_key]
+    
+    def result(self, future, fn_name, *args):
+        """等待结果；进程池崩溃或参数无法序列化时在当前线程重算，任务本身抛出的异常照常传给调用方"""
+        try:
+            return future.result()
+        except (BrokenProcessPool, pickle.PicklingError):
+            with self._lock:
+                self._executor = None
+            return self._run_inline(fn_name, *args).result()
+    
+    def run(self, fn_name, *args, cache_key=None):
+        return self.result(self.submit(fn_name, *args, cache_key=cache_key), fn_name, *args)
+    
+    def _run_inline(self, fn_name, *args):
+        with self._lock:
+            self.stats["inline"] += 1
+        future = Future()
+        try:
+            future.set_result(call_worker_function(fn_name, *args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+@st.cache_resource
+def get_worker_pool():
+    """进程内共享的进程池（首次提交任务时才启动子进程）"""
+    return WorkerPool()
 
 # ==================== 数据初始化 ====================
-def clear_all_data(conn):
+def clear_interaction_records(store):
+    """清除存储后端、本地副本和发件箱中的全部交互记录（先等待正在投递的批次，避免清除后又被写回）"""
+    outbox = get_outbox()
+    try:
+        if outbox is None:
+            store.clear_interactions()
+            if store.mirror is not None:
+                store.mirror.clear_interactions()
+            return
+        with start_outbox_replayer(store, outbox).lock:
+            outbox.clear()
+            store.clear_interactions()
+            if store.mirror is not None:
+                store.mirror.clear_interactions()
+    finally:
+        get_data_generation().bump()
+
+def clear_all_data(store):
     """清除所有图形和数据（包括知识图谱和交互记录）"""
-    if not conn.driver:
+    if not store.available():
         return False
     
     try:
-        # 清除知识图谱数据
-        conn.execute_write(f"MATCH (n:{TARGET_LABEL}) DETACH DELETE n")
-        
-        # 清除交互记录
-        conn.execute_write(f"MATCH (n:Interaction_{TARGET_LABEL}) DELETE n")
-        
+        store.clear_graph()
+        clear_interaction_records(store)
         return True
     except Exception as e:
         st.error(f"清除数据时出错: {e}")
         return False
 
-def clear_local_files():
-    """清除本地文件"""
+def clear_local_files(store):
+    """清除本地文件和本地副本中的交互记录"""
     try:
-        # 清除交互记录文件
-        if os.path.exists(INTERACTIONS_FILE):
-            os.remove(INTERACTIONS_FILE)
+        # 清除旧版交互记录文件
+        for path in (INTERACTIONS_FILE, INTERACTIONS_DAILY_FILE):
+            if os.path.exists(path):
+                os.remove(path)
+        
+        if store.mirror is not None:
+            store.mirror.clear_interactions()
+            get_data_generation().bump()
         
         # 清除临时图形文件
         graph_path = os.path.join(current_dir, "temp_graph.html")
@@ -107,51 +1311,6 @@ def clear_local_files():
         st.error(f"清除本地文件时出错: {e}")
         return False
 
-def init_neo4j_data(conn, json_data):
-    """将JSON数据导入Neo4j"""
-    if not conn.driver:
-        return False
-    
-    # 清除旧数据
-    conn.execute_write(f"MATCH (n:{TARGET_LABEL}) DETACH DELETE n")
-    
-    # 创建节点
-    for node in json_data.get("nodes", []):
-        query = f"""
-        CREATE (n:{TARGET_LABEL}:KnowledgeNode {{
-            node_id: $node_id,
-            label: $label,
-            category: $category,
-            level: $level,
-            type: $type,
-            properties: $properties
-        }})
-        """
-        conn.execute_write(query, {
-            "node_id": node["id"],
-            "label": node["label"],
-            "category": node["category"],
-            "level": node["level"],
-            "type": node["type"],
-            "properties": json.dumps(node["properties"], ensure_ascii=False)
-        })
-    
-    # 创建关系
-    for rel in json_data.get("relationships", []):
-        query = f"""
-        MATCH (a:{TARGET_LABEL} {{node_id: $source}})
-        MATCH (b:{TARGET_LABEL} {{node_id: $target}})
-        CREATE (a)-[r:RELATES {{type: $rel_type, properties: $properties}}]->(b)
-        """
-        conn.execute_write(query, {
-            "source": rel["source"],
-            "target": rel["target"],
-            "rel_type": rel.get("type", "关联"),
-            "properties": json.dumps(rel.get("properties", {}), ensure_ascii=False)
-        })
-    
-    return True
-
 def create_new_data_warehouse():
     """创建新的空白数据仓库结构"""
     new_data = {
@@ -172,140 +1331,685 @@ def save_json_data(data, filepath=None):
         filepath = JSON_FILE_PATH
     
     try:
-        with open(filepath, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+        write_json_atomic(filepath, data)
         return True
     except Exception as e:
         st.error(f"保存文件时出错: {e}")
         return False
 
-def init_interaction_table(conn):
-    """初始化交互记录表（在Neo4j中创建约束）"""
-    if not conn.driver:
-        return
+def record_interaction(store, student_id, node_id, node_label, action_type, duration=0, count=1, timestamp=None):
+    """记录学生交互行为（写入发件箱，由后台线程同步到存储后端）；count 为合并的重复查看次数"""
+    if timestamp is None:
+        timestamp = datetime.now()
+    interaction_id = f"{student_id}_{node_id}_{timestamp.strftime('%Y%m%d%H%M%S%f')}"
+    record = {
+        "interaction_id": interaction_id,
+        "student_id": student_id,
+        "node_id": node_id,
+        "node_label": node_label,
+        "action_type": action_type,
+        "duration": duration,
+        "count": count,
+        "timestamp": timestamp.astimezone().isoformat()
+    }
+    
+    # 先写入本地发件箱，由后台线程同步到存储后端；发件箱不可用时才同步写入
+    outbox = get_outbox()
     try:
-        conn.execute_write(f"""
-        CREATE CONSTRAINT IF NOT EXISTS FOR (n:Interaction_{TARGET_LABEL}) 
-        REQUIRE n.interaction_id IS UNIQUE
-        """)
-    except:
-        pass
+        if outbox is None:
+            raise sqlite3.Error("outbox unavailable")
+        outbox.append(record)
+    except sqlite3.Error:
+        if store.available():
+            store.write_interactions([record])
+    
+    # 远程存储同时写一份本地副本（远程不可用时由副本提供数据）
+    if store.mirror is not None:
+        try:
+            store.mirror.write_interactions([record])
+        except sqlite3.Error:
+            pass  # 静默失败
 
-def record_interaction(conn, student_id, node_id, node_label, action_type, duration=0):
-    """记录学生交互行为（支持Neo4j和本地文件双模式）"""
-    timestamp = datetime.now()
-    
-    # 尝试记录到Neo4j
-    if conn.driver:
-        interaction_id = f"{student_id}_{node_id}_{timestamp.strftime('%Y%m%d%H%M%S%f')}"
-        query = f"""
-        CREATE (i:Interaction_{TARGET_LABEL} {{
-            interaction_id: $interaction_id,
-            student_id: $student_id,
-            node_id: $node_id,
-            node_label: $node_label,
-            action_type: $action_type,
-            duration: $duration,
-            timestamp: datetime()
-        }})
-        """
-        conn.execute_write(query, {
-            "interaction_id": interaction_id,
-            "student_id": student_id,
-            "node_id": node_id,
-            "node_label": node_label,
-            "action_type": action_type,
-            "duration": duration
-        })
+def read_json_list(path):
+    """读取JSON列表文件，文件不存在时返回空列表"""
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def iter_interaction_chunks(store, chunk_size=STREAM_CHUNK_SIZE, ordered=False, until_seq=None):
+    """分块读取全部交互记录，最后补上发件箱中尚未同步的记录（内存占用按块计，不随总量增长）。
+    给定 until_seq 时只包含发件箱序号不超过它的记录，之后的记录由调用方按水位线增量读取"""
+    outbox = get_outbox()
+    snapshot = outbox.pending_snapshot(until_seq) if outbox else None
+    for chunk in store.iter_interactions(chunk_size, ordered):
+        # 读取期间可能有记录刚同步到存储，以发件箱快照中的为准去重（每块只查询本块的ID）
+        if snapshot:
+            chunk_ids = [record.get("interaction_id") for record in chunk]
+            pending_ids = outbox.in_snapshot(snapshot, chunk_ids)
+            if until_seq is not None:
+                pending_ids |= outbox.ids_after(until_seq, chunk_ids)
+            if pending_ids:
+                chunk = [record for record in chunk if record.get("interaction_id") not in pending_ids]
+        if chunk:
+            yield chunk
+    if snapshot:
+        for chunk in outbox.iter_pending(snapshot, chunk_size):
+            yield [dict((key, record[key]) for key in INTERACTION_FIELDS) for record in chunk]
+
+def iter_interaction_frames(store, chunk_size=STREAM_CHUNK_SIZE, ordered=False):
+    """同 iter_interaction_chunks，每块转换为DataFrame"""
+    import pandas as pd
     
-    # 同时记录到本地文件（作为备份或在无Neo4j时使用）
-    try:
-        # 确保目录存在
-        os.makedirs(os.path.dirname(INTERACTIONS_FILE), exist_ok=True)
-        
-        # 读取现有记录
-        if os.path.exists(INTERACTIONS_FILE):
-            with open(INTERACTIONS_FILE, 'r', encoding='utf-8') as f:
-                interactions = json.load(f)
-        else:
-            interactions = []
-        
-        # 添加新记录
-        interactions.append({
-            "student_id": student_id,
-            "node_id": node_id,
-            "node_label": node_label,
-            "action_type": action_type,
-            "duration": duration,
-            "timestamp": timestamp.strftime('%Y-%m-%d %H:%M:%S')
-        })
-        
-        # 保存到文件
-        with open(INTERACTIONS_FILE, 'w', encoding='utf-8') as f:
-            json.dump(interactions, f, ensure_ascii=False, indent=2)
-    except Exception as e:
-        pass  # 静默失败
+    for chunk in iter_interaction_chunks(store, chunk_size, ordered):
+        yield normalize_count_column(pd.DataFrame(chunk, columns=INTERACTION_FIELDS))
 
-def get_all_interactions(conn):
-    """获取所有交互记录（优先从Neo4j，否则从本地文件）"""
-    # 尝试从Neo4j获取
-    if conn.driver:
-        query = f"""
-        MATCH (i:Interaction_{TARGET_LABEL})
-        RETURN i.student_id as student_id, 
-               i.node_id as node_id,
-               i.node_label as node_label,
-               i.action_type as action_type,
-               i.duration as duration,
-               toString(i.timestamp) as timestamp
-        ORDER BY i.timestamp DESC
-        """
-        result = conn.execute_query(query)
-        if result:
-            return result
+def get_student_interactions(store, student_id):
+    """获取特定学生的交互记录（含发件箱中尚未同步的记录）"""
+    result = store.student_interactions(student_id)
+    outbox = get_outbox()
+    if outbox:
+        seen = {record["interaction_id"] for record in result if record.get("interaction_id")}
+        for chunk in outbox.iter_pending(outbox.pending_snapshot(), STREAM_CHUNK_SIZE, student_id=student_id):
+            result.extend(
+                dict((key, record[key]) for key in INTERACTION_FIELDS)
+                for record in chunk
+                if record["interaction_id"] not in seen
+            )
+    return result
+
+# ==================== 访问记录保留与压缩 ====================
+class DataGeneration:
+    """交互数据的代次：清除、压缩访问记录后递增，按记录增量累计的聚合器随代次重建"""
     
-    # 从本地文件获取
-    try:
-        if os.path.exists(INTERACTIONS_FILE):
-            with open(INTERACTIONS_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
-    except:
-        pass
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
     
-    return []
+    def bump(self):
+        with self._lock:
+            self.value += 1
+            return self.value
 
-def get_student_interactions(conn, student_id):
-    """获取特定学生的交互记录"""
-    if not conn.driver:
-        return []
-    query = f"""
-    MATCH (i:Interaction_{TARGET_LABEL} {{student_id: $student_id}})
-    RETURN i.node_id as node_id,
-           i.node_label as node_label,
-           i.action_type as action_type,
-           i.duration as duration,
-           toString(i.timestamp) as timestamp
-    ORDER BY i.timestamp DESC
-    """
-    return conn.execute_query(query, {"student_id": student_id})
+@st.cache_resource
+def get_data_generation():
+    """进程内共享的数据代次"""
+    return DataGeneration()
+
+def compact_interactions(store, retention_days=INTERACTION_RETENTION_DAYS, batch_size=COMPACTION_BATCH_SIZE):
+    """把超过保留期的原始访问记录汇总为每日（学生×节点）聚合，并分批删除原始记录"""
+    cutoff = datetime.now() - timedelta(days=retention_days)
+    stats = {"compacted": store.compact(cutoff, batch_size), "local_compacted": 0}
+    if store.mirror is not None:
+        stats["local_compacted"] = store.mirror.compact(cutoff, batch_size)
+    
+    # 已同步的发件箱记录同样只保留保留期内的
+    outbox = get_outbox()
+    if outbox:
+        outbox.prune_delivered(cutoff.timestamp())
+    if stats["compacted"] or stats["local_compacted"]:
+        get_data_generation().bump()
+    return stats
+
+def write_json_atomic(path, data):
+    """先写临时文件再替换，避免写到一半时留下损坏的JSON"""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+# ==================== 会话级点击缓冲 ====================
+def get_session_key():
+    """本会话的随机标识（进程级的缓冲登记表、限流等按会话区分）"""
+    if "session_key" not in st.session_state:
+        st.session_state.session_key = hashlib.sha1(os.urandom(16)).hexdigest()[:16]
+    return st.session_state.session_key
+
+def write_buffered_view(store, pending, now=None):
+    """把一条缓冲的查看合并为一条记录写入"""
+    if now is None:
+        now = time.time()
+    # 浏览时长：从首次查看到离开；离开时间未知时最多按窗口期估算
+    end = min(now, pending["last_at"] + CLICK_DEBOUNCE_SECONDS)
+    record_interaction(
+        store,
+        pending["student_id"],
+        pending["node_id"],
+        pending["node_label"],
+        pending["action_type"],
+        duration=round(max(end - pending["first_at"], 0), 1),
+        count=pending["count"],
+        timestamp=datetime.fromtimestamp(pending["first_at"])
+    )
+
+class PendingViewRegistry:
+    """进程级的会话点击缓冲登记表：后台线程定时写入超过窗口期的缓冲，会话没有退出登录就关闭时最后一次浏览也不会丢失"""
+    
+    def __init__(self, store, interval=PENDING_SWEEP_SECONDS):
+        self.store = store
+        self.interval = interval
+        self.swept_total = 0
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="pending-view-sweeper", daemon=True)
+        self._thread.start()
+    
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.swept_total += self.flush_expired()
+            except Exception:
+                pass  # 静默失败，下一轮重试
+    
+    def get(self, session_key):
+        with self._lock:
+            pending = self._pending.get(session_key)
+            return dict(pending) if pending else None
+    
+    def merge(self, session_key, student_id, node_id, action_type, now):
+        """窗口期内对同一节点的重复查看只累加次数，返回是否已合并"""
+        with self._lock:
+            pending = self._pending.get(session_key)
+            if (pending
+                    and pending["student_id"] == student_id
+                    and pending["node_id"] == node_id
+                    and pending["action_type"] == action_type
+                    and now - pending["last_at"] <= CLICK_DEBOUNCE_SECONDS):
+                pending["count"] += 1
+                pending["last_at"] = max(pending["last_at"], now)
+                return True
+            return False
+    
+    def replace(self, session_key, pending):
+        """登记新的缓冲（None表示清空），返回被替换下来的旧缓冲，由调用方写入"""
+        with self._lock:
+            previous = self._pending.pop(session_key, None)
+            if pending is not None:
+                self._pending[session_key] = pending
+            return previous
+    
+    def flush(self, session_key, now=None):
+        """写入该会话的缓冲"""
+        previous = self.replace(session_key, None)
+        if previous:
+            write_buffered_view(self.store, previous, now)
+    
+    def flush_expired(self, now=None):
+        """写入所有超过窗口期未再更新的缓冲，返回写入条数"""
+        if now is None:
+            now = time.time()
+        with self._lock:
+            expired = [key for key, pending in self._pending.items() if now - pending["last_at"] > CLICK_DEBOUNCE_SECONDS]
+            views = [self._pending.pop(key) for key in expired]
+        for pending in views:
+            write_buffered_view(self.store, pending, now)
+        return len(views)
+
+@st.cache_resource
+def get_pending_views(_store):
+    """每个进程只有一个缓冲登记表和后台写入线程"""
+    return PendingViewRegistry(_store)
+
+def buffer_interaction(store, student_id, node_id, node_label, action_type="view", at=None):
+    """会话级点击缓冲：窗口期内对同一节点的重复查看只累加次数，切换节点时才写入上一条。
+    客户端事件在这里进入写入流程：只有产生新记录的查看才消耗限流令牌（合并到缓冲的重复查看不计），
+    超过限流时直接丢弃并返回False，已缓冲的查看写入时不再限流"""
+    session_key = get_session_key()
+    now = at if at is not None else time.time()
+    registry = get_pending_views(store)
+    if registry.merge(session_key, student_id, node_id, action_type, now):
+        return True
+    if not get_ingestion_limiter().admit(student_id, session_key):
+        return False
+    
+    observe_student_view(student_id, node_id)
+    previous = registry.replace(session_key, {
+        "student_id": student_id,
+        "node_id": node_id,
+        "node_label": node_label,
+        "action_type": action_type,
+        "count": 1,
+        "first_at": now,
+        "last_at": now
+    })
+    if previous:
+        write_buffered_view(store, previous, now)
+    return True
+
+def flush_interaction_buffer(store, now=None):
+    """把缓冲中的查看合并为一条记录写入（换节点、退出登录或超时时调用）"""
+    get_pending_views(store).flush(get_session_key(), now)
+
+def flush_expired_buffer(store):
+    """缓冲超过窗口期未再更新时写入（后台线程也会定时检查，这里让本会话的记录更及时）"""
+    registry = get_pending_views(store)
+    session_key = get_session_key()
+    pending = registry.get(session_key)
+    if pending and time.time() - pending["last_at"] > CLICK_DEBOUNCE_SECONDS:
+        registry.flush(session_key)
+
+def parse_client_timestamp(value, now=None):
+    """解析前端记录的ISO时间戳为本地时间秒数；浏览器时间可被篡改，只接受最近一个合并窗口内的时间，
+    解析失败或超出范围（伪造的未来时间、回填到保留期之前等）时返回None，由调用方使用服务器时间"""
+    if now is None:
+        now = time.time()
+    try:
+        at = datetime.fromisoformat(value).timestamp()
+    except (TypeError, ValueError, OverflowError, OSError):
+        return None
+    if not now - CLICK_DEBOUNCE_SECONDS <= at <= now:
+        return None
+    return at
 
 # ==================== 加载JSON数据 ====================
-@st.cache_data
 def load_json_data():
-    """加载知识图谱JSON数据"""
+    """加载知识图谱JSON数据（当前版本）"""
+    graph_store = get_graph_store()
+    return graph_store.snapshot["json_data"] if graph_store else None
+
+# ==================== 图谱数据校验 ====================
+NODE_FIELDS = ("id", "label", "category", "level", "type", "properties")
+
+def check_node(node, node_ids):
+    """检查单个节点，返回 (补全默认值后的节点, 错误原因)；type/properties 缺失时补默认值，其余字段缺失或类型错误视为坏记录"""
+    if not isinstance(node, dict):
+        return None, "节点不是对象"
+    node_id = node.get("id")
+    if not isinstance(node_id, str) or not node_id:
+        return None, "缺少节点ID"
+    if node_id in node_ids:
+        return None, f"节点ID重复: {node_id}"
+    if not isinstance(node.get("label"), str) or not node["label"]:
+        return None, f"节点缺少名称: {node_id}"
+    if not isinstance(node.get("category"), str) or not node["category"]:
+        return None, f"节点缺少类别: {node_id}"
+    level = node.get("level")
+    if isinstance(level, bool) or not isinstance(level, int) or level < 1:
+        return None, f"节点层级不是正整数: {node_id}"
+    if not isinstance(node.get("type", ""), str):
+        return None, f"节点类型不是字符串: {node_id}"
+    if not isinstance(node.get("properties", {}), dict):
+        return None, f"节点属性不是对象: {node_id}"
+    if "type" not in node or "properties" not in node:
+        node = dict(node, type=node.get("type", ""), properties=node.get("properties", {}))
+    return node, None
+
+def check_relationship(rel, node_ids):
+    """检查单条关系，返回 (补全默认值后的关系, 错误原因)；两端节点必须存在"""
+    if not isinstance(rel, dict):
+        return None, "关系不是对象"
+    for endpoint in (rel.get("source"), rel.get("target")):
+        if endpoint not in node_ids:
+            return None, f"关系端点不存在: {endpoint}"
+    if not isinstance(rel.get("type", "关联"), str):
+        return None, "关系类型不是字符串"
+    if not isinstance(rel.get("properties", {}), dict):
+        return None, "关系属性不是对象"
+    if "type" not in rel or "properties" not in rel:
+        rel = dict(rel, type=rel.get("type", "关联"), properties=rel.get("properties", {}))
+    return rel, None
+
+def validate_graph(json_data):
+    """一次遍历校验图谱：坏记录移入隔离区（保存在 quarantine 字段中，随下次保存写回文件，不会丢失），
+    同时生成 ID→序号映射、出入度和邻接表。返回 (校验后的图谱, 索引, 本次新隔离的记录)"""
+    nodes = []
+    position = {}
+    quarantined = []
+    for node in json_data.get("nodes", []):
+        checked, reason = check_node(node, position)
+        if reason:
+            quarantined.append({"kind": "node", "reason": reason, "record": node})
+            continue
+        position[checked["id"]] = len(nodes)
+        nodes.append(checked)
+    
+    relationships = []
+    out_degree = [0] * len(nodes)
+    in_degree = [0] * len(nodes)
+    out_neighbors = [[] for _ in nodes]
+    in_neighbors = [[] for _ in nodes]
+    for rel in json_data.get("relationships", []):
+        checked, reason = check_relationship(rel, position)
+        if reason:
+            quarantined.append({"kind": "relationship", "reason": reason, "record": rel})
+            continue
+        source, target = position[checked["source"]], position[checked["target"]]
+        out_degree[source] += 1
+        in_degree[target] += 1
+        out_neighbors[source].append(target)
+        in_neighbors[target].append(source)
+        relationships.append(checked)
+    
+    validated = dict(json_data)
+    validated["nodes"] = nodes
+    validated["relationships"] = relationships
+    if quarantined:
+        validated["quarantine"] = list(json_data.get("quarantine", [])) + quarantined
+    index = {
+        "ids": [node["id"] for node in nodes],
+        "position": position,
+        "out_degree": out_degree,
+        "in_degree": in_degree,
+        "out_neighbors": out_neighbors,
+        "in_neighbors": in_neighbors
+    }
+    return validated, index, quarantined
+
+# ==================== 预编译图谱快照 ====================
+def compute_graph_version(raw_bytes):
+    """根据JSON原始内容计算图谱版本号"""
+    return hashlib.sha1(raw_bytes).hexdigest()[:16]
+
+def serialize_graph_payload(json_data):
+    """序列化供前端脚本使用的节点字典和边列表"""
+    nodes_data = {node["id"]: node for node in json_data.get("nodes", [])}
+    return (
+        json.dumps(nodes_data, ensure_ascii=False),
+        json.dumps(json_data.get("relationships", []), ensure_ascii=False)
+    )
+
+def build_graph_snapshot(json_data, version, pool=None, validated=None):
+    """校验并索引图谱、预渲染HTML，生成启动快照；传入进程池时渲染和序列化并行在子进程中完成。
+    之后的渲染和导入都基于校验后的数据，不再逐条防御性检查。已校验过时传入 validate_graph 的结果。
+    不写任何文件：快照对应的JSON落盘后，调用方再保存前端数据（save_client_payload_version）"""
+    json_data, index, _ = validated or validate_graph(json_data)
+    if pool is None:
+        nodes_json, edges_json = serialize_graph_payload(json_data)
+        html = render_graph_html(json_data)
+        client_payload = build_client_payload(json_data, version)
+    else:
+        payload_future = pool.submit("serialize_graph_payload", json_data, cache_key=f"payload:{version}")
+        html_future = pool.submit("render_graph_html", json_data, None, cache_key=f"html:{version}:")
+        client_future = pool.submit("build_client_payload", json_data, version, cache_key=f"client:{version}")
+        nodes_json, edges_json = pool.result(payload_future, "serialize_graph_payload", json_data)
+        html = pool.result(html_future, "render_graph_html", json_data, None)
+        client_payload = pool.result(client_future, "build_client_payload", json_data, version)
+    return {
+        "format": SNAPSHOT_FORMAT,
+        "version": version,
+        "json_data": json_data,
+        "index": index,
+        "nodes_json": nodes_json,
+        "edges_json": edges_json,
+        "html": html,
+        "client_payload": client_payload,
+        "built_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    }
+
+def read_snapshot_file(version):
+    """读取与当前版本匹配的快照文件，不匹配或损坏时返回None"""
     try:
-        with open(JSON_FILE_PATH, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except FileNotFoundError:
-        st.error(f"❌ 找不到文件: {JSON_FILE_PATH}")
+        with open(SNAPSHOT_FILE, 'rb') as f:
+            snapshot = pickle.load(f)
+    except Exception:
         return None
-    except json.JSONDecodeError as e:
-        st.error(f"❌ JSON解析错误: {e}")
+    if not isinstance(snapshot, dict):
+        return None
+    if snapshot.get("format") != SNAPSHOT_FORMAT or snapshot.get("version") != version:
         return None
+    return snapshot
+
+def write_snapshot_file(snapshot):
+    """原子写入快照文件（先写临时文件再替换）"""
+    tmp_path = SNAPSHOT_FILE + ".tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, SNAPSHOT_FILE)
+        return True
+    except Exception:
+        return False
+
+def load_or_build_snapshot(force=False, pool=None):
+    """优先读取预编译快照，JSON有变化（或强制）时重新生成；返回 (快照, 错误信息)"""
+    try:
+        with open(JSON_FILE_PATH, 'rb') as f:
+            raw = f.read()
+    except FileNotFoundError:
+        return None, f"❌ 找不到文件: {JSON_FILE_PATH}"
+    
+    version = compute_graph_version(raw)
+    if not force:
+        snapshot = read_snapshot_file(version)
+        if snapshot:
+            return snapshot, None
+    
+    try:
+        json_data = json.loads(raw.decode('utf-8'))
+    except (json.JSONDecodeError, UnicodeDecodeError) as e:
+        return None, f"❌ JSON解析错误: {e}"
+    
+    snapshot = build_graph_snapshot(json_data, version, pool)
+    save_client_payload_version(snapshot["client_payload"])
+    write_snapshot_file(snapshot)
+    return snapshot, None
+
+@st.cache_resource
+def load_graph_snapshot():
+    """进程内缓存的图谱快照（解析后的数据、节点/边JSON、预渲染HTML）"""
+    # 快照有效时不会启动进程池；只有JSON变化需要重建时才交给子进程渲染
+    snapshot, error = load_or_build_snapshot(pool=get_worker_pool())
+    if error:
+        st.error(error)
+    return snapshot
+
+# ==================== 版本化图谱编辑 ====================
+
+class GraphConflictError(Exception):
+    """编辑基于的版本之后，同一节点或关系已被其他人修改"""
+
+def relationship_key(rel):
+    return f"{rel['source']}->{rel['target']}:{rel.get('type', '关联')}"
+
+def apply_graph_ops(json_data, ops):
+    """在副本上依次应用编辑操作，返回 (新图谱, 补全后的操作)；未改动的节点和关系对象与原版本共享。
+    任何一步校验失败都抛出 ValueError，原图谱不受影响"""
+    nodes = list(json_data.get("nodes", []))
+    relationships = list(json_data.get("relationships", []))
+    index = {node["id"]: position for position, node in enumerate(nodes)}
+    resolved = []
+    for op in ops:
+        kind = op.get("op")
+        if kind == "add_node":
+            node = dict(op["node"])
+            missing = [field for field in NODE_FIELDS if field not in node]
+            if missing:
+                raise ValueError(f"节点缺少字段: {', '.join(missing)}")
+            if node["id"] in index:
+                raise ValueError(f"节点ID已存在: {node['id']}")
+            index[node["id"]] = len(nodes)
+            nodes.append(node)
+            resolved.append({"op": kind, "node": node})
+        elif kind == "update_node":
+            position = index.get(op["id"])
+            if position is None:
+                raise ValueError(f"节点不存在: {op['id']}")
+            if "node" in op:
+                node = dict(op["node"])
+            else:
+                node = dict(nodes[position], **op["fields"])
+            if node.get("id") != op["id"]:
+                raise ValueError("不能修改节点ID")
+            nodes[position] = node
+            resolved.append({"op": kind, "id": op["id"], "node": node})
+        elif kind == "remove_node":
+            position = index.pop(op["id"], None)
+            if position is None:
+                raise ValueError(f"节点不存在: {op['id']}")
+            nodes[position] = None
+            relationships = [rel for rel in relationships if op["id"] not in (rel["source"], rel["target"])]
+            resolved.append({"op": kind, "id": op["id"]})
+        elif kind == "add_relationship":
+            rel = dict(op["relationship"])
+            for endpoint in (rel.get("source"), rel.get("target")):
+                if endpoint not in index:
+                    raise ValueError(f"关系端点不存在: {endpoint}")
+            rel.setdefault("type", "关联")
+            rel.setdefault("properties", {})
+            if any(relationship_key(existing) == relationship_key(rel) for existing in relationships):
+                raise ValueError(f"关系已存在: {relationship_key(rel)}")
+            relationships.append(rel)
+            resolved.append({"op": kind, "relationship": rel})
+        elif kind == "remove_relationship":
+            key = relationship_key(op["relationship"])
+            position = next((i for i, rel in enumerate(relationships) if relationship_key(rel) == key), None)
+            if position is None:
+                raise ValueError(f"关系不存在: {key}")
+            relationships = relationships[:position] + relationships[position + 1:]
+            resolved.append({"op": kind, "relationship": dict(op["relationship"])})
+        else:
+            raise ValueError(f"未知的编辑操作: {kind}")
+    
+    new_data = dict(json_data)
+    new_data["nodes"] = [node for node in nodes if node is not None]
+    new_data["relationships"] = relationships
+    return new_data, resolved
+
+def touched_keys(ops):
+    """操作涉及的节点ID和关系键，用于判断两次并发编辑是否冲突"""
+    keys = set()
+    for op in ops:
+        if "relationship" in op:
+            keys.add(relationship_key(op["relationship"]))
+        else:
+            keys.add(op.get("id") or op["node"]["id"])
+    return keys
+
+class GraphStore:
+    """版本化的知识图谱：每次编辑生成新的不可变快照（写时复制），按编辑时的基线版本做乐观并发控制。
+    正在使用旧快照的会话不受影响，下次运行时拿到新版本"""
+    
+    def __init__(self, snapshot, pool=None):
+        self.snapshot = snapshot
+        self.history = []  # [{version, base, touched, ops, author, at}]，最近的在最后
+        self.sync_error = None
+        self._pool = pool
+        self._lock = threading.Lock()
+    
+    @property
+    def version(self):
+        return self.snapshot["version"]
+    
+    def changed_since(self, base_version):
+        """基线版本之后改动过的键（"*" 表示整体替换）；基线不在编辑历史中时返回None"""
+        touched = set()
+        if base_version == self.version:
+            return touched
+        for entry in reversed(self.history):
+            touched |= entry["touched"]
+            if entry["base"] == base_version:
+                return touched
+        return None
+    
+    def _record(self, base, snapshot, touched, ops, author):
+        self.history.append({
+            "version": snapshot["version"],
+            "base": base,
+            "touched": touched,
+            "ops": ops,
+            "author": author,
+            "at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        })
+        del self.history[:-GRAPH_EDIT_HISTORY]
+        self.snapshot = snapshot
+    
+    def _sync_with_file(self):
+        """JSON文件被其他进程或手工修改过时，先载入文件中的版本（视为一次整体替换）"""
+        try:
+            with open(JSON_FILE_PATH, 'rb') as f:
+                disk_version = compute_graph_version(f.read())
+        except OSError:
+            return
+        if disk_version != self.version:
+            snapshot, error = load_or_build_snapshot(pool=self._pool)
+            if snapshot:
+                self._record(self.version, snapshot, {"*"}, None, "文件")
+    
+    def _commit(self, new_data, reject_invalid=False):
+        """原子写入JSON文件并生成新快照；reject_invalid 时有记录未通过校验则在渲染和写入任何文件之前抛出 ValueError"""
+        validated = validate_graph(new_data)
+        if reject_invalid and validated[2]:
+            raise ValueError(validated[2][0]["reason"])
+        raw = json.dumps(new_data, ensure_ascii=False, indent=2).encode("utf-8")
+        version = compute_graph_version(raw)
+        snapshot = build_graph_snapshot(new_data, version, self._pool, validated)
+        tmp_path = JSON_FILE_PATH + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(raw)
+        os.replace(tmp_path, JSON_FILE_PATH)
+        save_client_payload_version(snapshot["client_payload"])
+        write_snapshot_file(snapshot)
+        return snapshot
+    
+    def apply_patch(self, base_version, ops, store=None, author=""):
+        """基于 base_version 应用一组编辑操作（整体成功或整体失败），返回新快照。
+        基线之后别人改过的节点/关系与本次涉及的有交集时抛出 GraphConflictError，没有交集则直接合并"""
+        with self._lock:
+            self._sync_with_file()
+            changed = self.changed_since(base_version)
+            touched = touched_keys(ops)
+            if changed is None or "*" in changed or changed & touched:
+                raise GraphConflictError(f"图谱已被其他人修改（当前版本 {self.version}），请刷新后重试")
+            if not ops:
+                raise ValueError("没有要应用的编辑操作")
+            new_data, resolved = apply_graph_ops(self.snapshot["json_data"], ops)
+            base = self.version
+            # 当前图谱已校验过，生成快照时出现的坏记录只可能来自本次编辑，整体拒绝
+            snapshot = self._commit(new_data, reject_invalid=True)
+            self._record(base, snapshot, touched, resolved, author)
+        
+        # 存储后端只同步改动的部分；失败时记录下来，可在管理端整体重新初始化
+        if store is not None:
+            try:
+                store.apply_graph_ops(resolved)
+                self.sync_error = None
+            except Exception as e:
+                self.sync_error = f"{datetime.now().strftime('%H:%M:%S')} {e}"
+        return snapshot
+    
+    def replace(self, json_data, base_version, author=""):
+        """整体替换图谱（如新建数据仓库），同样需要基线版本未过期"""
+        with self._lock:
+            self._sync_with_file()
+            if base_version != self.version:
+                raise GraphConflictError(f"图谱已被其他人修改（当前版本 {self.version}），请刷新后重试")
+            base = self.version
+            snapshot = self._commit(json_data)
+            self._record(base, snapshot, {"*"}, None, author)
+        return snapshot
+
+@st.cache_resource
+def get_graph_store():
+    """进程内共享的版本化图谱，JSON无法加载时返回None"""
+    snapshot = load_graph_snapshot()
+    return GraphStore(snapshot, pool=get_worker_pool()) if snapshot else None
+
+# ==================== 启动耗时统计 ====================
+_RUN_TIMINGS = {}
+
+def mark_stage(stage):
+    """记录本次运行从开始到某阶段的耗时（毫秒）"""
+    _RUN_TIMINGS[stage] = round((time.perf_counter() - _RUN_T0) * 1000, 1)
+
+@st.cache_resource
+def get_boot_metrics():
+    """进程级耗时记录：cold 为进程内首次运行（冷启动），last 为最近一次运行"""
+    return {"cold": None, "last": None}
+
+def finish_run_timing():
+    """保存本次运行的各阶段耗时"""
+    metrics = get_boot_metrics()
+    timings = dict(_RUN_TIMINGS)
+    if metrics["cold"] is None:
+        metrics["cold"] = timings
+    metrics["last"] = timings
 
 # ==================== 创建知识图谱可视化 ====================
 def create_knowledge_graph(json_data, selected_node=None):
     """创建交互式知识图谱"""
+    from pyvis.network import Network
+    
     net = Network(height="900px", width="100%", bgcolor="#ffffff", font_color="#333333")
     net.barnes_hut(gravity=-3000, central_gravity=0.3, spring_length=200)
     
@@ -333,8 +2037,8 @@ def create_knowledge_graph(json_data, selected_node=None):
         net.add_edge(
             rel["source"],
             rel["target"],
-            title=rel.get("type", "关联"),
-            label=rel.get("type", ""),
+            title=rel["type"],
+            label=rel["type"],
             color="#999999",
             width=1,
             arrows={"to": {"enabled": True, "scaleFactor": 0.3}},
@@ -383,6 +2087,11 @@ def create_knowledge_graph(json_data, selected_node=None):
     
     return net
 
+def render_graph_html(json_data, selected_node=None):
+    """生成图谱HTML（直接在内存中生成，不落盘临时文件）"""
+    net = create_knowledge_graph(json_data, selected_node)
+    return net.generate_html()
+
 # ==================== 信息卡片组件 ====================
 def render_info_card(node_data):
     """渲染节点信息卡片"""
@@ -427,147 +2136,265 @@ def render_info_card(node_data):
                 border-left: 3px solid {color};
             '>
                 <span style='color: {color}; font-weight: bold; font-size: 13px;'>{key}</span>
-                <p style='color: #333; margin: 4px 0 0 0; font-size: 13px; line-height: 1.5;'>{value}</p>
-            </div>
-            """, unsafe_allow_html=True)
-    else:
-        st.info("暂无详细属性信息")
-
-# ==================== 学生端页面 ====================
-def student_page(conn, json_data):
-    """学生端：浏览知识图谱"""
-    
-    # ========== 左侧侧边栏：登录和节点详情 ==========
-    with st.sidebar:
-        st.markdown("### 👤 学生登录")
-        login_input = st.text_input("学号或姓名", value=st.session_state.get("login_input", ""), key="login_input_field")
-        
-        if st.button("确认登录", type="primary", use_container_width=True):
-            if login_input:
-                st.session_state.login_input = login_input
-                st.session_state.student_id = login_input
-                st.success(f"欢迎, {login_input}!")
-            else:
-                st.warning("请输入学号或姓名")
-        
-        if st.session_state.get("student_id"):
-            st.markdown(f"✅ 已登录: **{st.session_state.student_id}**")
-        
-        st.markdown("---")
-        st.markdown("💡 **提示**: 点击右侧图谱中的节点查看详情")
-        
-        # 读取并处理localStorage中的交互记录
-        if st.session_state.get("student_id"):
-            try:
-                interactions_js = st_javascript("""
-                    var interactions = localStorage.getItem('pending_interactions');
-                    if (interactions) {
-                        localStorage.removeItem('pending_interactions');
-                        interactions;
-                    } else {
-                        null;
-                    }
-                """, key=f"read_interactions_{int(time.time())}")
-                
-                if interactions_js:
-                    import json as json_lib
-                    try:
-                        interactions_list = json_lib.loads(interactions_js)
-                        for interaction in interactions_list:
-                            record_interaction(
-                                conn,
-                                st.session_state.student_id,
-                                interaction.get('node_id', ''),
-                                interaction.get('node_label', ''),
-                                'view',
-                                0
-                            )
-                    except:
-                        pass
-            except:
-                pass
-        
-        # ========== 节点列表菜单 ==========
-        if st.session_state.get("student_id"):
-            st.markdown("---")
-            st.markdown("### 📋 知识节点列表")
-            
-            # 按类别分组显示节点
-            nodes_by_category = {}
-            for node in json_data.get("nodes", []):
-                cat = node.get("category", "其他")
-                if cat not in nodes_by_category:
-                    nodes_by_category[cat] = []
-                nodes_by_category[cat].append(node)
-            
-            # 显示每个类别的节点
-            for category, nodes in nodes_by_category.items():
-                color = CATEGORY_COLORS.get(category, "#888888")
-                with st.expander(f"📂 {category} ({len(nodes)})", expanded=False):
-                    for node in nodes:
-                        if st.button(f"🔹 {node['label']}", key=f"node_btn_{node['id']}", use_container_width=True):
-                            # 记录点击交互
-                            record_interaction(
-                                conn,
-                                st.session_state.student_id,
-                                node['id'],
-                                node['label'],
-                                'view',
-                                0
-                            )
-                            st.session_state.selected_node = node
-                            st.rerun()
-            
-            # 显示选中节点的详情
-            if st.session_state.get("selected_node"):
-                st.markdown("---")
-                st.markdown("### 📍 节点详情")
-                render_info_card(st.session_state.selected_node)
+                <p style='color: #333; margin: 4px 0 0 0; font-size: 13px; line-height: 1.5;'>{value}</p>
+            </div>
+            """, unsafe_allow_html=True)
+    else:
+        st.info("暂无详细属性信息")
+
+# ==================== 节点列表（分页浏览） ====================
+@st.cache_resource(max_entries=GRAPH_VERSION_HISTORY)
+def get_category_index(version, _json_data):
+    """按图谱版本缓存的类别索引：类别 -> 节点列表，以及 节点ID -> 节点"""
+    by_category = {}
+    by_id = {}
+    for node in _json_data.get("nodes", []):
+        by_category.setdefault(node["category"], []).append(node)
+        by_id[node["id"]] = node
+    return {"by_category": by_category, "by_id": by_id}
+
+@st.cache_resource(max_entries=256)
+def filter_node_ids(version, category, keyword, _index):
+    """服务端筛选节点（按类别和名称关键字），结果按版本缓存"""
+    if category:
+        candidates = _index["by_category"].get(category, [])
+    else:
+        candidates = [node for nodes in _index["by_category"].values() for node in nodes]
+    keyword = keyword.strip().casefold()
+    if keyword:
+        candidates = [node for node in candidates if keyword in node["label"].casefold()]
+    return [node["id"] for node in candidates]
+
+def render_node_browser(store, snapshot):
+    """分页的节点浏览器：只为当前页的节点创建按钮，开销与图谱规模无关"""
+    index = get_category_index(snapshot["version"], snapshot["json_data"])
     
-    # ========== 主区域 ==========
-    st.title("🌊 范各庄矿突水事故知识图谱")
-    st.markdown("*1984年开滦范各庄矿奥陶系岩溶陷落柱特大突水灾害案例学习*")
+    categories = list(index["by_category"].keys())
+    category = st.selectbox(
+        "📂 知识类别",
+        options=[""] + categories,
+        format_func=lambda cat: f"{cat} ({len(index['by_category'][cat])})" if cat else f"全部 ({len(index['by_id'])})",
+        key="node_filter_category"
+    )
+    keyword = st.text_input("🔍 搜索节点", key="node_filter_keyword", placeholder="输入节点名称关键字")
     
-    if not st.session_state.get("student_id"):
-        st.info("💡 请在左侧输入学号和姓名登录")
+    node_ids = filter_node_ids(snapshot["version"], category, keyword, index)
+    if not node_ids:
+        st.caption("没有匹配的节点")
         return
     
-    # 图例（小型，放右侧）
-    st.markdown("##### 📊 知识分类")
-    legend_html = "<div style='display:flex;gap:8px;flex-wrap:wrap;justify-content:flex-end;'>"
-    for cat, color in CATEGORY_COLORS.items():
-        legend_html += f"<span style='background:{color}33;border:1px solid {color};border-radius:4px;padding:2px 8px;font-size:11px;color:{color};'>{cat}</span>"
-    legend_html += "</div>"
-    st.markdown(legend_html, unsafe_allow_html=True)
+    # 筛选条件变化时回到第一页
+    filter_key = (snapshot["version"], category, keyword)
+    if st.session_state.get("node_filter_key") != filter_key:
+        st.session_state.node_filter_key = filter_key
+        st.session_state.node_page = 0
     
-    st.markdown("---")
+    page_count = (len(node_ids) + NODE_PAGE_SIZE - 1) // NODE_PAGE_SIZE
+    page = min(st.session_state.get("node_page", 0), page_count - 1)
     
-    # ========== 知识图谱（全宽显示）==========
-    st.markdown("### 🗺️ 知识图谱（点击节点可在左侧查看详情）")
+    for node_id in node_ids[page * NODE_PAGE_SIZE:(page + 1) * NODE_PAGE_SIZE]:
+        node = index["by_id"][node_id]
+        if st.button(f"🔹 {node['label']}", key=f"node_btn_{node_id}", use_container_width=True):
+            # 记录点击交互（经会话缓冲合并重复点击）
+            buffer_interaction(
+                store,
+                st.session_state.student_id,
+                node['id'],
+                node['label'],
+                'view'
+            )
+            st.session_state.selected_node = node
+            st.rerun()
     
-    # 获取URL参数中的选中节点，用于高亮显示
-    query_params = st.query_params
-    url_selected = query_params.get("selected_node", None)
+    if page_count > 1:
+        col_prev, col_info, col_next = st.columns([1, 2, 1])
+        with col_prev:
+            if st.button("◀", key="node_page_prev", disabled=page == 0):
+                st.session_state.node_page = page - 1
+                st.rerun()
+        with col_info:
+            st.caption(f"第 {page + 1} / {page_count} 页，共 {len(node_ids)} 个节点")
+        with col_next:
+            if st.button("▶", key="node_page_next", disabled=page >= page_count - 1):
+                st.session_state.node_page = page + 1
+                st.rerun()
+
+# ==================== 学习推荐 ====================
+def personalized_pagerank(source, neighbors, alpha=RECOMMEND_ALPHA, epsilon=RECOMMEND_EPSILON):
+    """以 source 为重启点的近似个性化PageRank（前向推送算法），只访问得分不可忽略的节点，返回 {序号: 得分}"""
+    estimate = {}
+    residual = {source: 1.0}
+    queue = [source]
+    while queue:
+        u = queue.pop()
+        mass = residual.get(u, 0.0)
+        degree = len(neighbors[u])
+        if degree == 0:
+            # 孤立节点：残差全部留在自身
+            estimate[u] = estimate.get(u, 0.0) + mass
+            residual[u] = 0.0
+            continue
+        if mass < epsilon * degree:
+            continue
+        estimate[u] = estimate.get(u, 0.0) + alpha * mass
+        residual[u] = 0.0
+        share = (1 - alpha) * mass / degree
+        for v in neighbors[u]:
+            before = residual.get(v, 0.0)
+            residual[v] = before + share
+            threshold = epsilon * len(neighbors[v])
+            if before < threshold <= residual[v]:
+                queue.append(v)
+    return estimate
+
+def build_ppr_table(out_neighbors, in_neighbors, top=RECOMMEND_PPR_TOP):
+    """批量预计算每个节点的个性化PageRank（关系按无向处理），每个节点保留得分最高的 top 个 [(序号, 得分)]"""
+    import heapq
     
-    # 创建并显示图谱
-    net = create_knowledge_graph(json_data, url_selected)
+    neighbors = [out_list + in_list for out_list, in_list in zip(out_neighbors, in_neighbors)]
+    table = []
+    for source in range(len(neighbors)):
+        scores = personalized_pagerank(source, neighbors)
+        scores.pop(source, None)
+        table.append(heapq.nlargest(top, scores.items(), key=lambda item: item[1]))
+    return table
+
+@st.cache_resource(max_entries=2)
+def get_recommendation_model(version, _snapshot):
+    """按图谱版本缓存的推荐模型：个性化PageRank表（提交到进程池后台计算，不阻塞页面）和无历史时的默认顺序"""
+    index = _snapshot["index"]
+    args = (index["out_neighbors"], index["in_neighbors"])
+    future = get_worker_pool().submit("build_ppr_table", *args, cache_key=f"ppr:{version}")
+    nodes = _snapshot["json_data"]["nodes"]
+    # 没有浏览记录时从高层级、关联多的核心节点开始
+    default_order = sorted(
+        range(len(nodes)),
+        key=lambda i: (nodes[i]["level"], -(index["out_degree"][i] + index["in_degree"][i]))
+    )
+    return {
+        "version": version, "table": None, "future": future, "args": args,
+        "default_order": default_order, "position": index["position"]
+    }
+
+def recommendation_table(model):
+    """PageRank表计算完成后返回（之后保存在模型中），尚未完成时返回None"""
+    if model["table"] is None and model["future"].done():
+        model["table"] = get_worker_pool().result(model["future"], "build_ppr_table", *model["args"])
+    return model["table"]
+
+class StudentRecommender:
+    """单个学生的推荐状态：把浏览过的节点的PageRank向量按时间加权累加，每次新访问只累加一个稀疏向量"""
     
-    # 保存并显示HTML
-    graph_path = os.path.join(current_dir, "temp_graph.html")
-    net.save_graph(graph_path)
+    def __init__(self, student_id, model):
+        self.student_id = student_id
+        self.model = model
+        self.visited = Counter()  # 节点序号 -> 浏览次数
+        self.history = []  # 按时间顺序的节点ID，图谱版本变化时用于重放
+        self.scores = {}
+        self.weight = 1.0
+        self.applied = 0  # 已累加到得分中的历史条数（PageRank表计算完成前只记录历史）
     
-    # 读取并嵌入HTML
-    with open(graph_path, "r", encoding="utf-8") as f:
-        html_content = f.read()
+    @property
+    def version(self):
+        return self.model["version"]
     
-    # 准备节点数据供 JavaScript 使用
-    nodes_data = {node["id"]: node for node in json_data.get("nodes", [])}
-    nodes_json = json.dumps(nodes_data, ensure_ascii=False)
+    def observe(self, node_id):
+        position = self.model["position"].get(node_id)
+        if position is None:
+            return
+        self.history.append(node_id)
+        self.visited[position] += 1
+        self._accumulate()
+    
+    @property
+    def ready(self):
+        """PageRank表是否已可用（未就绪时只按默认顺序推荐）"""
+        return recommendation_table(self.model) is not None
+    
+    def _accumulate(self):
+        """把尚未计入的历史浏览累加到得分"""
+        table = recommendation_table(self.model)
+        if table is None:
+            return
+        for node_id in self.history[self.applied:]:
+            # 越晚的访问权重越大；不衰减旧得分，而是放大新得分，权重过大时整体缩放
+            for target, score in table[self.model["position"][node_id]]:
+                self.scores[target] = self.scores.get(target, 0.0) + self.weight * score
+            self.weight *= RECOMMEND_RECENCY
+            if self.weight > 1e6:
+                self.scores = {target: score / self.weight for target, score in self.scores.items()}
+                self.weight = 1.0
+        self.applied = len(self.history)
     
-    # 准备边的数据供高亮使用
-    edges_data = json_data.get("relationships", [])
-    edges_json = json.dumps(edges_data, ensure_ascii=False)
+    def recommend(self, count=RECOMMEND_COUNT):
+        """得分最高且尚未浏览的节点序号；相关节点不足时按默认顺序补齐"""
+        import heapq
+        
+        self._accumulate()
+        result = heapq.nlargest(
+            count,
+            (target for target in self.scores if target not in self.visited),
+            key=self.scores.get
+        )
+        for position in self.model["default_order"]:
+            if len(result) >= count:
+                break
+            if position not in self.visited and position not in result:
+                result.append(position)
+        return result
+
+def get_student_recommender(store, snapshot, student_id):
+    """本会话的推荐状态：登录后从存储读取一次历史记录，之后随浏览增量更新；图谱版本变化时重放历史"""
+    recommender = st.session_state.get("recommender")
+    if recommender is not None and recommender.student_id == student_id and recommender.version == snapshot["version"]:
+        return recommender
     
+    model = get_recommendation_model(snapshot["version"], snapshot)
+    if recommender is not None and recommender.student_id == student_id:
+        history = recommender.history
+    else:
+        records = sorted(get_student_interactions(store, student_id), key=lambda record: str(record.get("timestamp", "")))
+        history = [record["node_id"] for record in records]
+        # 会话缓冲中尚未写入的浏览
+        pending = get_pending_views(store).get(get_session_key())
+        if pending and pending["student_id"] == student_id:
+            history.append(pending["node_id"])
+    recommender = StudentRecommender(student_id, model)
+    for node_id in history:
+        recommender.observe(node_id)
+    st.session_state.recommender = recommender
+    return recommender
+
+def observe_student_view(student_id, node_id):
+    """新的浏览记录到达时更新本会话的推荐状态（尚未建立时登录后会从历史记录中建立）"""
+    recommender = st.session_state.get("recommender")
+    if recommender is not None and recommender.student_id == student_id:
+        recommender.observe(node_id)
+
+def render_recommendations(store, snapshot):
+    """侧边栏的下一步学习推荐：与已浏览节点关联最紧密、但尚未浏览的节点"""
+    recommender = get_student_recommender(store, snapshot, st.session_state.student_id)
+    nodes = snapshot["json_data"]["nodes"]
+    positions = recommender.recommend()
+    if not positions:
+        st.caption("已浏览全部节点 🎉")
+        return
+    if not recommender.history:
+        st.caption("从核心知识点开始")
+    elif recommender.ready:
+        st.caption("根据图谱关联和你已浏览的内容推荐")
+    else:
+        st.caption("推荐模型计算中，暂按核心知识点推荐")
+    for position in positions:
+        node = nodes[position]
+        if st.button(f"➡️ {node['label']}", key=f"recommend_btn_{node['id']}", use_container_width=True):
+            buffer_interaction(store, st.session_state.student_id, node['id'], node['label'], 'view')
+            st.session_state.selected_node = node
+            st.rerun()
+
+# ==================== 图谱点击交互脚本 ====================
+def inject_click_handler(html_content, nodes_json, edges_json, overlay_channel=None):
+    """在pyvis生成的HTML中注入节点详情面板和关联高亮脚本；指定 overlay_channel 时同时监听叠加样式"""
     # 注入点击事件处理 - 在图谱内直接显示节点详情（不刷新页面）
     click_handler = f"""
     <style>
@@ -746,6 +2573,7 @@ def student_page(conn, json_data):
         var maxAttempts = 20;
         
         function tryBindEvents() {{
+            if (networkRef) return;
             attempts++;
             var networkObj = null;
             
@@ -780,6 +2608,8 @@ def student_page(conn, json_data):
                                     node_label: node.label || nodeId,
                                     timestamp: new Date().toISOString()
                                 }});
+                                // 只保留最近的记录，服务器端每次最多读取这么多
+                                interactions = interactions.slice(-{INGEST_CLIENT_BATCH_LIMIT});
                                 localStorage.setItem('pending_interactions', JSON.stringify(interactions));
                             }} catch(e) {{}}                        }}
                     }} else {{
@@ -827,185 +2657,1934 @@ def student_page(conn, json_data):
                     html += '<div class="detail-row"><span class="detail-label">名称：</span><span class="detail-value">' + node.label + '</span></div>';
                 }}
             }}
-            
-            content.innerHTML = html;
-            
-            // 显示关联关系
-            var relHtml = '<div class="relations-section"><h4>🔗 相关联系</h4>';
-            var hasRelations = false;
-            edgesData.forEach(function(edge) {{
-                if (edge.source === nodeId) {{
-                    var targetNode = nodesData[edge.target];
-                    var targetLabel = targetNode ? targetNode.label : edge.target;
-                    relHtml += '<div class="relation-item">➡️ <strong>' + (edge.type || '关联') + '</strong> → ' + targetLabel + '</div>';
-                    hasRelations = true;
-                }} else if (edge.target === nodeId) {{
-                    var sourceNode = nodesData[edge.source];
-                    var sourceLabel = sourceNode ? sourceNode.label : edge.source;
-                    relHtml += '<div class="relation-item">⬅️ ' + sourceLabel + ' <strong>' + (edge.type || '关联') + '</strong> →</div>';
-                    hasRelations = true;
-                }}
+            
+            content.innerHTML = html;
+            
+            // 显示关联关系
+            var relHtml = '<div class="relations-section"><h4>🔗 相关联系</h4>';
+            var hasRelations = false;
+            edgesData.forEach(function(edge) {{
+                if (edge.source === nodeId) {{
+                    var targetNode = nodesData[edge.target];
+                    var targetLabel = targetNode ? targetNode.label : edge.target;
+                    relHtml += '<div class="relation-item">➡️ <strong>' + (edge.type || '关联') + '</strong> → ' + targetLabel + '</div>';
+                    hasRelations = true;
+                }} else if (edge.target === nodeId) {{
+                    var sourceNode = nodesData[edge.source];
+                    var sourceLabel = sourceNode ? sourceNode.label : edge.source;
+                    relHtml += '<div class="relation-item">⬅️ ' + sourceLabel + ' <strong>' + (edge.type || '关联') + '</strong> →</div>';
+                    hasRelations = true;
+                }}
+            }});
+            relHtml += '</div>';
+            
+            relationsContent.innerHTML = hasRelations ? relHtml : '';
+            panel.style.display = 'block';
+        }}
+        
+        // pyvis页面在onload前已创建网络，直接绑定；图谱由缓存加载器异步绘制时，绘制完成后立即绑定
+        window.addEventListener('graph-ready', tryBindEvents);
+        tryBindEvents();
+    }};
+    </script>
+    """
+    if overlay_channel:
+        click_handler += build_overlay_listener(overlay_channel)
+    return html_content.replace("</body>", click_handler + "</body>")
+
+def overlay_storage_key(channel):
+    return f"graph_overlay_{TARGET_LABEL}_{channel}"
+
+def build_overlay_listener(channel):
+    """图谱页中的叠加样式监听脚本：从localStorage读取节点样式增量并直接更新已加载的网络，不重新渲染"""
+    return f"""
+    <script>
+    (function() {{
+        var overlayKey = {json.dumps(overlay_storage_key(channel))};
+        var baseStyles = null;
+        
+        function applyOverlay(raw) {{
+            if (!networkRef) {{
+                setTimeout(function() {{ applyOverlay(raw); }}, 300);
+                return;
+            }}
+            var nodesSet = networkRef.body.data.nodes;
+            if (baseStyles === null) {{
+                baseStyles = {{}};
+                nodesSet.get().forEach(function(node) {{
+                    baseStyles[node.id] = {{size: node.size, color: node.color, title: node.title}};
+                }});
+            }}
+            var overlay = {{}};
+            try {{ overlay = raw ? JSON.parse(raw).nodes || {{}} : {{}}; }} catch(e) {{}}
+            var updates = [];
+            for (var nodeId in baseStyles) {{
+                var base = baseStyles[nodeId];
+                var style = overlay[nodeId];
+                if (style) {{
+                    updates.push({{id: nodeId, size: base.size * style.scale, color: style.color, title: base.title + ' · ' + style.text}});
+                }} else {{
+                    updates.push({{id: nodeId, size: base.size, color: base.color, title: base.title}});
+                }}
+            }}
+            nodesSet.update(updates);
+        }}
+        
+        window.addEventListener('storage', function(event) {{
+            if (event.key === overlayKey) {{
+                applyOverlay(event.newValue);
+            }}
+        }});
+        applyOverlay(localStorage.getItem(overlayKey));
+    }})();
+    </script>
+    """
+
+def push_graph_overlay(channel, overlay):
+    """把叠加样式写入浏览器localStorage，已打开的图谱页通过storage事件增量更新"""
+    from streamlit_javascript import st_javascript
+    
+    payload = json.dumps({"nodes": overlay}, ensure_ascii=False, separators=(",", ":"))
+    digest = hashlib.sha1(payload.encode("utf-8")).hexdigest()[:12]
+    st_javascript(
+        f"localStorage.setItem({json.dumps(overlay_storage_key(channel))}, {json.dumps(payload)}); 1",
+        key=f"overlay_{channel}_{digest}"
+    )
+
+# ==================== 浏览器端图谱缓存 ====================
+GRAPH_VERSION_PATTERN = re.compile(r"^[0-9a-f]{16}$")
+
+def build_client_payload(json_data, version):
+    """前端绘图所需的数据：vis节点/边（附带原始数据）、配置和原始关系列表"""
+    net = create_knowledge_graph(json_data)
+    nodes, edges, _, _, _, options = net.get_network_data()
+    if isinstance(options, str):
+        options = json.loads(options)
+    
+    raw_nodes = {node["id"]: node for node in json_data.get("nodes", [])}
+    for node in nodes:
+        node["raw"] = raw_nodes.get(node["id"])
+    # 边ID由端点决定，同一对节点的重复边加序号，保证版本之间可以逐条比较
+    seen_pairs = Counter()
+    for edge in edges:
+        pair = f"{edge['from']}->{edge['to']}"
+        edge["id"] = pair if not seen_pairs[pair] else f"{pair}#{seen_pairs[pair]}"
+        seen_pairs[pair] += 1
+    
+    return {
+        "version": version,
+        "nodes": nodes,
+        "edges": edges,
+        "options": options,
+        "relationships": json_data.get("relationships", [])
+    }
+
+def save_client_payload_version(payload):
+    """保存该版本的前端数据，只保留最近若干个版本"""
+    try:
+        os.makedirs(GRAPH_VERSIONS_DIR, exist_ok=True)
+        write_json_atomic(os.path.join(GRAPH_VERSIONS_DIR, f"{payload['version']}.json"), payload)
+        versions = sorted(
+            (entry for entry in os.scandir(GRAPH_VERSIONS_DIR) if entry.name.endswith(".json")),
+            key=lambda entry: entry.stat().st_mtime,
+            reverse=True
+        )
+        for entry in versions[GRAPH_VERSION_HISTORY:]:
+            os.remove(entry.path)
+    except OSError:
+        pass
+
+@st.cache_resource(max_entries=GRAPH_VERSION_HISTORY)
+def load_client_payload_version(version):
+    """读取历史版本的前端数据（版本号必须是合法的哈希，防止路径注入）"""
+    if not GRAPH_VERSION_PATTERN.match(version or ""):
+        return None
+    try:
+        with open(os.path.join(GRAPH_VERSIONS_DIR, f"{version}.json"), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+
+def diff_client_payload(old, new):
+    """计算两个版本之间的增量：新增/修改的节点和边、删除的ID，配置和关系列表变化时整体替换"""
+    def changes(old_items, new_items):
+        old_index = {item["id"]: item for item in old_items}
+        new_ids = set()
+        upsert = []
+        for item in new_items:
+            new_ids.add(item["id"])
+            if old_index.get(item["id"]) != item:
+                upsert.append(item)
+        return {"upsert": upsert, "remove": [item_id for item_id in old_index if item_id not in new_ids]}
+    
+    return {
+        "base": old["version"],
+        "version": new["version"],
+        "nodes": changes(old["nodes"], new["nodes"]),
+        "edges": changes(old["edges"], new["edges"]),
+        "options": new["options"] if new["options"] != old["options"] else None,
+        "relationships": new["relationships"] if new["relationships"] != old["relationships"] else None
+    }
+
+@st.cache_resource(max_entries=32)
+def get_client_boot(client_version, current_version, _payload):
+    """根据浏览器已缓存的版本决定发送内容：同版本只发版本号，有历史版本发增量，否则发全量"""
+    if client_version == current_version:
+        return {"mode": "cached", "version": current_version}
+    base = load_client_payload_version(client_version)
+    if base:
+        diff = diff_client_payload(base, _payload)
+        # 增量比全量还大时（改动很多）直接发全量
+        if len(json.dumps(diff, ensure_ascii=False)) < len(json.dumps(_payload, ensure_ascii=False)) // 2:
+            return {"mode": "diff", "version": current_version, "diff": diff}
+    return {"mode": "full", "version": current_version, "payload": _payload}
+
+CACHED_GRAPH_LOADER = """
+<script>
+var network;
+(function() {
+    var boot = __BOOT__;
+    var VERSION_KEY = 'graph_cache_version_' + boot.label;
+    var GRAPH_KEY = 'graph:' + boot.label;
+    var DELTA_KEY = 'graph_delta_' + boot.label;
+    var STATUS_KEY = 'graph_cache_status_' + boot.label;
+    var VIS_KEY = 'graph_vis_asset';
+    var COOKIE_KEY = 'graph_cache_' + boot.label;
+    var container = document.getElementById('mynetwork');
+    var currentGraph = null;
+    var positionKey = null;
+    var visCached = localStorage.getItem(VIS_KEY) === boot.vis.key;
+    
+    function openDb() {
+        return new Promise(function(resolve, reject) {
+            var request = indexedDB.open('xjy_graph_cache', 1);
+            request.onupgradeneeded = function() { request.result.createObjectStore('kv'); };
+            request.onsuccess = function() { resolve(request.result); };
+            request.onerror = function() { reject(request.error); };
+        });
+    }
+    function idbGet(db, key) {
+        return new Promise(function(resolve) {
+            if (!db) { resolve(null); return; }
+            var request = db.transaction('kv').objectStore('kv').get(key);
+            request.onsuccess = function() { resolve(request.result || null); };
+            request.onerror = function() { resolve(null); };
+        });
+    }
+    function idbPut(db, key, value) {
+        return new Promise(function(resolve, reject) {
+            if (!db) { reject(new Error('no db')); return; }
+            var tx = db.transaction('kv', 'readwrite');
+            tx.objectStore('kv').put(value, key);
+            tx.oncomplete = function() { resolve(); };
+            tx.onerror = function() { reject(tx.error); };
+        });
+    }
+    
+    // vis-network 使用仓库自带的版本：服务器只在浏览器没有缓存时随页面发送，之后从 IndexedDB 读取
+    function loadVis(db) {
+        var assetKey = 'asset:' + boot.vis.key;
+        return idbGet(db, assetKey).then(function(asset) {
+            if (asset) return asset;
+            visCached = false;
+            localStorage.removeItem(VIS_KEY);
+            if (!boot.vis.js) throw new Error('vis missing');
+            asset = {js: boot.vis.js, css: boot.vis.css};
+            return idbPut(db, assetKey, asset).then(function() {
+                visCached = true;
+                localStorage.setItem(VIS_KEY, boot.vis.key);
+                return asset;
+            }, function() { return asset; });
+        }).then(function(asset) {
+            var style = document.createElement('style');
+            style.textContent = asset.css;
+            document.head.appendChild(style);
+            var script = document.createElement('script');
+            script.text = asset.js;
+            document.head.appendChild(script);
+        });
+    }
+    
+    function applyChanges(items, changes) {
+        var removed = new Set(changes.remove);
+        var index = {};
+        items.forEach(function(item) { if (!removed.has(item.id)) index[item.id] = item; });
+        var order = items.map(function(item) { return item.id; }).filter(function(id) { return index[id]; });
+        changes.upsert.forEach(function(item) {
+            if (!index[item.id]) order.push(item.id);
+            index[item.id] = item;
+        });
+        return order.map(function(id) { return index[id]; });
+    }
+    
+    function getCachedGraph(db, expectedVersion, retries) {
+        return idbGet(db, GRAPH_KEY).then(function(cached) {
+            if (cached && cached.version === expectedVersion) return cached;
+            // 上一次发送的全量数据可能还在写入，稍等重试
+            if (retries > 0) {
+                return new Promise(function(resolve) { setTimeout(resolve, 500); }).then(function() {
+                    return getCachedGraph(db, expectedVersion, retries - 1);
+                });
+            }
+            throw new Error('cache miss');
+        });
+    }
+    
+    function resolveGraph(db) {
+        if (boot.mode === 'full') return Promise.resolve(boot.payload);
+        if (boot.mode === 'cached') return getCachedGraph(db, boot.version, 6);
+        var diff = boot.diff;
+        return getCachedGraph(db, diff.base, 6).then(function(base) {
+            return {
+                version: diff.version,
+                nodes: applyChanges(base.nodes, diff.nodes),
+                edges: applyChanges(base.edges, diff.edges),
+                options: diff.options || base.options,
+                relationships: diff.relationships || base.relationships
+            };
+        });
+    }
+    
+    function setDetailData(graph) {
+        var detail = {};
+        graph.nodes.forEach(function(node) { if (node.raw) detail[node.id] = node.raw; });
+        window.nodesData = detail;
+        window.edgesData = graph.relationships;
+    }
+    function decorate(node) {
+        var copy = Object.assign({}, node);
+        if (boot.selected && node.id === boot.selected) copy.borderWidth = 5;
+        return copy;
+    }
+    
+    function draw(graph, positions) {
+        setDetailData(graph);
+        currentGraph = graph;
+        
+        var allPlaced = true;
+        var nodes = graph.nodes.map(function(node) {
+            var copy = decorate(node);
+            var position = positions[node.id];
+            if (position) {
+                copy.x = position.x;
+                copy.y = position.y;
+            } else {
+                allPlaced = false;
+            }
+            return copy;
+        });
+        var options = JSON.parse(JSON.stringify(graph.options));
+        if (allPlaced && nodes.length > 0) {
+            // 已有缓存布局时跳过物理稳定过程，直接显示
+            options.physics = Object.assign({}, options.physics, {enabled: false});
+        }
+        network = new vis.Network(container, {nodes: new vis.DataSet(nodes), edges: new vis.DataSet(graph.edges)}, options);
+        window.network = network;
+        window.dispatchEvent(new Event('graph-ready'));
+        return network;
+    }
+    
+    // 管理端编辑图谱后，服务器把增量写入localStorage，已打开的图谱就地更新（保留布局和视角）
+    function applyLiveUpdate(db, raw) {
+        if (!raw || !currentGraph || !network) return;
+        var update;
+        try { update = JSON.parse(raw); } catch (e) { return; }
+        if (update.version === currentGraph.version) return;
+        var graph, nodeChanges, edgeChanges;
+        if (update.mode === 'diff' && update.diff.base === currentGraph.version) {
+            var diff = update.diff;
+            nodeChanges = diff.nodes;
+            edgeChanges = diff.edges;
+            graph = {
+                version: diff.version,
+                nodes: applyChanges(currentGraph.nodes, diff.nodes),
+                edges: applyChanges(currentGraph.edges, diff.edges),
+                options: diff.options || currentGraph.options,
+                relationships: diff.relationships || currentGraph.relationships
+            };
+        } else if (update.mode === 'full') {
+            graph = update.payload;
+            var fullChanges = function(items, next) {
+                var ids = new Set(next.map(function(item) { return item.id; }));
+                return {upsert: next, remove: items.map(function(item) { return item.id; }).filter(function(id) { return !ids.has(id); })};
+            };
+            nodeChanges = fullChanges(currentGraph.nodes, graph.nodes);
+            edgeChanges = fullChanges(currentGraph.edges, graph.edges);
+        } else {
+            // 增量基于的版本与本页不一致，等下次页面刷新时从缓存加载
+            return;
+        }
+        // 先恢复高亮颜色，避免高亮记录中已删除的节点被重新加回
+        if (typeof restoreAllColors === 'function') restoreAllColors();
+        network.body.data.edges.remove(edgeChanges.remove);
+        network.body.data.nodes.remove(nodeChanges.remove);
+        network.body.data.nodes.update(nodeChanges.upsert.map(decorate));
+        network.body.data.edges.update(edgeChanges.upsert);
+        setDetailData(graph);
+        currentGraph = graph;
+        
+        positionKey = 'positions:' + boot.label + ':' + graph.version;
+        idbPut(db, positionKey, network.getPositions()).catch(function() {});
+        idbPut(db, GRAPH_KEY, graph).then(function() {
+            localStorage.setItem(VERSION_KEY, graph.version);
+            saveCookie();
+        }, function() {});
+    }
+    
+    function showMessage(text) {
+        container.innerHTML = '<div style="padding:40px;color:#888;font-family:Microsoft YaHei,sans-serif;">' + text + '</div>';
+    }
+    
+    // 缓存状态同时写入Cookie（版本|vis脚本键）：新会话的首次运行即可读到，不必先经过一次浏览器往返
+    function saveCookie() {
+        try {
+            var value = (localStorage.getItem(VERSION_KEY) || 'none') + '|' + (visCached ? boot.vis.key : '');
+            document.cookie = COOKIE_KEY + '=' + encodeURIComponent(value) + '; path=/; max-age=31536000; SameSite=Lax';
+        } catch (e) {}
+    }
+    
+    // 把本次加载的结果告诉服务器：浏览器实际缓存的版本、vis脚本是否已缓存、是否需要改发全量
+    function report(miss) {
+        saveCookie();
+        try {
+            localStorage.setItem(STATUS_KEY, JSON.stringify({
+                nonce: boot.nonce,
+                version: localStorage.getItem(VERSION_KEY) || 'none',
+                vis: visCached,
+                miss: miss
+            }));
+        } catch (e) {}
+    }
+    
+    openDb().catch(function() { return null; }).then(function(db) {
+        return resolveGraph(db).then(function(graph) {
+            var stored = boot.mode === 'cached' ? Promise.resolve(true)
+                : idbPut(db, GRAPH_KEY, graph).then(function() { return true; }, function() { return false; });
+            return stored.then(function(ok) {
+                if (ok) localStorage.setItem(VERSION_KEY, graph.version);
+                return loadVis(db);
+            }).then(function() {
+                positionKey = 'positions:' + boot.label + ':' + graph.version;
+                return idbGet(db, positionKey).then(function(positions) {
+                    if (!positions && boot.mode === 'diff') {
+                        return idbGet(db, 'positions:' + boot.label + ':' + boot.diff.base);
+                    }
+                    return positions;
+                }).then(function(positions) {
+                    var net = draw(graph, positions || {});
+                    var savePositions = function() {
+                        idbPut(db, positionKey, net.getPositions()).catch(function() {});
+                    };
+                    net.on('stabilized', savePositions);
+                    net.on('dragEnd', savePositions);
+                    window.addEventListener('storage', function(event) {
+                        if (event.key === DELTA_KEY) applyLiveUpdate(db, event.newValue);
+                    });
+                    // 绘制期间已推送的增量
+                    applyLiveUpdate(db, localStorage.getItem(DELTA_KEY));
+                    report(false);
+                });
+            });
+        });
+    }).catch(function() {
+        if (boot.mode === 'full' && boot.vis.js) {
+            showMessage('图谱加载失败，请点击图谱下方的“重新加载图谱”。');
+            report(false);
+            return;
+        }
+        // 本地缓存缺失（被浏览器清理或之前写入失败）：清掉缓存标记，由服务器改发全量数据
+        localStorage.removeItem(VERSION_KEY);
+        showMessage('正在从服务器重新加载图谱...');
+        openDb().then(function(db) { return idbGet(db, 'asset:' + boot.vis.key); }, function() { return null; }).then(function(asset) {
+            visCached = visCached && !!asset;
+            report(true);
+        });
+    });
+})();
+</script>
+"""
+
+@st.cache_resource
+def load_vis_assets():
+    """读取仓库自带的vis-network脚本和样式（浏览器没有缓存时随页面发送）"""
+    assets = {}
+    for name, filename in (("js", "vis-network.min.js"), ("css", "vis-network.css")):
+        with open(os.path.join(VIS_NETWORK_DIR, filename), 'r', encoding='utf-8') as f:
+            assets[name] = f.read()
+    return assets
+
+def build_cached_graph_page(boot, selected_node=None, height="900px", nonce=None, with_vis=True):
+    """浏览器缓存模式的图谱页面：数据、布局和vis脚本都尽量从IndexedDB读取"""
+    vis = dict(load_vis_assets(), key=VIS_ASSET_KEY) if with_vis else {"key": VIS_ASSET_KEY}
+    boot = dict(boot, label=TARGET_LABEL, vis=vis, selected=selected_node, nonce=nonce)
+    # 防止数据中的 </script> 提前结束脚本
+    boot_json = json.dumps(boot, ensure_ascii=False).replace("</", "<\\/")
+    html_content = f"""<html>
+<head>
+<meta charset="utf-8">
+<style>#mynetwork {{ width: 100%; height: {height}; background-color: #ffffff; position: relative; }}</style>
+</head>
+<body>
+<div id="mynetwork"></div>
+{CACHED_GRAPH_LOADER.replace("__BOOT__", boot_json)}
+</body>
+</html>"""
+    # 节点详情和关系数据由加载器从缓存中恢复，这里沿用加载器已设置的值
+    return inject_click_handler(html_content, "window.nodesData || {}", "window.edgesData || []")
+
+def wait_local_storage_js(setup, key, done):
+    """生成一段异步脚本：执行setup后轮询localStorage[key]，直到done(value)成立或超时，返回最终的值"""
+    return f"""new Promise(function(resolve) {{
+        {setup}
+        var deadline = Date.now() + {GRAPH_ACK_SECONDS * 1000};
+        (function check() {{
+            var value = localStorage.getItem({json.dumps(key)});
+            if ((function(value) {{ return {done}; }})(value) || Date.now() > deadline) {{ resolve(value || 'none'); return; }}
+            setTimeout(check, 200);
+        }})();
+    }})"""
+
+def read_graph_status(nonce):
+    """等待图谱页报告本次加载的结果，返回 {version, vis, miss}；未收到报告时返回None"""
+    from streamlit_javascript import st_javascript
+    
+    raw = st_javascript(
+        wait_local_storage_js("", f"graph_cache_status_{TARGET_LABEL}", f"value && JSON.parse(value).nonce === {json.dumps(nonce)}"),
+        key=f"graph_status_{nonce}"
+    )
+    if not raw:
+        return None
+    try:
+        status = json.loads(raw)
+    except (TypeError, ValueError):
+        status = None
+    if not isinstance(status, dict) or status.get("nonce") != nonce:
+        # 超时：无法确认浏览器缓存了什么，按没有缓存处理
+        return {"version": "none", "vis": False, "miss": False}
+    return status
+
+def read_graph_cache_cookie():
+    """图谱页写入的缓存状态Cookie，返回 {version, vis}；Streamlit 版本不支持读取Cookie时返回None"""
+    from urllib.parse import unquote
+    
+    cookies = getattr(getattr(st, "context", None), "cookies", None)
+    if cookies is None:
+        return None
+    value = cookies.get(f"graph_cache_{TARGET_LABEL}")
+    # 缺失或格式不对时按没有缓存处理（发送全量数据）
+    version, _, vis_key = unquote(value if isinstance(value, str) else "").partition("|")
+    return {"version": version or "none", "vis": vis_key == VIS_ASSET_KEY}
+
+def render_student_graph(snapshot, selected_node):
+    """学生端图谱：按浏览器已缓存的图谱版本只发送版本号、增量或全量数据。
+    缓存状态优先从Cookie读取（首次运行即可发送图谱），不支持时再用脚本询问浏览器"""
+    from streamlit_javascript import st_javascript
+    
+    if st.session_state.pop("graph_force_full", False):
+        st.session_state.graph_client_version = "none"
+        st.session_state.graph_client_vis = False
+        st.session_state.pop("graph_sent", None)
+    if st.session_state.get("graph_client_version") is None:
+        cached = read_graph_cache_cookie()
+        if cached is not None:
+            st.session_state.graph_client_version = cached["version"]
+            st.session_state.graph_client_vis = cached["vis"]
+    if st.session_state.get("graph_client_version") is None:
+        reported = st_javascript(
+            f"(function() {{ try {{ return JSON.stringify({{version: localStorage.getItem('graph_cache_version_{TARGET_LABEL}') || 'none', "
+            f"vis: localStorage.getItem('graph_vis_asset') === '{VIS_ASSET_KEY}'}}); }} catch(e) {{ return '{{}}'; }} }})()",
+            key="graph_cache_handshake"
+        )
+        if not reported:
+            st.caption("⏳ 正在加载图谱...")
+            return False
+        try:
+            handshake = json.loads(reported)
+        except (TypeError, ValueError):
+            handshake = {}
+        st.session_state.graph_client_version = str(handshake.get("version") or "none")
+        st.session_state.graph_client_vis = bool(handshake.get("vis"))
+    
+    # 版本和选中节点都没变时沿用上次发送的页面，避免iframe重新加载
+    sent = st.session_state.get("graph_sent")
+    if sent is None or (sent["version"], sent["selected"]) != (snapshot["version"], selected_node):
+        token = get_session_key()[:8]
+        seq = st.session_state.get("graph_boot_seq", 0) + 1
+        st.session_state.graph_boot_seq = seq
+        sent = {
+            "version": snapshot["version"],
+            "selected": selected_node,
+            "nonce": f"{token}-{seq}",
+            "boot": get_client_boot(st.session_state.graph_client_version, snapshot["version"], snapshot["client_payload"]),
+            "with_vis": not st.session_state.graph_client_vis
+        }
+        st.session_state.graph_sent = sent
+    components.html(
+        build_cached_graph_page(sent["boot"], selected_node, nonce=sent["nonce"], with_vis=sent["with_vis"]),
+        height=1000, scrolling=False
+    )
+    
+    # 浏览器缓存的版本只以图谱页的报告为准（写入IndexedDB成功后才算缓存）
+    status = read_graph_status(sent["nonce"])
+    if status and st.session_state.get("graph_status_seen") != sent["nonce"]:
+        st.session_state.graph_status_seen = sent["nonce"]
+        st.session_state.graph_client_version = str(status.get("version") or "none")
+        st.session_state.graph_client_vis = bool(status.get("vis"))
+        if status.get("miss"):
+            # 本地缓存缺失：按浏览器报告的状态重新发送全量数据
+            st.session_state.pop("graph_sent", None)
+            st.rerun()
+    
+    sync_student_graph()
+    
+    if st.button("🔄 重新加载图谱", key="graph_force_full_btn"):
+        st.session_state.graph_force_full = True
+        st.rerun()
+    return True
+
+def push_graph_update(client_version, boot):
+    """把新版本的增量（或全量）写入浏览器localStorage，已打开的图谱页通过storage事件就地更新；返回浏览器确认缓存的版本"""
+    from streamlit_javascript import st_javascript
+    
+    payload = json.dumps(boot, ensure_ascii=False, separators=(",", ":"))
+    setup = f"localStorage.setItem({json.dumps(f'graph_delta_{TARGET_LABEL}')}, {json.dumps(payload)});"
+    return st_javascript(
+        wait_local_storage_js(setup, f"graph_cache_version_{TARGET_LABEL}", f"value === {json.dumps(boot['version'])}"),
+        key=f"graph_delta_{client_version}_{boot['version']}"
+    )
+
+def sync_student_graph():
+    """定时检查图谱是否被管理端编辑过，只把增量推送给本会话的图谱页，不重新渲染整个页面"""
+    def check():
+        graph_store = get_graph_store()
+        client_version = st.session_state.get("graph_client_version")
+        if graph_store is None or client_version in (None, graph_store.version):
+            return
+        current = graph_store.snapshot
+        boot = get_client_boot(client_version, current["version"], current["client_payload"])
+        reported = push_graph_update(client_version, boot)
+        if reported:
+            # 以图谱页实际写入缓存的版本为准；页面没有应用增量时保持原版本，下次渲染照此发送
+            st.session_state.graph_client_version = str(reported)
+            if reported == current["version"]:
+                st.caption(f"🔄 图谱已更新到版本 {current['version']}")
+    
+    fragment = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None)
+    if fragment is not None:
+        fragment(run_every=GRAPH_SYNC_SECONDS)(check)()
+
+# ==================== 学生端页面 ====================
+def student_page(store, snapshot):
+    """学生端：浏览知识图谱"""
+    json_data = snapshot["json_data"]
+    
+    # ========== 左侧侧边栏：登录和节点详情 ==========
+    with st.sidebar:
+        st.markdown("### 👤 学生登录")
+        login_input = st.text_input("学号或姓名", value=st.session_state.get("login_input", ""), key="login_input_field")
+        
+        if st.button("确认登录", type="primary", use_container_width=True):
+            if login_input:
+                if st.session_state.get("student_id") != login_input:
+                    flush_interaction_buffer(store)
+                st.session_state.login_input = login_input
+                st.session_state.student_id = login_input
+                st.success(f"欢迎, {login_input}!")
+            else:
+                st.warning("请输入学号或姓名")
+        
+        if st.session_state.get("student_id"):
+            st.markdown(f"✅ 已登录: **{st.session_state.student_id}**")
+            if st.button("退出登录", use_container_width=True):
+                flush_interaction_buffer(store)
+                st.session_state.pop("student_id", None)
+                st.session_state.pop("selected_node", None)
+                st.session_state.login_input = ""
+                st.rerun()
+        
+        st.markdown("---")
+        st.markdown("💡 **提示**: 点击右侧图谱中的节点查看详情")
+        
+        # 读取并处理localStorage中的交互记录
+        if st.session_state.get("student_id"):
+            try:
+                from streamlit_javascript import st_javascript
+                
+                interactions_js = st_javascript("""
+                    var interactions = localStorage.getItem('pending_interactions');
+                    if (interactions) {
+                        localStorage.removeItem('pending_interactions');
+                        interactions;
+                    } else {
+                        null;
+                    }
+                """, key=f"read_interactions_{int(time.time())}")
+                
+                if interactions_js:
+                    import json as json_lib
+                    try:
+                        interactions_list = json_lib.loads(interactions_js)
+                        # 浏览器端的记录可被任意篡改：只接受图谱中存在的节点，单次数量超限的部分直接丢弃
+                        known_nodes = snapshot["index"]["position"]
+                        interactions_list = [
+                            interaction for interaction in interactions_list
+                            if isinstance(interaction, dict) and interaction.get('node_id') in known_nodes
+                        ]
+                        get_ingestion_limiter().reject(
+                            st.session_state.student_id,
+                            len(interactions_list) - INGEST_CLIENT_BATCH_LIMIT
+                        )
+                        for interaction in interactions_list[-INGEST_CLIENT_BATCH_LIMIT:]:
+                            buffer_interaction(
+                                store,
+                                st.session_state.student_id,
+                                interaction['node_id'],
+                                json_data["nodes"][known_nodes[interaction['node_id']]]['label'],
+                                'view',
+                                at=parse_client_timestamp(interaction.get('timestamp'))
+                            )
+                    except:
+                        pass
+            except:
+                pass
+            
+            flush_expired_buffer(store)
+        
+        # ========== 节点列表菜单 ==========
+        if st.session_state.get("student_id"):
+            st.markdown("---")
+            st.markdown("### 📋 知识节点列表")
+            
+            render_node_browser(store, snapshot)
+            
+            # 下一步学习推荐（先占位，图谱发送之后再计算，首屏不等待推荐模型）
+            st.markdown("---")
+            st.markdown("### 🧭 推荐学习")
+            recommend_slot = st.container()
+            
+            # 显示选中节点的详情
+            if st.session_state.get("selected_node"):
+                st.markdown("---")
+                st.markdown("### 📍 节点详情")
+                render_info_card(st.session_state.selected_node)
+    
+    # ========== 主区域 ==========
+    st.title("🌊 范各庄矿突水事故知识图谱")
+    st.markdown("*1984年开滦范各庄矿奥陶系岩溶陷落柱特大突水灾害案例学习*")
+    
+    if not st.session_state.get("student_id"):
+        st.info("💡 请在左侧输入学号和姓名登录")
+        return
+    
+    # 图例（小型，放右侧）
+    st.markdown("##### 📊 知识分类")
+    legend_html = "<div style='display:flex;gap:8px;flex-wrap:wrap;justify-content:flex-end;'>"
+    for cat, color in CATEGORY_COLORS.items():
+        legend_html += f"<span style='background:{color}33;border:1px solid {color};border-radius:4px;padding:2px 8px;font-size:11px;color:{color};'>{cat}</span>"
+    legend_html += "</div>"
+    st.markdown(legend_html, unsafe_allow_html=True)
+    
+    st.markdown("---")
+    
+    # ========== 知识图谱（全宽显示）==========
+    st.markdown("### 🗺️ 知识图谱（点击节点可在左侧查看详情）")
+    
+    # 获取URL参数中的选中节点，用于高亮显示
+    query_params = st.query_params
+    url_selected = query_params.get("selected_node", None)
+    
+    # 图谱数据、布局和vis脚本缓存在浏览器中，重跑和重新打开页面时只发送版本号或增量
+    if render_student_graph(snapshot, url_selected):
+        mark_stage("graph_sent")
+    
+    with recommend_slot:
+        render_recommendations(store, snapshot)
+
+# ==================== 学习行为时序分析 ====================
+def normalize_count_column(df):
+    """一条记录可能合并了多次查看，旧记录没有 count 字段时按 1 次计"""
+    import pandas as pd
+    
+    if "count" in df.columns:
+        df["count"] = pd.to_numeric(df["count"], errors="coerce").fillna(1).astype(int)
+    else:
+        df["count"] = 1
+    return df
+
+TIME_BUCKETS = {"小时": "h", "天": "D", "周": "W-MON"}
+
+def add_time_column(df):
+    """统一解析时间戳为本地时间（ts 列）：兼容本地文件格式、带时区的ISO格式和每日汇总的日期"""
+    import pandas as pd
+    
+    raw = df["timestamp"].astype(str)
+    has_offset = raw.str.contains(r"(?:[+-]\d{2}:?\d{2}|Z)$", regex=True)
+    ts = pd.Series(pd.NaT, index=df.index, dtype="datetime64[ns]")
+    if has_offset.any():
+        local_tz = datetime.now().astimezone().tzinfo
+        aware = pd.to_datetime(raw[has_offset], format="ISO8601", utc=True, errors="coerce")
+        ts[has_offset] = aware.dt.tz_convert(local_tz).dt.tz_localize(None)
+    if (~has_offset).any():
+        ts[~has_offset] = pd.to_datetime(raw[~has_offset], format="mixed", errors="coerce")
+    df["ts"] = ts
+    return df
+
+def activity_curve(df, freq):
+    """按时间桶统计访问量和活跃学生数"""
+    return (
+        df.set_index("ts")
+        .resample(freq)
+        .agg(访问次数=("count", "sum"), 活跃学生数=("student_id", "nunique"))
+    )
+
+def ordered_events(df, gap_minutes):
+    """按学生、时间排序的原始事件，并标注学习会话编号（每日汇总没有先后顺序，不参与）"""
+    import pandas as pd
+    
+    events = df[df["action_type"] != "daily_rollup"].sort_values(["student_id", "ts"], kind="stable")
+    gap = events["ts"].diff() > pd.Timedelta(minutes=gap_minutes)
+    new_student = events["student_id"] != events["student_id"].shift()
+    events = events.assign(session_id=(gap | new_student).cumsum())
+    return events
+
+def segment_sessions(events):
+    """按会话汇总：起止时间、时长、查看次数和覆盖节点数"""
+    sessions = events.groupby("session_id").agg(
+        学号=("student_id", "first"),
+        开始=("ts", "min"),
+        结束=("ts", "max"),
+        查看次数=("count", "sum"),
+        节点数=("node_id", "nunique"),
+        浏览时长=("duration", "sum")
+    )
+    sessions["会话分钟"] = ((sessions["结束"] - sessions["开始"]).dt.total_seconds() / 60).round(1)
+    return sessions.reset_index(drop=True)
+
+def category_coverage(df, node_categories, freq):
+    """各类别的平均知识覆盖率随时间的变化（学生首次访问节点计入覆盖）"""
+    category_sizes = Counter(node_categories.values())
+    first_visits = df.groupby(["student_id", "node_id"], sort=False)["ts"].min().reset_index()
+    first_visits["category"] = first_visits["node_id"].map(node_categories)
+    first_visits = first_visits.dropna(subset=["category", "ts"])
+    if first_visits.empty:
+        return first_visits
+    
+    reached = (
+        first_visits.set_index("ts")
+        .groupby("category")
+        .resample(freq)
+        .size()
+        .unstack(level=0, fill_value=0)
+        .cumsum()
+    )
+    student_count = df["student_id"].nunique()
+    totals = reached.columns.map(lambda cat: category_sizes[cat] * student_count)
+    return (reached / totals).round(3)
+
+def transition_matrix(events):
+    """会话内相邻两次访问的节点转移计数矩阵（行：来源节点，列：去向节点）"""
+    import pandas as pd
+    
+    next_node = events.groupby("session_id", sort=False)["node_id"].shift(-1)
+    moves = events.assign(next_node=next_node).dropna(subset=["next_node"])
+    moves = moves[moves["node_id"] != moves["next_node"]]
+    return pd.crosstab(moves["node_id"], moves["next_node"])
+
+ANALYTICS_COLUMNS = ["student_id", "node_id", "action_type", "count", "duration", "ts"]
+
+def load_interaction_frame(store, start, end):
+    """流式读取，只保留时间范围内记录的分析所需列"""
+    import pandas as pd
+    
+    frames = []
+    for df in iter_interaction_frames(store):
+        df = add_time_column(df)
+        df = df.loc[(df["ts"] >= start) & (df["ts"] < end), ANALYTICS_COLUMNS]
+        if not df.empty:
+            frames.append(df)
+    if not frames:
+        # 没有记录时返回带分析列的空表，后续计算照常进行
+        return add_time_column(pd.DataFrame(columns=INTERACTION_FIELDS))[ANALYTICS_COLUMNS]
+    return pd.concat(frames, ignore_index=True)
+
+@st.cache_data(ttl=ANALYTICS_CACHE_TTL, max_entries=32)
+def compute_time_analytics(data_key, start, end, freq, gap_minutes, _store, _node_categories):
+    """计算并按（数据版本，时间范围，粒度）缓存时序分析结果（未命中时才读取数据，在进程池中计算）"""
+    df = load_interaction_frame(_store, start, end)
+    return get_worker_pool().run(
+        "time_analytics_job", df, start, end, freq, gap_minutes, _node_categories,
+        cache_key=f"analytics:{data_key}:{start}:{end}:{freq}:{gap_minutes}"
+    )
+
+def time_analytics_job(df, start, end, freq, gap_minutes, node_categories):
+    """时序分析的计算部分（可在子进程中执行）"""
+    in_range = df[(df["ts"] >= start) & (df["ts"] < end)]
+    events = ordered_events(in_range, gap_minutes)
+    return {
+        "activity": activity_curve(in_range, freq),
+        "sessions": segment_sessions(events),
+        "coverage": category_coverage(in_range, node_categories, freq),
+        "transitions": transition_matrix(events)
+    }
+
+def render_time_analytics(store, metrics, node_categories, node_labels):
+    """时序与群体分析区块（只读取所选时间范围内的记录）"""
+    import pandas as pd
+    
+    st.markdown("## ⏱️ 时序与群体分析")
+    if metrics.first_ts is None:
+        st.info("没有可解析时间的访问记录")
+        return
+    
+    first_day = metrics.first_ts.date()
+    last_day = metrics.last_ts.date()
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        date_range = st.date_input("时间范围", value=(first_day, last_day), min_value=first_day, max_value=last_day)
+    with col2:
+        bucket = st.selectbox("时间粒度", options=list(TIME_BUCKETS.keys()), index=1)
+    with col3:
+        gap_minutes = st.number_input("会话间隔(分钟)", min_value=1, value=SESSION_GAP_MINUTES, step=5)
+    
+    if not isinstance(date_range, (list, tuple)) or len(date_range) != 2:
+        st.caption("请选择起止日期")
+        return
+    start = pd.Timestamp(date_range[0])
+    end = pd.Timestamp(date_range[1]) + pd.Timedelta(days=1)
+    
+    # 数据版本：记录数和最新时间，数据不变时直接命中缓存
+    result = compute_time_analytics(metrics.data_key(), start, end, TIME_BUCKETS[bucket], int(gap_minutes), store, node_categories)
+    
+    st.markdown("### 📈 学习活跃度曲线")
+    st.line_chart(result["activity"])
+    
+    st.markdown("### 🕒 学习会话")
+    sessions = result["sessions"]
+    if sessions.empty:
+        st.info("所选范围内没有会话数据")
+    else:
+        per_student = sessions.groupby("学号").agg(
+            会话数=("开始", "size"),
+            平均会话分钟=("会话分钟", "mean"),
+            平均查看次数=("查看次数", "mean")
+        ).round(1).sort_values("会话数", ascending=False)
+        st.dataframe(per_student, use_container_width=True)
+    
+    st.markdown("### 🧩 类别知识覆盖率")
+    if result["coverage"].empty:
+        st.info("所选范围内没有覆盖数据")
+    else:
+        st.line_chart(result["coverage"])
+    
+    st.markdown("### 🔀 节点转移矩阵")
+    transitions = result["transitions"]
+    if transitions.empty:
+        st.info("所选范围内没有节点间的跳转")
+    else:
+        st.dataframe(
+            transitions.rename(index=node_labels, columns=node_labels),
+            use_container_width=True
+        )
+
+# ==================== 学习路径流向图 ====================
+def parse_record_time(value):
+    """把记录中的时间戳（本地格式、带时区ISO或日期）解析为秒数，失败时返回None"""
+    try:
+        parsed = datetime.fromisoformat(str(value))
+    except ValueError:
+        return None
+    return parsed.timestamp()
+
+class TransitionAggregator:
+    """从交互流增量累计节点转移次数（A → B），每个学生只保留上一次访问的节点和时间"""
+    
+    def __init__(self, gap_minutes=SESSION_GAP_MINUTES):
+        self.gap_seconds = gap_minutes * 60
+        self.last_visit = {}  # 学号 -> (节点ID, 时间)
+        self.by_student = {}  # 学号 -> Counter{(来源, 去向): 次数}
+        self.totals = Counter()
+    
+    def apply(self, records):
+        """按时间顺序累加一批记录；间隔超过会话阈值的两次访问不算转移"""
+        for record in records:
+            if record.get("action_type") == "daily_rollup":
+                continue
+            at = parse_record_time(record.get("timestamp"))
+            if at is None:
+                continue
+            student_id = record["student_id"]
+            node_id = record["node_id"]
+            previous = self.last_visit.get(student_id)
+            if previous and at < previous[1]:
+                continue  # 迟到的乱序记录不改变路径
+            self.last_visit[student_id] = (node_id, at)
+            if previous and previous[0] != node_id and at - previous[1] <= self.gap_seconds:
+                move = (previous[0], node_id)
+                self.by_student.setdefault(student_id, Counter())[move] += 1
+                self.totals[move] += 1
+    
+    def flows(self, students=None):
+        """全体或指定学生群体的转移计数"""
+        if not students:
+            return Counter(self.totals)
+        combined = Counter()
+        for student_id in students:
+            combined.update(self.by_student.get(student_id, {}))
+        return combined
+
+def build_flow_overlay(flows, max_edges=FLOW_MAX_EDGES, min_count=1):
+    """把转移计数转换为叠加到图谱上的边，线宽按频次缩放"""
+    top = [(move, count) for move, count in flows.most_common(max_edges) if count >= min_count]
+    if not top:
+        return []
+    max_count = top[0][1]
+    return [
+        {
+            "id": f"flow_{index}",
+            "from": source,
+            "to": target,
+            "width": round(1 + 11 * count / max_count, 1),
+            "title": f"{count} 次",
+            "color": {"color": "rgba(255,107,107,0.75)", "highlight": "#FF6B6B"},
+            "arrows": {"to": {"enabled": True, "scaleFactor": 0.6}},
+            "smooth": {"enabled": True, "type": "curvedCW", "roundness": 0.2},
+            "physics": False
+        }
+        for index, ((source, target), count) in enumerate(top)
+    ]
+
+def render_flow_graph(snapshot, overlay_edges, height=900):
+    """在已有图谱上叠加学习流向边：原有关系变淡，流向边按频次加粗"""
+    overlay_script = f"""
+    <script>
+    (function() {{
+        var flowEdges = {json.dumps(overlay_edges, ensure_ascii=False)};
+        function applyFlowOverlay() {{
+            if (typeof network === 'undefined' || !network) {{
+                setTimeout(applyFlowOverlay, 300);
+                return;
+            }}
+            network.once('stabilized', function() {{
+                network.setOptions({{physics: {{enabled: false}}}});
             }});
-            relHtml += '</div>';
-            
-            relationsContent.innerHTML = hasRelations ? relHtml : '';
-            panel.style.display = 'block';
+            var faded = network.body.data.edges.get().map(function(edge) {{
+                return {{id: edge.id, color: '#e6e6e6', font: {{color: '#cccccc'}}}};
+            }});
+            network.body.data.edges.update(faded);
+            network.body.data.edges.add(flowEdges);
         }}
-        
-        setTimeout(tryBindEvents, 500);
-    }};
+        applyFlowOverlay();
+    }})();
     </script>
     """
-    html_content = html_content.replace("</body>", click_handler + "</body>")
+    components.html(snapshot["html"].replace("</body>", overlay_script + "</body>"), height=height, scrolling=False)
+
+# ==================== 报表导出服务 ====================
+EXPORT_KINDS = {
+    "student_csv": "每名学生一个CSV（ZIP打包）",
+    "student_xlsx": "每名学生一个工作表（XLSX）",
+    "class_parquet": "全班访问记录（Parquet）",
+    "class_json": "全班访问记录与汇总（JSON）",
+    "graph_html": "知识图谱静态网页（HTML）"
+}
+EXPORT_DEPENDENCIES = {
+    "student_xlsx": "openpyxl",
+    "class_parquet": "pyarrow"
+}
+EXPORT_EXTENSIONS = {
+    "student_csv": "zip",
+    "student_xlsx": "xlsx",
+    "class_parquet": "parquet",
+    "class_json": "json",
+    "graph_html": "html"
+}
+
+def available_export_kinds():
+    """可选依赖已安装的导出类型"""
+    import importlib.util
     
-    components.html(html_content, height=1000, scrolling=False)
+    return [
+        kind for kind in EXPORT_KINDS
+        if kind not in EXPORT_DEPENDENCIES or importlib.util.find_spec(EXPORT_DEPENDENCIES[kind]) is not None
+    ]
 
-# ==================== 管理端页面 ====================
-def admin_page(conn, json_data):
-    """管理端：查看学生访问数据"""
-    st.title("📊 管理端 - 学生学习数据分析")
+def stream_progress(written):
+    """总条数未知时按已读取的记录数逼近进度（0.5 起，趋近 0.9）"""
+    return 0.9 - 0.4 / (1 + written / STREAM_CHUNK_SIZE)
+
+def iter_export_chunks(source, ordered=False):
+    """按提交导出时取得的数据版本分块读取记录：有发件箱时截止到当时的序号，否则截止到当时的时间水位线；
+    其间记录被清除或压缩时中止，避免文件名中的版本与内容不符"""
+    def included(record):
+        at = parse_record_time(record.get("timestamp"))
+        return at is None or (source["until_time"] is not None and at <= source["until_time"])
     
-    # 显示数据来源信息
-    if conn.driver:
-        st.info("📡 数据来源: Neo4j 数据库")
-    else:
-        st.info("📁 数据来源: 本地文件 (interactions_log.json)")
+    for chunk in iter_interaction_chunks(source["store"], ordered=ordered, until_seq=source["until_seq"]):
+        if get_data_generation().value != source["generation"]:
+            raise RuntimeError("导出期间访问记录已被清除或压缩，请重新生成")
+        if source["until_seq"] is None:
+            chunk = [record for record in chunk if included(record)]
+        if chunk:
+            yield chunk
+
+def export_student_csv(path, source, progress):
+    """按块流式读取，逐块追加到每名学生的临时CSV，最后打包（不把全班记录一次性读入内存）"""
+    import csv
+    import tempfile
+    import zipfile
     
-    # 获取所有交互数据
-    interactions = get_all_interactions(conn)
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(path)) as tmp_dir:
+        files = {}  # 学号 -> 临时文件名
+        written = 0
+        for chunk in iter_export_chunks(source, ordered=True):
+            by_student = {}
+            for record in chunk:
+                by_student.setdefault(str(record.get("student_id")), []).append(record)
+            for student_id, records in by_student.items():
+                if student_id not in files:
+                    safe_name = "".join(ch if ch.isalnum() or ch in "-_" else "_" for ch in student_id)
+                    files[student_id] = f"{safe_name}_{len(files)}.csv"
+                tmp_path = os.path.join(tmp_dir, files[student_id])
+                is_new = not os.path.exists(tmp_path)
+                with open(tmp_path, "a", encoding="utf-8-sig" if is_new else "utf-8", newline="") as f:
+                    writer = csv.DictWriter(f, fieldnames=INTERACTION_FIELDS, extrasaction="ignore")
+                    if is_new:
+                        writer.writeheader()
+                    writer.writerows(records)
+            written += len(chunk)
+            progress(stream_progress(written), f"已读取 {written} 条")
+        used_names = set()
+        with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+            for index, (student_id, filename) in enumerate(files.items(), 1):
+                # 不同学号替换特殊字符后可能同名，重名时加序号
+                name = filename.rsplit("_", 1)[0]
+                if name in used_names:
+                    name = f"{name}_{index}"
+                used_names.add(name)
+                archive.write(os.path.join(tmp_dir, filename), f"{name}.csv")
+                progress(0.9 + 0.1 * index / len(files), f"已打包 {index}/{len(files)} 名学生")
+
+def export_student_xlsx(path, source, progress):
+    """openpyxl 只写模式：按块流式读取，逐行追加到各学生的工作表"""
+    from openpyxl import Workbook
     
-    # 调试信息
-    st.caption(f"共获取到 {len(interactions)} 条记录")
+    workbook = Workbook(write_only=True)
+    sheets = {}
+    written = 0
+    for chunk in iter_export_chunks(source, ordered=True):
+        for record in chunk:
+            student_id = str(record.get("student_id"))
+            sheet = sheets.get(student_id)
+            if sheet is None:
+                # Excel工作表名最长31个字符且不能重复
+                sheet_name = student_id[:31]
+                used_names = {ws.title for ws in sheets.values()}
+                while sheet_name in used_names:
+                    sheet_name = f"{sheet_name[:27]}_{len(sheets)}"
+                sheet = sheets[student_id] = workbook.create_sheet(sheet_name)
+                sheet.append(list(INTERACTION_FIELDS))
+            sheet.append([record.get(field) for field in INTERACTION_FIELDS])
+        written += len(chunk)
+        progress(stream_progress(written), f"已导出 {written} 条")
+    if not sheets:
+        workbook.create_sheet("空")
+    progress(0.95, "正在写入文件")
+    workbook.save(path)
+
+def export_class_parquet(path, source, progress):
+    """按块流式写入Parquet，不把全班记录一次性读入内存"""
+    import pandas as pd
+    import pyarrow as pa
+    import pyarrow.parquet as pq
     
-    if not interactions:
-        st.warning("暂无学生访问数据。请先在学生端浏览知识图谱，数据会自动记录。")
-        
-        # 显示本地文件状态
-        if os.path.exists(INTERACTIONS_FILE):
-            st.info(f"✅ 本地记录文件存在: {INTERACTIONS_FILE}")
-            try:
-                with open(INTERACTIONS_FILE, 'r', encoding='utf-8') as f:
-                    local_data = json.load(f)
-                    st.write(f"本地文件中有 {len(local_data)} 条记录")
-                    if local_data:
-                        st.dataframe(pd.DataFrame(local_data), use_container_width=True)
-            except Exception as e:
-                st.error(f"读取本地文件失败: {e}")
-        else:
-            st.warning(f"❌ 本地记录文件不存在: {INTERACTIONS_FILE}")
+    schema = pa.schema([
+        ("interaction_id", pa.string()),
+        ("student_id", pa.string()),
+        ("node_id", pa.string()),
+        ("node_label", pa.string()),
+        ("action_type", pa.string()),
+        ("duration", pa.float64()),
+        ("count", pa.int64()),
+        ("timestamp", pa.string())
+    ])
+    written = 0
+    with pq.ParquetWriter(path, schema) as writer:
+        for chunk in iter_export_chunks(source):
+            df = normalize_count_column(pd.DataFrame(chunk, columns=INTERACTION_FIELDS))
+            df["duration"] = df["duration"].astype(float)
+            df["timestamp"] = df["timestamp"].astype(str)
+            writer.write_table(pa.Table.from_pandas(df, schema=schema, preserve_index=False))
+            written += len(df)
+            progress(stream_progress(written), f"已写入 {written} 条")
+
+def export_class_json(path, source, progress):
+    """按块流式写入记录数组，汇总在读取过程中累计，写在记录之后（写入的是导出服务的临时文件，失败时由服务删除）"""
+    by_student = Counter()
+    by_node = Counter()
+    written = 0
+    with open(path, "w", encoding="utf-8") as f:
+        f.write('{\n  "generated_at": %s,\n  "records": [' % json.dumps(datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+        for chunk in iter_export_chunks(source):
+            for record in chunk:
+                f.write(("," if written else "") + "\n    " + json.dumps(record, ensure_ascii=False, default=str))
+                count = int(record.get("count") or 1)
+                by_student[record.get("student_id")] += count
+                by_node[record.get("node_id")] += count
+                written += 1
+            progress(stream_progress(written), f"已写入 {written} 条")
+        summary = {
+            "total_visits": sum(by_student.values()),
+            "students": len(by_student),
+            "nodes": len(by_node),
+            "by_student": dict(by_student),
+            "by_node": dict(by_node)
+        }
+        f.write('\n  ],\n  "summary": %s\n}\n' % json.dumps(summary, ensure_ascii=False, indent=2).replace("\n", "\n  "))
+
+EXTERNAL_ASSET_PATTERN = re.compile(
+    r'<link\b[^>]*href="https?://[^"]*"[^>]*>'
+    r'|<script\b[^>]*src="https?://[^"]*"[^>]*>\s*</script>'
+    r'|<!--\s*<link[^>]*node_modules.*?-->',
+    re.DOTALL
+)
+
+def export_graph_html(path, snapshot, progress):
+    """导出可离线打开的静态网页：去掉CDN上的vis-network和bootstrap，改为内联仓库自带的脚本和样式"""
+    html_content = inject_click_handler(snapshot["html"], snapshot["nodes_json"], snapshot["edges_json"])
+    html_content = EXTERNAL_ASSET_PATTERN.sub("", html_content)
+    with open(os.path.join(current_dir, "lib", "bindings", "utils.js"), "r", encoding="utf-8") as f:
+        utils_js = f.read()
+    vis = load_vis_assets()
+    inline_assets = f"<style>{vis['css']}</style>\n<script>{vis['js']}</script>\n<script>{utils_js}</script>"
+    html_content = html_content.replace('<script src="lib/bindings/utils.js"></script>', inline_assets, 1)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(html_content)
+
+EXPORTERS = {
+    "student_csv": export_student_csv,
+    "student_xlsx": export_student_xlsx,
+    "class_parquet": export_class_parquet,
+    "class_json": export_class_json,
+    "graph_html": export_graph_html
+}
+
+class ExportService:
+    """后台导出：在线程池中生成文件并汇报进度，相同数据版本的导出直接复用已生成的文件"""
+    
+    def __init__(self, workers=EXPORT_WORKERS):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="export")
+        self.jobs = {}
+        self.lock = threading.Lock()
+    
+    def submit(self, kind, data_key, payload):
+        """提交导出任务，返回任务键；同一版本的任务正在进行或已完成时不重复生成"""
+        filename = f"{kind}_{data_key}.{EXPORT_EXTENSIONS[kind]}"
+        path = os.path.join(EXPORT_DIR, filename)
+        with self.lock:
+            job = self.jobs.get(filename)
+            if job and job["status"] in ("running", "done") and (job["status"] == "running" or os.path.exists(path)):
+                return filename
+            job = {"kind": kind, "path": path, "status": "running", "progress": 0.0, "message": "排队中", "error": None,
+                   "created_at": datetime.now().strftime("%H:%M:%S"), "finished_at": None}
+            self.jobs[filename] = job
+            if os.path.exists(path):
+                job.update(status="done", progress=1.0, message="已复用之前生成的文件", finished_at=time.time())
+                return filename
+        self.executor.submit(self._run, job, payload)
+        return filename
+    
+    def _run(self, job, payload):
+        def progress(fraction, message):
+            job["progress"] = min(max(fraction, 0.0), 1.0)
+            job["message"] = message
         
-        # 提供初始化数据选项
-        if conn.driver and st.button("🔄 初始化知识图谱数据到Neo4j"):
-            with st.spinner("正在导入数据..."):
-                if init_neo4j_data(conn, json_data):
-                    init_interaction_table(conn)
-                    st.success("✅ 数据初始化成功！")
-                else:
-                    st.error("❌ 数据初始化失败")
+        os.makedirs(EXPORT_DIR, exist_ok=True)
+        root, ext = os.path.splitext(job["path"])
+        tmp_path = f"{root}.part{ext}"  # 保留扩展名，pandas按扩展名选择写入引擎
+        try:
+            progress(0.0, "正在生成")
+            EXPORTERS[job["kind"]](tmp_path, payload, progress)
+            os.replace(tmp_path, job["path"])
+            job.update(status="done", progress=1.0, message="已完成", finished_at=time.time())
+        except ImportError as e:
+            job.update(status="failed", error=f"缺少可选依赖: {e.name}", finished_at=time.time())
+        except Exception as e:
+            job.update(status="failed", error=str(e), finished_at=time.time())
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    
+    def list_jobs(self):
+        with self.lock:
+            self._expire(time.time())
+            return list(self.jobs.items())
+    
+    def _expire(self, now):
+        """移除完成超过保留时间的任务，并删除其文件"""
+        for filename, job in list(self.jobs.items()):
+            if job["finished_at"] is not None and now - job["finished_at"] > EXPORT_JOB_TTL:
+                del self.jobs[filename]
+                try:
+                    os.remove(job["path"])
+                except OSError:
+                    pass
+
+@st.cache_resource
+def get_export_service():
+    """进程内共享的导出服务（导出任务在各会话和重跑之间保留）"""
+    return ExportService()
+
+def render_export_panel(snapshot, data_key, source):
+    """导出区块：提交后台任务（任务中按提交时的数据版本读取记录），并显示进度和下载按钮"""
+    service = get_export_service()
+    kinds = available_export_kinds()
+    missing = [EXPORT_DEPENDENCIES[kind] for kind in EXPORT_KINDS if kind not in kinds]
+    col1, col2 = st.columns([3, 1])
+    with col1:
+        kind = st.selectbox("导出内容", options=kinds, format_func=EXPORT_KINDS.get, key="export_kind")
+        if missing:
+            st.caption(f"安装 {'、'.join(missing)} 后可导出更多格式")
+    with col2:
+        st.write("")
+        if st.button("📦 生成导出文件", use_container_width=True):
+            if kind == "graph_html":
+                service.submit(kind, snapshot["version"], snapshot)
+            else:
+                service.submit(kind, data_key, source)
+    
+    def job_list():
+        running = False
+        for filename, job in sorted(service.list_jobs(), key=lambda item: item[1]["created_at"], reverse=True):
+            label = f"{EXPORT_KINDS[job['kind']]}（{job['created_at']}）"
+            if job["status"] == "running":
+                running = True
+                st.progress(job["progress"], text=f"{label}：{job['message']}")
+            elif job["status"] == "failed":
+                st.error(f"{label} 导出失败：{job['error']}")
+        return running
+    
+    def download_selected():
+        """只读取选中的一个文件提供下载，不在每次重跑时读取全部已完成的文件"""
+        done = [(filename, job) for filename, job in service.list_jobs()
+                if job["status"] == "done" and os.path.exists(job["path"])]
+        if not done:
+            return
+        done.sort(key=lambda item: item[1]["created_at"], reverse=True)
+        labels = {filename: f"{EXPORT_KINDS[job['kind']]}（{job['created_at']}）" for filename, job in done}
+        col1, col2 = st.columns([3, 1])
+        with col1:
+            filename = st.selectbox("已生成的文件", options=list(labels), format_func=labels.get, key="export_download")
+        with col2:
+            st.write("")
+            with open(dict(done)[filename]["path"], "rb") as f:
+                st.download_button("⬇️ 下载", data=f.read(), file_name=filename, key="export_download_btn", use_container_width=True)
+    
+    fragment = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None)
+    if fragment is None:
+        job_list()
+        download_selected()
         return
     
-    df = pd.DataFrame(interactions)
+    # 有任务进行中时每秒只重跑本区块刷新进度，全部完成后整页重跑一次以停止定时刷新
+    any_running = any(job["status"] == "running" for _, job in service.list_jobs())
     
-    # 整体统计
-    st.markdown("## 📈 整体数据统计")
+    @fragment(run_every=1 if any_running else None)
+    def job_progress():
+        if not job_list() and any_running:
+            st.rerun()
+    job_progress()
+    download_selected()
+
+# ==================== 节点热度图 ====================
+HEATMAP_MODES = {"visits": "访问次数", "dwell": "浏览时长", "off": "关闭"}
+HEAT_LOW = (255, 243, 176)  # 热度最低的颜色（浅黄）
+HEAT_HIGH = (215, 38, 61)  # 热度最高的颜色（深红）
+
+class NodePopularityIndex:
+    """每个节点的访问次数和浏览时长汇总（由交互记录增量消费者累加）"""
+    
+    def __init__(self):
+        self.visits = Counter()
+        self.dwell = Counter()
+        self.revision = 0  # 每次数据变化递增，用于缓存叠加样式
+    
+    def apply(self, records):
+        for record in records:
+            self.visits[record["node_id"]] += int(record.get("count") or 1)
+            self.dwell[record["node_id"]] += record.get("duration") or 0
+        self.revision += 1
+
+@st.cache_data(max_entries=16)
+def build_heatmap_overlay(mode, generation, revision, _index):
+    """按热度生成节点的缩放比例和颜色（只包含有访问记录的节点）"""
+    values = _index.visits if mode == "visits" else _index.dwell
+    max_value = max(values.values(), default=0)
+    if max_value <= 0:
+        return {}
+    overlay = {}
+    for node_id, value in values.items():
+        ratio = value / max_value
+        color = "#%02x%02x%02x" % tuple(int(low + (high - low) * ratio) for low, high in zip(HEAT_LOW, HEAT_HIGH))
+        text = f"访问 {_index.visits[node_id]} 次" if mode == "visits" else f"浏览 {round(_index.dwell[node_id], 1)} 秒"
+        overlay[node_id] = {"scale": round(0.6 + 1.4 * ratio, 2), "color": color, "text": text}
+    return overlay
+
+def render_heatmap_section(feed, snapshot):
+    """节点热度图：图谱HTML保持不变，切换模式或数据更新时只推送样式增量"""
+    st.markdown("## 🔥 节点热度图")
+    mode = st.radio("热度依据", options=list(HEATMAP_MODES.keys()), format_func=HEATMAP_MODES.get, horizontal=True, key="heatmap_mode")
+    with feed.lock:
+        index = feed.popularity
+        overlay = {} if mode == "off" else build_heatmap_overlay(mode, feed.generation, index.revision, index)
+    st.caption("节点越大、越红表示热度越高；未被访问的节点保持原样")
+    
+    html_content = inject_click_handler(snapshot["html"], snapshot["nodes_json"], snapshot["edges_json"], overlay_channel="heatmap")
+    components.html(html_content, height=900, scrolling=False)
+    push_graph_overlay("heatmap", overlay)
+
+# ==================== 管理端实时模式 ====================
+class InteractionMetrics:
+    """访问统计：按块或按新增记录累加，内存只与学生数、节点数有关（实时模式首次全量加载后只累加增量）"""
+    
+    def __init__(self, node_categories, generation=0):
+        self.node_categories = node_categories
+        self.generation = generation
+        self.records = 0
+        self.total = 0
+        self.duration_sum = 0.0
+        self.duration_records = 0
+        self.by_student = Counter()
+        self.by_node = Counter()
+        self.node_labels = {}
+        self.time_watermark = ""  # 最新一条记录的时间戳
+        self.first_ts = None  # 可解析时间的最早/最晚记录（本地时间）
+        self.last_ts = None
+    
+    def apply(self, records):
+        """把一批新记录累加到各项统计"""
+        applied = 0
+        for record in records:
+            count = int(record.get("count") or 1)
+            duration = record.get("duration") or 0
+            self.total += count
+            if duration > 0:
+                self.duration_sum += duration
+                self.duration_records += 1
+            self.by_student[record["student_id"]] += count
+            self.by_node[record["node_id"]] += count
+            self.node_labels[record["node_id"]] = record.get("node_label", record["node_id"])
+            timestamp = record.get("timestamp") or ""
+            if timestamp > self.time_watermark:
+                self.time_watermark = timestamp
+            at = parse_record_time(timestamp)
+            if at is not None:
+                at = datetime.fromtimestamp(at)
+                self.first_ts = at if self.first_ts is None else min(self.first_ts, at)
+                self.last_ts = at if self.last_ts is None else max(self.last_ts, at)
+            applied += 1
+        self.records += applied
+        return applied
+    
+    def apply_frame(self, df):
+        """向量化累加一块记录（df 已经过 normalize_count_column）"""
+        import pandas as pd
+        
+        if df.empty:
+            return
+        self.records += len(df)
+        self.total += int(df["count"].sum())
+        duration = pd.to_numeric(df["duration"], errors="coerce")
+        positive = duration[duration > 0]
+        self.duration_sum += float(positive.sum())
+        self.duration_records += len(positive)
+        self.by_student.update(df.groupby("student_id")["count"].sum().to_dict())
+        self.by_node.update(df.groupby("node_id")["count"].sum().to_dict())
+        labels = df.drop_duplicates("node_id", keep="last").set_index("node_id")["node_label"]
+        self.node_labels.update(labels.fillna(labels.index.to_series()).to_dict())
+        timestamps = df["timestamp"].dropna().astype(str)
+        if not timestamps.empty:
+            self.time_watermark = max(self.time_watermark, timestamps.max())
+        ts = add_time_column(df)["ts"].dropna()
+        if not ts.empty:
+            self.first_ts = ts.min() if self.first_ts is None else min(self.first_ts, ts.min())
+            self.last_ts = ts.max() if self.last_ts is None else max(self.last_ts, ts.max())
+    
+    def by_category(self):
+        """按当前图谱的节点类别汇总访问次数（图谱编辑后类别随之更新）"""
+        counts = Counter()
+        for node_id, count in self.by_node.items():
+            counts[self.node_categories.get(node_id, "其他")] += count
+        return counts
+    
+    def data_key(self):
+        """数据版本（数据代次 + 记录数 + 最新时间戳），用于分析缓存和导出文件复用"""
+        return hashlib.sha1(f"{self.generation}|{self.records}|{self.time_watermark}".encode("utf-8")).hexdigest()[:12]
+
+# ==================== 交互记录增量消费 ====================
+class InteractionFeed:
+    """交互记录的共享增量消费者：首次全量读取一次，之后只读取新记录，同时累加访问统计、学习路径和节点热度。
+    有发件箱时按序号水位线增量读取（全量读取只包含水位线之前的记录，两者不重叠）；
+    否则按时间戳回看一个窗口轮询存储后端，按 interaction_id 去重"""
+    
+    def __init__(self, generation):
+        self.generation = generation
+        self._reset({})
+        self.seeded = False
+        self.lock = threading.Lock()
+    
+    def _reset(self, node_categories):
+        self.metrics = InteractionMetrics(node_categories, self.generation)
+        self.flow = TransitionAggregator()
+        self.popularity = NodePopularityIndex()
+        self.seq_watermark = 0
+        self.time_watermark = None  # 无发件箱时：已读取记录的最晚时间（秒）
+        self.recent_ids = {}  # 无发件箱时：回看窗口内已读取的记录 interaction_id -> 时间
+    
+    def refresh(self, store, node_categories):
+        """读取新记录并累加，返回本次新增的记录数（首次全量读取返回0）"""
+        outbox = get_outbox()
+        with self.lock:
+            self.metrics.node_categories = node_categories
+            if not self.seeded:
+                self._seed(store, outbox)
+                self.seeded = True
+                return 0
+            if outbox:
+                added = 0
+                rows = outbox.since(self.seq_watermark, LIVE_BATCH_LIMIT)
+                first = rows[0][0] if rows else outbox.last_seq() + 1
+                if first > self.seq_watermark + 1:
+                    # 水位线之后的记录读取前已被清理（长时间没有刷新），重新全量读取
+                    self._reset(node_categories)
+                    self._seed(store, outbox)
+                    return 0
+                while rows:
+                    self._apply([record for _, record in rows])
+                    added += len(rows)
+                    self.seq_watermark = rows[-1][0]
+                    rows = outbox.since(self.seq_watermark, LIVE_BATCH_LIMIT)
+                return added
+            records = self._poll_store(store)
+            self._apply(records)
+            self._track(records)
+            return len(records)
+    
+    def _seed(self, store, outbox):
+        import pandas as pd
+        
+        if outbox:
+            self.seq_watermark = outbox.last_seq()
+        for chunk in iter_interaction_chunks(store, ordered=True, until_seq=self.seq_watermark if outbox else None):
+            self.metrics.apply_frame(normalize_count_column(pd.DataFrame(chunk, columns=INTERACTION_FIELDS)))
+            self.flow.apply(chunk)
+            self.popularity.apply(chunk)
+            if not outbox:
+                self._track(chunk)
+    
+    def export_source(self, store):
+        """与 metrics.data_key() 同时取得导出的数据版本，导出任务只读取到该版本为止的记录"""
+        with self.lock:
+            source = {"store": store, "generation": self.generation, "until_seq": None, "until_time": None}
+            if get_outbox():
+                source["until_seq"] = self.seq_watermark
+            else:
+                source["until_time"] = self.time_watermark
+            return self.metrics.data_key(), source
+    
+    def _apply(self, records):
+        if records:
+            self.metrics.apply(records)
+            self.flow.apply(records)
+            self.popularity.apply(records)
+    
+    def _poll_store(self, store):
+        """读取回看窗口之后的记录，去掉已读取过的（会话缓冲写入的记录时间戳可能早于水位线）"""
+        if self.time_watermark is None:
+            return []
+        fresh = []
+        after = self.time_watermark - FEED_LOOKBACK_SECONDS
+        while True:
+            rows = store.interactions_after(datetime.fromtimestamp(after).astimezone().isoformat(), LIVE_BATCH_LIMIT)
+            fresh.extend(record for record in rows if record.get("interaction_id") not in self.recent_ids)
+            last = parse_record_time(rows[-1]["timestamp"]) if rows else None
+            if len(rows) < LIVE_BATCH_LIMIT or last is None or last <= after:
+                return fresh
+            after = last
+    
+    def _track(self, records):
+        """记下回看窗口内已读取的记录ID，窗口之前的随水位线前移丢弃"""
+        for record in records:
+            at = parse_record_time(record.get("timestamp"))
+            if at is None or record.get("action_type") == "daily_rollup":
+                continue
+            self.time_watermark = at if self.time_watermark is None else max(self.time_watermark, at)
+            if record.get("interaction_id"):
+                self.recent_ids[record["interaction_id"]] = at
+        if self.time_watermark is not None:
+            cutoff = self.time_watermark - FEED_LOOKBACK_SECONDS
+            self.recent_ids = {key: at for key, at in self.recent_ids.items() if at >= cutoff}
+
+@st.cache_resource(max_entries=1)
+def get_interaction_feed(generation):
+    """进程内共享的增量消费者；数据代次变化（清除、压缩记录）后重新全量读取"""
+    return InteractionFeed(generation)
+
+def refresh_interaction_feed(store, node_categories):
+    """读取新记录后返回共享的消费者（读取其中的统计时需持有 feed.lock）"""
+    feed = get_interaction_feed(get_data_generation().value)
+    feed.refresh(store, node_categories)
+    return feed
+
+def render_interaction_metrics(metrics, delta=None):
+    """根据累计统计渲染指标、排行和类别分布"""
+    import pandas as pd
     
     col1, col2, col3, col4 = st.columns(4)
     with col1:
-        total_visits = len(df)
-        st.metric("总访问次数", total_visits)
+        st.metric("总访问次数", metrics.total, delta=delta or None)
     with col2:
-        unique_students = df["student_id"].nunique()
-        st.metric("学习学生数", unique_students)
+        st.metric("学习学生数", len(metrics.by_student))
     with col3:
-        unique_nodes = df["node_id"].nunique()
-        st.metric("被访问节点数", unique_nodes)
+        st.metric("被访问节点数", len(metrics.by_node))
     with col4:
-        avg_duration = df[df["duration"] > 0]["duration"].mean()
-        st.metric("平均浏览时长(秒)", f"{avg_duration:.1f}" if pd.notna(avg_duration) else "N/A")
-    
-    st.divider()
+        avg_duration = metrics.duration_sum / metrics.duration_records if metrics.duration_records else None
+        st.metric("平均浏览时长(秒)", f"{avg_duration:.1f}" if avg_duration is not None else "N/A")
     
-    # 节点访问热度
     col_left, col_right = st.columns(2)
-    
     with col_left:
         st.markdown("### 🔥 节点访问热度排行")
-        node_counts = df.groupby(["node_id", "node_label"]).size().reset_index(name="访问次数")
-        node_counts = node_counts.sort_values("访问次数", ascending=False).head(10)
-        
         st.dataframe(
-            node_counts[["node_label", "访问次数"]].rename(columns={"node_label": "节点名称"}),
+            pd.DataFrame(
+                [(metrics.node_labels[node_id], count) for node_id, count in metrics.by_node.most_common(10)],
+                columns=["节点名称", "访问次数"]
+            ),
             use_container_width=True,
             hide_index=True
         )
-    
     with col_right:
         st.markdown("### 👥 学生活跃度排行")
-        student_counts = df.groupby("student_id").size().reset_index(name="访问次数")
-        student_counts = student_counts.sort_values("访问次数", ascending=False).head(10)
-        
         st.dataframe(
-            student_counts.rename(columns={"student_id": "学号"}),
+            pd.DataFrame(metrics.by_student.most_common(10), columns=["学号", "访问次数"]),
             use_container_width=True,
             hide_index=True
         )
     
-    st.divider()
-    
-    # 类别分布
     st.markdown("### 📊 知识类别访问分布")
+    by_category = metrics.by_category()
+    if by_category:
+        st.bar_chart(pd.Series(by_category, name="访问次数"))
+
+def live_dashboard(store, json_data):
+    """实时模式：定时拉取增量并刷新统计，不重新查询全部数据"""
+    node_categories = {node["id"]: node["category"] for node in json_data.get("nodes", [])}
+    
+    def refresh():
+        feed = refresh_interaction_feed(store, node_categories)
+        with feed.lock:
+            metrics = feed.metrics
+            # 统计由各会话共享，“本次新增”按本会话上次看到的数值计算
+            generation, records, total = st.session_state.get("live_seen", (None, metrics.records, metrics.total))
+            if generation != feed.generation:
+                records, total = metrics.records, metrics.total
+            st.session_state.live_seen = (feed.generation, metrics.records, metrics.total)
+            st.caption(f"🔴 实时更新中（每 {LIVE_REFRESH_SECONDS} 秒），本次新增 {metrics.records - records} 条，更新于 {datetime.now().strftime('%H:%M:%S')}")
+            render_interaction_metrics(metrics, metrics.total - total)
+    
+    fragment = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None)
+    if fragment is None:
+        # 旧版Streamlit没有局部定时刷新，改为手动刷新
+        st.button("🔄 刷新")
+        refresh()
+    else:
+        fragment(run_every=LIVE_REFRESH_SECONDS)(refresh)()
+
+# ==================== 图谱编辑面板 ====================
+GRAPH_EDIT_ACTIONS = {
+    "add_node": "新增节点",
+    "update_node": "修改节点",
+    "remove_node": "删除节点",
+    "add_relationship": "新增关系",
+    "remove_relationship": "删除关系"
+}
+
+def parse_properties_input(text):
+    """解析属性输入框中的JSON对象"""
+    try:
+        value = json.loads(text or "{}")
+    except json.JSONDecodeError as e:
+        raise ValueError(f"属性不是合法的JSON: {e}")
+    if not isinstance(value, dict):
+        raise ValueError("属性必须是JSON对象")
+    return value
+
+def render_graph_editor(store, snapshot):
+    """图谱编辑：每次提交一个补丁，基于本页加载时的版本做并发检查，成功后增量同步到存储和已打开的图谱页"""
+    graph_store = get_graph_store()
+    json_data = snapshot["json_data"]
+    nodes = {node["id"]: node for node in json_data.get("nodes", [])}
+    node_ids = list(nodes)
+    categories = list(dict.fromkeys(list(CATEGORY_COLORS) + [node["category"] for node in nodes.values()]))
     
-    # 合并节点类别信息
+    st.caption(f"当前编辑基于版本 {snapshot['version']}；提交时若同一节点或关系已被其他人修改，会提示刷新后重试")
+    action = st.selectbox("操作", options=list(GRAPH_EDIT_ACTIONS), format_func=GRAPH_EDIT_ACTIONS.get, key="graph_edit_action")
+    target = None
+    if action in ("update_node", "remove_node"):
+        target = st.selectbox("节点", options=node_ids, format_func=lambda node_id: f"{nodes[node_id]['label']} ({node_id})", key="graph_edit_node")
+    elif action == "remove_relationship":
+        relationships = json_data.get("relationships", [])
+        target = st.selectbox(
+            "关系",
+            options=range(len(relationships)),
+            format_func=lambda i: f"{nodes.get(relationships[i]['source'], {}).get('label', relationships[i]['source'])}"
+                                  f" —{relationships[i].get('type', '关联')}→ "
+                                  f"{nodes.get(relationships[i]['target'], {}).get('label', relationships[i]['target'])}",
+            key="graph_edit_relationship"
+        )
+    
+    with st.form(f"graph_edit_form_{action}_{target}", clear_on_submit=False):
+        ops = []
+        if action in ("add_node", "update_node"):
+            current = nodes.get(target, {}) if action == "update_node" else {}
+            node_id = st.text_input("节点ID", value=current.get("id", ""), disabled=action == "update_node")
+            label = st.text_input("名称", value=current.get("label", ""))
+            category = st.selectbox("类别", options=categories,
+                                    index=categories.index(current["category"]) if current.get("category") in categories else 0)
+            level = st.number_input("层级", min_value=1, max_value=9, value=int(current.get("level", 1)), step=1)
+            node_type = st.text_input("类型", value=current.get("type", ""))
+            properties = st.text_area("属性（JSON）", value=json.dumps(current.get("properties", {}), ensure_ascii=False, indent=2))
+        elif action == "add_relationship":
+            source = st.selectbox("起点", options=node_ids, format_func=lambda node_id: nodes[node_id]["label"])
+            rel_target = st.selectbox("终点", options=node_ids, format_func=lambda node_id: nodes[node_id]["label"])
+            rel_type = st.text_input("关系类型", value="关联")
+            properties = st.text_area("属性（JSON）", value="{}")
+        submitted = st.form_submit_button(f"提交：{GRAPH_EDIT_ACTIONS[action]}")
+    
+    if submitted:
+        try:
+            if action == "add_node":
+                ops.append({"op": "add_node", "node": {
+                    "id": node_id.strip(), "label": label.strip(), "category": category, "level": int(level),
+                    "type": node_type.strip(), "properties": parse_properties_input(properties)
+                }})
+            elif action == "update_node" and target is not None:
+                ops.append({"op": "update_node", "id": target, "fields": {
+                    "label": label.strip(), "category": category, "level": int(level),
+                    "type": node_type.strip(), "properties": parse_properties_input(properties)
+                }})
+            elif action == "remove_node" and target is not None:
+                ops.append({"op": "remove_node", "id": target})
+            elif action == "add_relationship":
+                ops.append({"op": "add_relationship", "relationship": {
+                    "source": source, "target": rel_target, "type": rel_type.strip() or "关联",
+                    "properties": parse_properties_input(properties)
+                }})
+            elif action == "remove_relationship" and target is not None:
+                rel = json_data["relationships"][target]
+                ops.append({"op": "remove_relationship", "relationship": {
+                    "source": rel["source"], "target": rel["target"], "type": rel.get("type", "关联")
+                }})
+            if action == "add_node" and not (ops[0]["node"]["id"] and ops[0]["node"]["label"]):
+                raise ValueError("节点ID和名称不能为空")
+            new_snapshot = graph_store.apply_patch(snapshot["version"], ops, store=store, author="管理员")
+        except GraphConflictError as e:
+            st.error(f"❌ {e}")
+        except (ValueError, OSError) as e:
+            st.error(f"❌ 编辑失败: {e}")
+        else:
+            st.session_state.graph_edit_notice = f"✅ 已保存，图谱版本 {new_snapshot['version']}"
+            st.rerun()
+    
+    notice = st.session_state.pop("graph_edit_notice", None)
+    if notice:
+        st.success(notice)
+    if graph_store.sync_error:
+        st.warning(f"⚠️ 编辑已保存，但同步到存储后端失败（{graph_store.sync_error}），可使用“重新初始化知识图谱”整体同步")
+    if graph_store.history:
+        # 编辑面板本身位于折叠区内，这里不能再嵌套折叠区
+        st.markdown(f"**📝 最近的编辑（{len(graph_store.history)}）**")
+        for entry in reversed(graph_store.history[-10:]):
+            summary = "整体替换" if entry["ops"] is None else "，".join(
+                f"{GRAPH_EDIT_ACTIONS[op['op']]} {'、'.join(sorted(touched_keys([op])))}" for op in entry["ops"]
+            )
+            st.caption(f"{entry['at']} · {entry['author']} · {entry['base']} → {entry['version']} · {summary}")
+
+# ==================== 管理端页面 ====================
+def admin_page(store, snapshot):
+    """管理端：查看学生访问数据"""
+    import pandas as pd
+    
+    json_data = snapshot["json_data"]
+    st.title("📊 管理端 - 学生学习数据分析")
+    
+    # 显示数据来源信息
+    st.info(f"📡 数据来源: {store.describe()}")
+    
+    # 加载时未通过校验的图谱记录（已隔离，不参与显示和导入）
+    quarantine = json_data.get("quarantine", [])
+    if quarantine:
+        st.warning(
+            f"⚠️ 知识图谱中有 {len(quarantine)} 条记录未通过校验，已隔离（不显示、不导入数据库）。"
+            f"请在JSON文件的 quarantine 字段中查看并修正后移回 nodes/relationships"
+        )
+        with st.expander(f"🧪 隔离的记录（{len(quarantine)}）", expanded=False):
+            st.dataframe(
+                pd.DataFrame([{
+                    "类型": "节点" if item["kind"] == "node" else "关系",
+                    "原因": item["reason"],
+                    "记录": json.dumps(item["record"], ensure_ascii=False)
+                } for item in quarantine]),
+                use_container_width=True,
+                hide_index=True
+            )
+    
+    # 发件箱同步状态
+    outbox = get_outbox()
+    if outbox:
+        replay_status = start_outbox_replayer(store, outbox).status()
+        st.caption(
+            f"🔄 待同步到存储: {replay_status['pending']} 条"
+            f"（最早等待 {replay_status['oldest_age']} 秒），累计已同步 {replay_status['delivered_total']} 条"
+            + (f"，最近同步 {replay_status['last_success_at']}" if replay_status['last_success_at'] else "")
+        )
+        if replay_status["last_error"]:
+            st.caption(f"⚠️ 最近一次同步失败: {replay_status['last_error']}")
+        if replay_status["last_write_ms"] is not None:
+            st.caption(f"📦 当前同步批大小 {replay_status['batch_size']} 条，最近一批写入耗时 {replay_status['last_write_ms']} ms")
+    
+    # 写入限流统计
+    limiter = get_ingestion_limiter()
+    if limiter.dropped_total():
+        top_dropped = "、".join(f"{student_id}（{count}）" for student_id, count in limiter.dropped_by_student.most_common(5))
+        st.caption(
+            f"🚦 写入限流：已接收 {limiter.stats['admitted']} 条，丢弃 {limiter.dropped_total()} 条"
+            f"（超过个人或会话速率 {limiter.stats['dropped_student']}，超过全局速率 {limiter.stats['dropped_global']}，"
+            f"浏览器单次提交过多 {limiter.stats['dropped_client']}）；丢弃最多：{top_dropped}"
+        )
+    
+    # 启动性能（各阶段距脚本开始的毫秒数）
+    with st.expander("⏱️ 启动性能", expanded=False):
+        boot_metrics = get_boot_metrics()
+        st.caption(f"图谱快照版本 {snapshot['version']}，生成于 {snapshot.get('built_at', '-')}")
+        pool_stats = get_worker_pool().stats
+        st.caption(
+            f"进程池（{WORKER_PROCESSES} 个进程）：提交 {pool_stats['submitted']} 次，"
+            f"共用计算中的相同任务 {pool_stats['shared']} 次，退回当前线程 {pool_stats['inline']} 次"
+        )
+        for title, key in (("冷启动（进程内首次运行）", "cold"), ("最近一次运行", "last")):
+            if boot_metrics[key]:
+                st.markdown(f"**{title}**")
+                st.json(boot_metrics[key])
+    
+    # 图谱编辑（多人同时编辑时按版本检测冲突；没有访问记录时也需要可用）
+    with st.expander("✏️ 知识图谱编辑", expanded=False):
+        render_graph_editor(store, snapshot)
+    
+    # 实时模式：只拉取增量，不重新计算全部统计
+    if st.toggle("🔴 实时模式", key="live_mode", help="开启后定时拉取新增访问记录并增量更新统计"):
+        live_dashboard(store, json_data)
+        return
+    st.session_state.pop("live_seen", None)
+    
+    # 访问统计、学习路径和节点热度由共享的增量消费者累计（进程内只全量读取一次，之后只读新记录）
     node_categories = {node["id"]: node["category"] for node in json_data.get("nodes", [])}
-    df["category"] = df["node_id"].map(node_categories)
+    feed = refresh_interaction_feed(store, node_categories)
+    metrics = feed.metrics
+    
+    # 调试信息
+    st.caption(f"共获取到 {metrics.records} 条记录")
+    
+    if not metrics.records:
+        st.warning("暂无学生访问数据。请先在学生端浏览知识图谱，数据会自动记录。")
+        
+        # 显示本地存储状态
+        local = store.mirror or store
+        if local.path:
+            st.info(f"📁 本地存储 {local.path} 中有 {local.count()} 条原始记录")
+        
+        # 提供初始化数据选项
+        if store.available() and st.button("🔄 初始化知识图谱数据到存储"):
+            with st.spinner("正在导入数据..."):
+                if store.save_graph(json_data):
+                    store.init_schema()
+                    st.success("✅ 数据初始化成功！")
+                else:
+                    st.error("❌ 数据初始化失败")
+        return
+    
+    # 整体统计
+    st.markdown("## 📈 整体数据统计")
+    with feed.lock:
+        render_interaction_metrics(metrics)
+        all_students = list(metrics.by_student)
     
-    category_counts = df.groupby("category").size().reset_index(name="访问次数")
+    st.divider()
     
-    # 使用柱状图
-    st.bar_chart(category_counts.set_index("category")["访问次数"])
+    # 时序与群体分析
+    node_labels = {node["id"]: node["label"] for node in json_data.get("nodes", [])}
+    render_time_analytics(store, metrics, node_categories, node_labels)
     
     st.divider()
     
     # 个人数据查询
     st.markdown("## 👤 个人学习数据查询")
     
-    all_students = df["student_id"].unique().tolist()
     selected_student = st.selectbox("选择学生学号", options=all_students)
     
     if selected_student:
-        student_data = df[df["student_id"] == selected_student]
+        student_data = normalize_count_column(pd.DataFrame(
+            get_student_interactions(store, selected_student), columns=INTERACTION_FIELDS
+        ))
         
         col1, col2, col3 = st.columns(3)
         with col1:
             st.metric("访问节点数", student_data["node_id"].nunique())
         with col2:
-            st.metric("总访问次数", len(student_data))
+            st.metric("总访问次数", int(student_data["count"].sum()))
         with col3:
             total_duration = student_data[student_data["duration"] > 0]["duration"].sum()
             st.metric("总学习时长(秒)", int(total_duration))
         
         st.markdown("#### 📜 访问记录")
         st.dataframe(
-            student_data[["node_label", "action_type", "duration", "timestamp"]].rename(columns={
+            student_data[["node_label", "action_type", "count", "duration", "timestamp"]].rename(columns={
                 "node_label": "节点名称",
                 "action_type": "操作类型",
+                "count": "查看次数",
                 "duration": "浏览时长(秒)",
                 "timestamp": "时间"
             }),
             use_container_width=True,
             hide_index=True
         )
-        
-        # 学习路径可视化
-        st.markdown("#### 🛤️ 学习路径")
-        path_nodes = student_data["node_label"].tolist()
-        if len(path_nodes) > 1:
-            path_str = " → ".join(path_nodes[:20])  # 最多显示20个
-            if len(path_nodes) > 20:
-                path_str += " → ..."
-            st.markdown(f"```\n{path_str}\n```")
-        else:
-            st.info("学习路径数据不足")
+    
+    st.divider()
+    
+    # 节点热度图
+    render_heatmap_section(feed, snapshot)
+    
+    st.divider()
+    
+    # 学习路径流向（全班或选定学生群体的节点转移汇总）
+    st.markdown("## 🛤️ 学习路径流向")
+    col1, col2 = st.columns([3, 1])
+    with col1:
+        cohort = st.multiselect("学生群体（留空为全体学生）", options=all_students, key="flow_cohort")
+    with col2:
+        min_count = st.number_input("最少转移次数", min_value=1, value=1, step=1)
+    with feed.lock:
+        flows = feed.flow.flows(cohort)
+    overlay_edges = build_flow_overlay(flows, min_count=int(min_count))
+    if overlay_edges:
+        st.caption(f"红色曲线为学生在节点间的跳转，线越粗表示越多学生走过（显示前 {len(overlay_edges)} 条）")
+        render_flow_graph(snapshot, overlay_edges)
+    else:
+        st.info("学习路径数据不足")
+    
+    st.divider()
+    
+    # 报表导出（后台生成，不阻塞页面）
+    st.markdown("## 📦 数据导出")
+    render_export_panel(snapshot, *feed.export_source(store))
     
     st.divider()
     
@@ -1016,15 +4595,15 @@ def admin_page(conn, json_data):
     with col1:
         if st.button("� 重新初始化知识图谱"):
             with st.spinner("正在重新导入数据..."):
-                if init_neo4j_data(conn, json_data):
+                if store.save_graph(json_data):
                     st.success("✅ 知识图谱数据已重新初始化")
                 else:
                     st.error("❌ 初始化失败")
     
     with col2:
         if st.button("�️ 清除所有访问记录", type="secondary"):
-            if conn.driver:
-                conn.execute_write(f"MATCH (n:Interaction_{TARGET_LABEL}) DELETE n")
+            if store.available():
+                clear_interaction_records(store)
                 st.success("✅ 访问记录已清除")
                 st.rerun()
     
@@ -1033,22 +4612,31 @@ def admin_page(conn, json_data):
             st.warning("⚠️ 此操作将清除所有现有数据！")
             if st.checkbox("我确认要清除所有数据并创建新仓库"):
                 with st.spinner("正在清除数据..."):
-                    # 清除Neo4j数据
-                    if clear_all_data(conn):
-                        st.success("✅ Neo4j数据已清除")
-                    
-                    # 清除本地文件
-                    if clear_local_files():
-                        st.success("✅ 本地文件已清除")
-                    
-                    # 创建新的空白数据仓库
-                    new_data = create_new_data_warehouse()
-                    if save_json_data(new_data):
+                    # 先原子替换为空白图谱（其他会话下次运行时拿到新版本），成功后再清除旧数据
+                    try:
+                        get_graph_store().replace(create_new_data_warehouse(), snapshot["version"], author="管理员")
+                    except (GraphConflictError, OSError) as e:
+                        st.error(f"❌ 创建新数据仓库失败: {e}")
+                    else:
+                        # 清除存储后端数据
+                        if clear_all_data(store):
+                            st.success(f"✅ {store.describe()}中的数据已清除")
+                        
+                        # 清除本地文件
+                        if clear_local_files(store):
+                            st.success("✅ 本地文件已清除")
+                        
                         st.success("✅ 新数据仓库已创建")
-                        st.info("📝 请编辑 JSON 文件来添加节点和关系")
+                        st.info("📝 请在“知识图谱编辑”中添加节点和关系")
                         st.rerun()
-                    else:
-                        st.error("❌ 创建新数据仓库失败")
+    
+    # 历史记录压缩：旧的原始记录汇总为每日聚合，存储量不随学期累积而增长
+    st.markdown("### 🧹 历史访问记录压缩")
+    retention_days = st.number_input("原始记录保留天数", min_value=1, value=INTERACTION_RETENTION_DAYS, step=1)
+    if st.button("压缩历史访问记录"):
+        with st.spinner("正在汇总并分批删除旧记录..."):
+            stats = compact_interactions(store, int(retention_days))
+        st.success(f"✅ 已压缩存储后端记录 {stats['compacted']} 条、本地副本记录 {stats['local_compacted']} 条")
 
 # ==================== 主程序入口 ====================
 def main():
@@ -1091,14 +4679,19 @@ def main():
     </style>
     """, unsafe_allow_html=True)
     
-    # 加载JSON数据
-    json_data = load_json_data()
-    if not json_data:
+    # 加载当前版本的图谱快照（含解析后的图谱和预渲染HTML）；本次运行全程使用同一份不可变快照
+    graph_store = get_graph_store()
+    snapshot = graph_store.snapshot if graph_store else None
+    if not snapshot:
         st.error("无法加载知识图谱数据，请检查JSON文件")
         return
+    mark_stage("snapshot_loaded")
     
-    # 连接Neo4j
-    conn = Neo4jConnection(NEO4J_URI, NEO4J_USER, NEO4J_PASSWORD)
+    # 存储后端（Neo4j连接在首次使用时才建立，不阻塞首屏）
+    store = get_interaction_store()
+    outbox = get_outbox()
+    if outbox:
+        start_outbox_replayer(store, outbox)
     
     # 侧边栏导航
     st.sidebar.title("🧭 导航")
@@ -1110,7 +4703,7 @@ def main():
     )
     
     if page == "🎓 学生端":
-        student_page(conn, json_data)
+        student_page(store, snapshot)
     else:
         # 管理端需要密码验证
         st.sidebar.markdown("---")
@@ -1118,16 +4711,13 @@ def main():
         
         if password == ADMIN_PASSWORD:
             st.sidebar.success("✅ 验证成功")
-            admin_page(conn, json_data)
+            admin_page(store, snapshot)
         elif password:
             st.sidebar.error("❌ 密码错误")
             st.warning("请输入正确的管理员密码")
         else:
             st.info("👈 请在侧边栏输入管理员密码")
     
-    # 关闭数据库连接
-    conn.close()
-    
     # 页脚
     st.sidebar.markdown("---")
     st.sidebar.markdown("""
@@ -1137,6 +4727,30 @@ def main():
         <p>© 2025</p>
     </div>
     """, unsafe_allow_html=True)
+    
+    mark_stage("run_done")
+    finish_run_timing()
+
+def compact_cli():
+    """命令行压缩历史访问记录（可由定时任务执行：python xjygraph.py --compact）"""
+    store = get_interaction_store()
+    stats = compact_interactions(store)
+    print(f"✅ 压缩完成: 存储后端 {stats['compacted']} 条, 本地副本 {stats['local_compacted']} 条")
+    store.close()
+
+def build_snapshot_cli():
+    """命令行预编译快照（部署时执行：python xjygraph.py --build-snapshot）"""
+    t0 = time.perf_counter()
+    snapshot, error = load_or_build_snapshot(force=True)
+    if error:
+        print(error)
+        sys.exit(1)
+    print(f"✅ 快照已生成: {SNAPSHOT_FILE} (版本 {snapshot['version']}, 耗时 {(time.perf_counter() - t0) * 1000:.0f} ms)")
 
 if __name__ == "__main__":
-    main()
+    if "--build-snapshot" in sys.argv:
+        build_snapshot_cli()
+    elif "--compact" in sys.argv:
+        compact_cli()
+    else:
+        main()